@@ -0,0 +1,238 @@
+# 后端健康检查与熔断器：Ollama / MCP 等后端共用
+# - 健康状态按 TTL 缓存，同一进程内多次构造客户端不会重复探测
+# - 连续失败达到阈值后熔断，熔断期间请求立即失败，不再阻塞等待超时
+# - 熔断冷却后只放行一个试探请求（半开），成功则恢复
+# - 熔断后由后台线程定期探测，恢复后停止；也可调用 start_background_probe 常驻探测
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional, Any, Callable, Iterator
+
+import requests
+
+from HttpClient import HttpClient, get_client
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """后端处于熔断状态，请求被直接拒绝"""
+
+
+def is_backend_failure(error: BaseException) -> bool:
+    """判断异常是否说明后端不可用（连接失败、超时或 5xx）"""
+    if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+        return error.response.status_code >= 500
+    return False
+
+
+class BackendHealth:
+    def __init__(
+        self,
+        name: str,
+        health_url: str,
+        ttl: float = 30,
+        failure_threshold: int = 3,
+        reset_timeout: float = 15,
+        probe_timeout: float = 2,
+        http: Optional[HttpClient] = None,
+        probe_interval: Optional[float] = None,
+    ):
+        """初始化后端健康状态
+
+        Args:
+            name: 后端名称，用于日志
+            health_url: 健康检查地址，返回 200 视为健康
+            ttl: 健康检查结果的缓存时间（秒）
+            failure_threshold: 连续失败多少次后熔断
+            reset_timeout: 熔断后多久允许一次试探请求（秒）
+            probe_timeout: 健康检查的超时时间（秒）
+            http: HTTP 客户端，默认使用全局共享的连接池
+            probe_interval: 熔断后在后台按该间隔（秒）探测，恢复后停止；为 None 时不在后台探测
+        """
+        self.name = name
+        self.health_url = health_url
+        self.ttl = ttl
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.probe_timeout = probe_timeout
+        self.http = http or get_client()
+        self.probe_interval = probe_interval
+
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.last_payload: Any = None
+        self._healthy: Optional[bool] = None
+        self._checked_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+        self._probe_thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+
+    def probe(self) -> bool:
+        """立即探测一次健康状态并更新缓存与熔断状态"""
+        try:
+            response = self.http.get(self.health_url, timeout=self.probe_timeout, retries=0)
+            healthy = response.status_code == 200
+            if healthy:
+                try:
+                    self.last_payload = response.json()
+                except ValueError:
+                    self.last_payload = None
+        except requests.exceptions.RequestException:
+            healthy = False
+
+        with self._lock:
+            self._healthy = healthy
+            self._checked_at = time.monotonic()
+        if healthy:
+            self.record_success()
+        else:
+            self.record_failure()
+        return healthy
+
+    def is_healthy(self, force: bool = False) -> bool:
+        """返回后端是否可用，优先使用缓存结果
+
+        熔断期间在冷却时间结束前直接返回 False，不发起探测。
+        """
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            fresh = self._healthy is not None and time.monotonic() - self._checked_at < self.ttl
+            if fresh and not force:
+                return self._healthy
+        return self.probe()
+
+    def allow_request(self) -> bool:
+        """熔断器是否放行当前请求；半开状态下同一时间只放行一个试探请求"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = HALF_OPEN
+            if self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.state != CLOSED:
+                print(f"[{self.name}] 后端已恢复")
+            self.state = CLOSED
+            self.failures = 0
+            self._trial_in_flight = False
+            self._healthy = True
+            self._checked_at = time.monotonic()
+
+    def record_failure(self) -> None:
+        opened = False
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            self._healthy = False
+            self._checked_at = time.monotonic()
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    print(f"[{self.name}] 连续失败 {self.failures} 次，熔断 {self.reset_timeout} 秒")
+                    opened = True
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+        if opened and self.probe_interval:
+            self.start_background_probe(self.probe_interval, until_healthy=True)
+
+    @contextmanager
+    def guard(self) -> Iterator[None]:
+        """包裹一次对后端的调用：熔断时立即抛出 CircuitOpenError，并根据结果更新状态"""
+        if not self.allow_request():
+            raise CircuitOpenError(f"{self.name} 暂不可用（熔断中），请稍后再试")
+        try:
+            yield
+        except BaseException as e:
+            if is_backend_failure(e):
+                self.record_failure()
+            else:
+                self._release_trial()
+            raise
+        else:
+            self.record_success()
+
+    def _release_trial(self) -> None:
+        with self._lock:
+            self._trial_in_flight = False
+
+    def call(self, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """在熔断器保护下调用 func"""
+        with self.guard():
+            return func(*args, **kwargs)
+
+    def start_background_probe(self, interval: float = 10, until_healthy: bool = False) -> None:
+        """启动后台探测线程，定期刷新健康状态（熔断后也会自动探测恢复）
+
+        Args:
+            interval: 探测间隔（秒）
+            until_healthy: 探测成功后停止线程（熔断后自动启动时使用）
+        """
+        if self._probe_thread and self._probe_thread.is_alive():
+            return
+        self._stop_event.clear()
+
+        def loop() -> None:
+            while not self._stop_event.wait(interval):
+                if self.probe() and until_healthy:
+                    break
+
+        self._probe_thread = threading.Thread(target=loop, name=f"health-{self.name}", daemon=True)
+        self._probe_thread.start()
+
+    def stop_background_probe(self) -> None:
+        self._stop_event.set()
+
+
+_backends: Dict[str, BackendHealth] = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend(name: str, health_url: str, probe_interval: Optional[float] = None, **kwargs: Any) -> BackendHealth:
+    """获取进程内共享的 BackendHealth（按健康检查地址区分）
+
+    Args:
+        name: 后端名称
+        health_url: 健康检查地址
+        probe_interval: 指定时熔断后在后台按该间隔（秒）探测恢复；获取时不启动探测线程
+        **kwargs: 首次创建时传给 BackendHealth 的参数
+    """
+    with _backends_lock:
+        if health_url not in _backends:
+            _backends[health_url] = BackendHealth(name, health_url, probe_interval=probe_interval, **kwargs)
+        backend = _backends[health_url]
+        if probe_interval and not backend.probe_interval:
+            backend.probe_interval = probe_interval
+    return backend
+
+
+def ollama_backend(base_url: str) -> BackendHealth:
+    """Ollama 服务的共享健康状态，使用 /api/tags 作为健康检查地址，熔断后后台每 10 秒探测一次直到恢复"""
+    return get_backend("ollama", f"{base_url}/api/tags", probe_interval=10)
+
+
+if __name__ == "__main__":
+    # 演示：后端不可用时，熔断后的请求立即失败而不是等待超时
+    backend = BackendHealth("demo", "http://127.0.0.1:9/health", failure_threshold=2, reset_timeout=5)
+    for i in range(5):
+        start = time.perf_counter()
+        try:
+            backend.call(backend.http.get, "http://127.0.0.1:9/api", timeout=2, retries=0)
+        except requests.exceptions.ConnectionError as e:
+            print(f"第{i + 1}次请求失败（{type(e).__name__}），耗时 {(time.perf_counter() - start) * 1000:.1f} ms")
+    start = time.perf_counter()
+    print(f"缓存的健康状态: {backend.is_healthy()}，耗时 {(time.perf_counter() - start) * 1000:.3f} ms")
@@ -7,6 +7,11 @@ import os
 import time
 from typing import List, Dict, Any, Optional
 import datetime
+from BackendHealth import ollama_backend
+from HttpClient import get_client
+from OllamaSession import OllamaChatSession, stable_window, DEFAULT_KEEP_ALIVE
+from WebSearch import WebSearch
+from SearchRouter import SearchRouter
 
 class ChatWithMemory:
     def __init__(
@@ -14,7 +19,9 @@ class ChatWithMemory:
         model_name: str = "deepseek-r1:7b", 
         base_url: str = "http://192.168.0.245:11434",
         memory_file: str = "chat_memory.json",
-        debug_mode: bool = False
+        debug_mode: bool = False,
+        keep_alive: Any = DEFAULT_KEEP_ALIVE,
+        search_budget: float = 3.0
     ):
         """初始化聊天机器人
 
@@ -23,27 +30,30 @@ class ChatWithMemory:
             base_url: Ollama API基础URL
             memory_file: 记忆存储文件路径
             debug_mode: 是否启用调试模式
+            keep_alive: 模型在Ollama中的驻留时间
+            search_budget: 搜索的最长等待时间（秒），超时使用已返回的部分结果
         """
         self.model_name = model_name
         self.base_url = base_url
         self.memory_file = memory_file
         self.debug_mode = debug_mode
         self.memory = self._load_memory()
+        self.http = get_client()
+        self.session = OllamaChatSession(model_name, base_url, keep_alive=keep_alive, http=self.http)
+        self.web_search = WebSearch(self._search_provider, max_results=3, budget=search_budget)
+        self.router = SearchRouter()
         
         # 检查Ollama服务是否可用
         self._check_ollama_availability()
         
     def _check_ollama_availability(self) -> None:
-        """检查Ollama服务是否可用"""
-        try:
-            response = requests.get(f"{self.base_url}/api/tags")
-            if response.status_code == 200:
-                if self.debug_mode:
-                    print(f"Ollama服务正常，可用模型: {', '.join([model['name'] for model in response.json().get('models', [])])}")
-            else:
-                print(f"警告: Ollama服务接口返回异常状态码: {response.status_code}")
-        except Exception as e:
-            print(f"警告: 无法连接到Ollama服务 ({self.base_url}): {str(e)}")
+        """检查Ollama服务是否可用（结果在进程内按TTL缓存，多次构造不会重复请求）"""
+        health = ollama_backend(self.base_url)
+        if health.is_healthy():
+            if self.debug_mode and health.last_payload:
+                print(f"Ollama服务正常，可用模型: {', '.join([model['name'] for model in health.last_payload.get('models', [])])}")
+        else:
+            print(f"警告: 无法连接到Ollama服务 ({self.base_url})")
             print("请确保Ollama服务正在运行，并且基础URL正确。")
 
     def _load_memory(self) -> Dict[str, List[Dict[str, str]]]:
@@ -67,30 +77,36 @@ class ChatWithMemory:
             print(f"保存记忆文件失败: {e}")
 
     def _get_recent_messages(self, conversation_id: str, limit: int = 10) -> List[Dict[str, str]]:
-        """获取最近的对话消息"""
+        """获取最近的对话消息（窗口起点按块跳动，保持发送给模型的前缀稳定）"""
         for conv in self.memory["conversations"]:
             if conv["id"] == conversation_id:
-                return conv["messages"][-limit:] if len(conv["messages"]) > limit else conv["messages"]
+                return stable_window(conv["messages"], limit)
         return []
 
-    def search_internet(self, query: str) -> str:
-        """搜索互联网获取信息
-        
+    def _search_provider(self, query: str, max_results: int):
+        """搜索提供方
+
         这里使用了一个简化的搜索实现，在实际应用中可以替换为真实的搜索API
         如Google Custom Search API, Bing Search API等
         """
-        try:
-            search_url = f"https://ddg-api.herokuapp.com/search?query={query}&limit=3"
-            response = requests.get(search_url)
-            
-            if response.status_code == 200:
-                results = response.json()
-                return "\n".join([f"标题: {r['title']}\n链接: {r['link']}\n摘要: {r['snippet']}\n" 
-                                for r in results])
-            else:
-                return f"搜索请求失败，状态码: {response.status_code}"
-        except Exception as e:
-            return f"搜索时发生错误: {str(e)}"
+        search_url = "https://ddg-api.herokuapp.com/search"
+        response = self.http.get(search_url, params={"query": query, "limit": max_results}, timeout=10)
+        if response.status_code != 200:
+            raise Exception(f"搜索请求失败，状态码: {response.status_code}")
+        for r in response.json():
+            yield {"title": r["title"], "link": r["link"], "snippet": r["snippet"]}
+
+    def search_internet(self, query: str) -> str:
+        """搜索互联网获取信息（限时并缓存，超时使用已返回的部分结果）"""
+        handle = self.web_search.search_async(query)
+        results = handle.wait(self.web_search.budget)
+        if not results:
+            if handle.error is not None:
+                return f"搜索时发生错误: {str(handle.error)}"
+            if not handle.done.is_set():
+                return "搜索超时，未获取到结果"
+        return "\n".join([f"标题: {r['title']}\n链接: {r['link']}\n摘要: {r['snippet']}\n"
+                          for r in results])
 
     def ask(self, user_message: str, conversation_id: Optional[str] = None) -> Dict[str, Any]:
         """向聊天机器人提问
@@ -111,8 +127,8 @@ class ChatWithMemory:
                 "messages": []
             })
         
-        # 检查是否需要搜索网络
-        need_search = "搜索" in user_message or "查询" in user_message
+        # 检查是否需要搜索网络（显式关键词或本地分类器判断需要检索）
+        need_search = self.router.route(user_message)["need_search"]
         search_results = ""
         
         if need_search:
@@ -139,81 +155,43 @@ class ChatWithMemory:
         
         # 调用Ollama API - 使用流式处理
         try:
-            # 使用stream=True启用流式处理
-            with requests.post(
-                f"{self.base_url}/api/chat",
-                json={
-                    "model": self.model_name,
-                    "messages": ollama_messages,
-                    "stream": True,  # 启用流式处理
-                },
-                stream=True
-            ) as response:
-                
-                if response.status_code == 200:
-                    # 收集完整的回答
-                    full_response = ""
-                    last_json = None
-                    
-                    # 逐行处理流式响应
-                    for line in response.iter_lines():
-                        if not line:
-                            continue
-                            
-                        try:
-                            # 解析当前行的JSON
-                            json_data = json.loads(line)
-                            last_json = json_data
-                            
-                            # 获取当前片段内容
-                            if "message" in json_data and "content" in json_data["message"]:
-                                content = json_data["message"]["content"]
-                                full_response += content
-                                
-                                # 如果启用了调试模式，可以显示流式内容
-                                # if self.debug_mode:
-                                #     print(f"收到片段: {content}", end="", flush=True)
-                            
-                            # 检查是否为最后一个响应
-                            if json_data.get("done", False):
-                                break
-                                
-                        except json.JSONDecodeError as je:
-                            if self.debug_mode:
-                                print(f"跳过非JSON行: {line}")
-                            continue
-                    
-                    if full_response:
-                        # 存储用户消息和机器人回复
-                        for conv in self.memory["conversations"]:
-                            if conv["id"] == conversation_id:
-                                conv["messages"].append({
-                                    "role": "user",
-                                    "content": user_message,
-                                    "timestamp": datetime.datetime.now().isoformat()
-                                })
-                                conv["messages"].append({
-                                    "role": "assistant",
-                                    "content": full_response,
-                                    "timestamp": datetime.datetime.now().isoformat()
-                                })
-                                break
-                        
-                        self._save_memory()
-                        
-                        return {
-                            "response": full_response,
-                            "conversation_id": conversation_id,
-                            "searched": need_search,
-                            "search_results": search_results if need_search else None
-                        }
-                    else:
-                        error_msg = "模型未返回任何内容"
-                        return {"error": error_msg, "conversation_id": conversation_id}
-                else:
-                    error_msg = f"API请求失败，状态码: {response.status_code}, 响应内容: {response.text[:300]}..."
-                    return {"error": error_msg, "conversation_id": conversation_id}
-        
+            full_response, timings = self.session.send(ollama_messages, stream=True)
+            if self.debug_mode:
+                print(f"prefill: {timings['prompt_eval_count']} tokens / {timings['prompt_eval_ms']:.0f} ms, "
+                      f"生成: {timings['eval_count']} tokens / {timings['eval_ms']:.0f} ms")
+
+            if full_response:
+                # 存储用户消息和机器人回复
+                for conv in self.memory["conversations"]:
+                    if conv["id"] == conversation_id:
+                        conv["messages"].append({
+                            "role": "user",
+                            "content": user_message,
+                            "timestamp": datetime.datetime.now().isoformat()
+                        })
+                        conv["messages"].append({
+                            "role": "assistant",
+                            "content": full_response,
+                            "timestamp": datetime.datetime.now().isoformat()
+                        })
+                        break
+
+                self._save_memory()
+
+                return {
+                    "response": full_response,
+                    "conversation_id": conversation_id,
+                    "searched": need_search,
+                    "search_results": search_results if need_search else None,
+                    "timings": timings
+                }
+            else:
+                error_msg = "模型未返回任何内容"
+                return {"error": error_msg, "conversation_id": conversation_id}
+
+        except requests.exceptions.HTTPError as e:
+            error_msg = f"API请求失败，状态码: {e.response.status_code}, 响应内容: {e.response.text[:300]}..."
+            return {"error": error_msg, "conversation_id": conversation_id}
         except Exception as e:
             error_msg = f"发生错误: {str(e)}"
             return {"error": error_msg, "conversation_id": conversation_id}
@@ -10,14 +10,15 @@
 
 # 使用  milvus_host: str = "192.168.0.245", milvus_port: str = "19530"
 
-import ollama
-from sentence_transformers import SentenceTransformer
-# from langchain_community.embeddings import OllamaEmbeddings
-from pymilvus import connections, Collection, utility
+# ollama、pymilvus、langchain_ollama 导入较慢，只在真正用到的方法里导入，
+# 启动时不加载；交互模式下在等待用户输入的同时于后台完成初始化
 import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Optional, Any
-from langchain_ollama import OllamaEmbeddings
-import fitz  # PyMuPDF
+from OllamaSession import parse_timings, DEFAULT_KEEP_ALIVE
+from CollectionMigration import OLLAMA_SPEC, ServingCollection, build_filter, embed_query, metadata_names, serving_collection_name
+from ParentChildIndex import CHILD_OVERSAMPLE, ParentDocStore, expand_parents
 
 # 配置参数
 EMBEDDING_MODEL = "nomic-embed-text"
@@ -25,6 +26,8 @@ MILVUS_HOST = "192.168.0.245"
 MILVUS_PORT = "19530"
 COLLECTION_NAME = "doc_embeddings"
 OLLAMA_MODEL = "deepseek-r1:7b"  # 或其他你本地安装的模型
+OLLAMA_KEEP_ALIVE = DEFAULT_KEEP_ALIVE  # 模型常驻时间，避免每次对话重新加载
+DOCSTORE_PATH = "docstore.db"  # 父窗口存储，与 ParentChildIndex.DEFAULT_DB_PATH 一致
 
 # 初始化日志
 logging.basicConfig(level=logging.INFO)
@@ -32,40 +35,45 @@ logger = logging.getLogger(__name__)
 
 class DocSearch:
     def __init__(self, milvus_host: str = "192.168.0.245", milvus_port: str = "19530"):
+        from pymilvus import connections
+
         # 初始化 Milvus 连接
         connections.connect(host=milvus_host, port=milvus_port)
-        
-        # 初始化 Ollama embeddings
-        self.embeddings = OllamaEmbeddings(
-            model="nomic-embed-text",
-            base_url="http://192.168.0.245:11434"
-        )
-        
-        # 获取集合
-        self.collection_name = "doc_embeddings"
-        self.collection = Collection(self.collection_name)
-        self.collection.load()
-        
+
+        # 获取集合：别名 doc_search 切换到新模型的集合后（CollectionMigration.py），查询模型随之切换
+        self.serving = ServingCollection(OLLAMA_SPEC)
+        self.collection, self.embeddings = self.serving.get()
+        self.collection_name = self.serving.name
+
+        # 父子索引的父窗口存储：检索命中子块，返回所属父窗口的文本
+        self.docstore = None
+        if os.path.exists(DOCSTORE_PATH):
+            self.docstore = ParentDocStore(DOCSTORE_PATH)
+
         # 检查集合中的实体数量
-        collection = Collection("doc_embeddings")
-        print(f"集合中的实体数量: {collection.num_entities}")
+        print(f"集合中的实体数量: {self.collection.num_entities}")
     
-    def search(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
+    def search(self, query: str, top_k: int = 5, filter: Any = None) -> List[Dict[str, Any]]:
         """
         搜索与查询文本最相关的文档片段
         
         Args:
             query: 搜索文本
             top_k: 返回最相关的前 k 个结果
+            filter: 过滤条件，在向量检索内部执行（不是对 top_k 结果后过滤），可以是 Milvus 表达式或字典，
+                例如 {"project": "朔黄", "date": {">=": 20230101}}，见 CollectionMigration.build_filter
             
         Returns:
             包含搜索结果信息的列表，每个结果包含：
-            - text: 匹配的文本片段
+            - text: 匹配的文本片段；父子索引时为命中子块所属的父窗口（同一父窗口只返回一次）
+            - child_text: 父子索引时命中的子块
             - source: 来源文档
+            - project / date / page: 项目、文档日期、起始页码（集合有这些字段时）
             - score: 相似度分数
         """
         # 将查询文本转换为向量
-        query_embedding = self.embeddings.embed_query(query)
+        self.collection, self.embeddings = self.serving.get()
+        query_embedding = embed_query(self.embeddings, query)
         # 检查向量维度
         print(f"向量维度: {len(query_embedding)}")
 
@@ -77,13 +85,22 @@ class DocSearch:
             "params": {"nprobe": 10}
         }
         
+        # 过滤条件下推到 Milvus：先按标量索引（以及 project 分区键）缩小范围，再做向量检索
+        fields = metadata_names(self.collection)
+        expr = build_filter(filter, ["source", *fields])
+
+        # 父子索引：多取几倍子块，按父窗口去重后仍有 top_k 个结果
+        parent_child = self.docstore is not None and "parent_id" in fields
+        limit = top_k * CHILD_OVERSAMPLE if parent_child else top_k
+
         # 执行向量搜索
         results = self.collection.search(
             data=[query_embedding],
             anns_field="embedding",
             param=search_params,
-            limit=top_k,
-            output_fields=["text", "source"]
+            limit=limit,
+            expr=expr or None,
+            output_fields=["text", "source", *fields]
         )
         print(f"搜索结果: {results}")
         # 处理搜索结果
@@ -93,15 +110,21 @@ class DocSearch:
                 result = {
                     "text": hit.entity.get("text"),
                     "source": hit.entity.get("source"),
+                    **{name: hit.entity.get(name) for name in fields},
                     "score": hit.score
                 }
                 search_results.append(result)
         
+        if parent_child:
+            search_results = expand_parents(search_results, self.docstore, top_k)
         return search_results
     
     
 class RAGSystem:
     def __init__(self):
+        from langchain_ollama import OllamaEmbeddings
+        from pymilvus import connections, Collection, utility
+
         # 初始化嵌入模型
         logger.info("Loading embedding model...")
         # 初始化 Ollama embeddings
@@ -115,13 +138,18 @@ class RAGSystem:
         connections.connect(host=MILVUS_HOST, port=MILVUS_PORT)
         
         # 检查集合是否存在
-        if not utility.has_collection(COLLECTION_NAME):
-            raise ValueError(f"Collection {COLLECTION_NAME} does not exist in Milvus")
+        # 别名 doc_search 存在时使用它指向的集合（见 CollectionMigration.py）
+        collection_name = serving_collection_name()
+        if not utility.has_collection(collection_name):
+            raise ValueError(f"Collection {collection_name} does not exist in Milvus")
         
         # 加载集合
-        self.collection = Collection(COLLECTION_NAME)
+        self.collection = Collection(collection_name)
         self.collection.load()
-        
+
+        # 检索器在第一次对话时创建并复用，不再每轮重新连接和加载集合
+        self.doc_search = None
+
         logger.info("RAG system initialized successfully")
     
     def format_context(self, documents: List[Dict]) -> str:
@@ -130,11 +158,14 @@ class RAGSystem:
         for i, doc in enumerate(documents, 1):
             context += f"\nDocument {i}:\n{doc['text']}\n"
             if doc.get('source'):
-                context += f"source: {doc['source']}\n"
+                context += f"source: {doc['source']}"
+                context += f", page {doc['page']}\n" if doc.get('page') else "\n"
         return context
     
     def generate_response(self, query: str, context: Optional[str] = None) -> str:
         """使用Ollama生成响应"""
+        import ollama
+
         prompt = f"""You are a helpful AI assistant. Answer the user's question based on the provided context.
 
 User question: {query}
@@ -146,17 +177,27 @@ Please provide a helpful and accurate response:"""
         response = ollama.generate(
             model=OLLAMA_MODEL,
             prompt=prompt,
-            stream=False
+            stream=False,
+            keep_alive=OLLAMA_KEEP_ALIVE
         )
-        
+
+        timings = parse_timings(response)
+        logger.info(f"prefill: {timings['prompt_eval_count']} tokens / {timings['prompt_eval_ms']:.0f} ms, "
+                    f"generation: {timings['eval_count']} tokens / {timings['eval_ms']:.0f} ms")
         return response['response']
     
-    def chat(self, query: str) -> str:
-        """完整的RAG对话流程"""
+    def chat(self, query: str, filter: Any = None) -> str:
+        """完整的RAG对话流程
+
+        Args:
+            query: 用户问题
+            filter: 检索过滤条件，例如 {"project": "朔黄"}，见 DocSearch.search
+        """
 
         # 执行搜索
-        doc_search = DocSearch()
-        retrieved_docs = doc_search.search(query)
+        if self.doc_search is None:
+            self.doc_search = DocSearch()
+        retrieved_docs = self.doc_search.search(query, filter=filter)
         
         
         # 如果有检索结果，添加到上下文
@@ -171,19 +212,28 @@ Please provide a helpful and accurate response:"""
     
     def close(self):
         """清理资源"""
-        connections.disconnect()
+        from pymilvus import connections
+
+        connections.disconnect("default")
 
 # 示例使用
 if __name__ == "__main__":
-    rag = RAGSystem()
-    
+    # 连接 Milvus、加载集合在后台进行，提示符立即出现
+    executor = ThreadPoolExecutor(max_workers=1)
+    pending = executor.submit(RAGSystem)
+    executor.shutdown(wait=False)
+    rag = None
+
     try:
         while True:
             user_input = input("You: ")
             if user_input.lower() in ['exit', 'quit']:
                 break
-                
+
+            if rag is None:
+                rag = pending.result()
             response = rag.chat(user_input)
             print(f"AI: {response}")
     finally:
-        rag.close()
\ No newline at end of file
+        if rag is not None:
+            rag.close()
\ No newline at end of file
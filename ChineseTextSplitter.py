@@ -0,0 +1,280 @@
+# 面向中文 PDF 的流式文本切分，替代 langchain 的 RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=100)
+#
+# - 按页流式处理，句子可以跨页延续，不需要先把整本 PDF 拼成一个字符串
+# - 以中文句末标点（。！？；…）和英文句末标点（后接空白的 . ! ?）为句子边界
+# - 处理 PDF 版式换行：段内换行直接拼接（中文不加空格，英文加空格，行尾连字符合并），
+#   空行、标题 / 列表编号开头的行视为段落边界，页面首行、末行单独成行的页码丢弃（正文中单独成行的数字保留）
+# - 片段由完整句子组成，重叠部分也是完整句子；超长句子先在逗号、顿号处拆分，仍然超长时才硬切
+# - 单遍扫描，时间复杂度与文本长度成线性
+#
+# 用法：
+#   python ChineseTextSplitter.py                 # 合成的中文 PDF 文本上对比 langchain 切分器
+#   python ChineseTextSplitter.py docs/a.pdf      # 对指定 PDF 对比
+
+import re
+import sys
+import time
+from typing import Callable, Iterable, Iterator, List, Tuple
+
+DEFAULT_CHUNK_SIZE = 500
+DEFAULT_CHUNK_OVERLAP = 100
+
+SENTENCE_END = "。！？；!?;…"
+CLOSING = "”’」』）)】》\"'"
+_CJK = re.compile(r"[\u3000-\u303f\u3400-\u9fff\uf900-\ufaff\uff00-\uffef]")
+# 句末标点（可跟引号、括号），或后面是大写字母 / 中文 / 行尾的英文句号（不匹配 3.14、e.g. 这类写法）
+_TERMINATOR = re.compile(
+    r"(?:[。！？；!?;]|…+)[”’」』）)】》\"']*"
+    r"|(?<!\d)\.[”’\"')]*(?=\s+[A-Z\u3400-\u9fff]|\s*$)"
+)
+_SOFT_BREAK = re.compile(r"[，、,：:]")
+# 章节标题单独成句
+_TITLE = re.compile(r"第[一二三四五六七八九十百千\d]+[章节篇部分]")
+# 标题 / 列表编号：第一章、一、（一）、(1)、1.2 、•，这些行开始新的段落
+_HEADING = re.compile(
+    r"(第[一二三四五六七八九十百千\d]+[章节条部分篇]"
+    r"|[一二三四五六七八九十]+、"
+    r"|[（(][一二三四五六七八九十\d]+[）)]"
+    r"|\d+(\.\d+)*[、．.](?!\d)"
+    r"|[•●■◆▪◇○])"
+)
+_PAGE_NUMBER = re.compile(r"(第\s*\d+\s*页|-?\s*\d+\s*-?|\d+\s*/\s*\d+)")
+
+
+def _is_cjk(char: str) -> bool:
+    return bool(_CJK.match(char))
+
+
+def _joiner(left: str, right: str) -> str:
+    """两段文字拼接时的分隔符：任一侧是中文时不加空格"""
+    if not left or not right or _is_cjk(left[-1]) or _is_cjk(right[0]):
+        return ""
+    return " "
+
+
+class ChineseTextSplitter:
+    def __init__(
+        self,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        chunk_overlap: int = DEFAULT_CHUNK_OVERLAP,
+        length_function: Callable[[str], int] = len,
+    ):
+        """
+        Args:
+            chunk_size: 片段最大长度
+            chunk_overlap: 相邻片段重叠的最大长度（由完整句子组成）
+            length_function: 长度计算函数
+        """
+        if chunk_overlap >= chunk_size:
+            raise ValueError("chunk_overlap must be smaller than chunk_size")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.length_function = length_function
+
+    def iter_sentences(self, pages: Iterable[str]) -> Iterator[str]:
+        """把逐页的 PDF 文本还原成句子（段落结尾没有标点时整段作为一句）"""
+        return (sentence for sentence, _ in self.iter_sentences_with_pages(pages))
+
+    def iter_sentences_with_pages(self, pages: Iterable[str]) -> Iterator[Tuple[str, int]]:
+        """与 iter_sentences 相同，同时给出句子开始的页码（从 1 开始）"""
+        pending: List[str] = []
+        start_page = 0
+
+        def flush() -> str:
+            sentence = "".join(pending).strip()
+            pending.clear()
+            return sentence
+
+        for page_number, page in enumerate(pages, 1):
+            lines = [line.strip() for line in page.splitlines()]
+            # 页码只出现在页面的第一行或最后一行；正文中单独成行的数字（表格数值等）保留
+            filled = [i for i, line in enumerate(lines) if line]
+            edges = {filled[0], filled[-1]} if filled else set()
+            for index, line in enumerate(lines):
+                if not line:
+                    sentence = flush()  # 空行是段落边界
+                    if sentence:
+                        yield sentence, start_page
+                    continue
+                if index in edges and _PAGE_NUMBER.fullmatch(line):
+                    continue
+                if pending:
+                    if _HEADING.match(line):
+                        sentence = flush()
+                        if sentence:
+                            yield sentence, start_page
+                    else:
+                        last = pending[-1]
+                        if last.endswith("-") and len(last) > 1 and last[-2].isalpha() and line[0].islower():
+                            pending[-1] = last[:-1]  # 英文单词被连字符断行
+                        else:
+                            pending.append(_joiner(last, line))
+                if not pending:
+                    start_page = page_number
+
+                start = 0
+                for match in _TERMINATOR.finditer(line):
+                    pending.append(line[start:match.end()])
+                    start = match.end()
+                    sentence = flush()
+                    if sentence:
+                        yield sentence, start_page
+                    start_page = page_number
+                if start < len(line):
+                    pending.append(line[start:])
+                    if _TITLE.match(line):
+                        sentence = flush()
+                        if sentence:
+                            yield sentence, start_page
+        sentence = flush()
+        if sentence:
+            yield sentence, start_page
+
+    def _fit(self, sentence: str) -> Iterator[str]:
+        """超长句子在逗号、顿号处拆分，仍然超长的部分按长度硬切"""
+        if self.length_function(sentence) <= self.chunk_size:
+            yield sentence
+            return
+        part = ""
+        start = 0
+        pieces = []
+        for match in _SOFT_BREAK.finditer(sentence):
+            pieces.append(sentence[start:match.end()])
+            start = match.end()
+        pieces.append(sentence[start:])
+        for piece in pieces:
+            if part and self.length_function(part + piece) > self.chunk_size:
+                yield part
+                part = ""
+            while self.length_function(piece) > self.chunk_size:
+                yield piece[:self.chunk_size]
+                piece = piece[self.chunk_size:]
+            part += piece
+        if part:
+            yield part
+
+    def split_sentences(self, sentences: Iterable[str]) -> Iterator[str]:
+        """把句子合并成不超过 chunk_size 的片段，相邻片段以完整句子重叠"""
+        return (chunk for chunk, _ in self.split_sentences_with_pages((sentence, 0) for sentence in sentences))
+
+    def split_sentences_with_pages(self, sentences: Iterable[Tuple[str, int]]) -> Iterator[Tuple[str, int]]:
+        """与 split_sentences 相同，输入和输出都带页码；片段的页码是其第一句所在的页"""
+        current: List[str] = []  # 除第一个外，元素带有与前一句之间的分隔符
+        pages: List[int] = []  # 与 current 一一对应
+        size = 0
+        for sentence, page in sentences:
+            for piece in self._fit(sentence):
+                separator = _joiner(current[-1], piece) if current else ""
+                length = self.length_function(piece) + len(separator)
+                if current and size + length > self.chunk_size:
+                    yield "".join(current), pages[0]
+                    # 从末尾保留不超过 chunk_overlap 的完整句子作为下一个片段的开头
+                    keep, kept = 0, 0
+                    for item in reversed(current):
+                        item_length = self.length_function(item)
+                        if kept + item_length > self.chunk_overlap:
+                            break
+                        keep += 1
+                        kept += item_length
+                    current, pages = current[len(current) - keep:], pages[len(pages) - keep:]
+                    if current:
+                        current[0] = current[0].lstrip()
+                    size = sum(self.length_function(item) for item in current)
+                    separator = _joiner(current[-1], piece) if current else ""
+                    length = self.length_function(piece) + len(separator)
+                    while current and size + length > self.chunk_size:
+                        size -= self.length_function(current.pop(0))
+                        pages.pop(0)
+                        if current:
+                            size -= len(current[0]) - len(current[0].lstrip())
+                            current[0] = current[0].lstrip()
+                    if not current:
+                        separator, length = "", self.length_function(piece)
+                current.append(separator + piece)
+                pages.append(page)
+                size += length
+        if current:
+            yield "".join(current), pages[0]
+
+    def split_pages(self, pages: Iterable[str]) -> Iterator[str]:
+        """流式切分：输入逐页文本，逐个产出片段"""
+        return self.split_sentences(self.iter_sentences(pages))
+
+    def split_pages_with_numbers(self, pages: Iterable[str]) -> Iterator[Tuple[str, int]]:
+        """流式切分，逐个产出 (片段, 起始页码)"""
+        return self.split_sentences_with_pages(self.iter_sentences_with_pages(pages))
+
+    def split_text(self, text: str) -> List[str]:
+        """与 RecursiveCharacterTextSplitter.split_text 相同的用法"""
+        return list(self.split_pages([text]))
+
+
+def boundary_quality(chunks: List[str]) -> dict:
+    """片段边界质量：结尾是否为完整句子、片段内是否残留版式换行"""
+    if not chunks:
+        return {"chunks": 0}
+    ends_at_sentence = sum(1 for c in chunks if c.rstrip() and c.rstrip()[-1] in SENTENCE_END + CLOSING + ".")
+    with_line_breaks = sum(1 for c in chunks if "\n" in c.strip())
+    return {
+        "chunks": len(chunks),
+        "avg_length": round(sum(len(c) for c in chunks) / len(chunks), 1),
+        "ends_at_sentence": f"{ends_at_sentence / len(chunks):.0%}",
+        "with_layout_line_breaks": f"{with_line_breaks / len(chunks):.0%}",
+    }
+
+
+def synthetic_pages(count: int = 200, width: int = 38) -> List[str]:
+    """生成模拟 PDF 提取结果的页面：固定宽度断行、标题、编号列表、页码"""
+    sentences = [
+        "在优化现有牵引供电设备运维手段基础上，深入开展朔黄铁路牵引供电运维智能化技术顶层框架及关键技术研究。",
+        "以数据为抓手、以数据为驱动，形成了完整的适用于朔黄铁路牵引供电设备智能运维技术架构！",
+        "该架构是否能够推广到其他重载铁路线路？",
+        "系统采用 SCADA 数据、在线监测数据和巡检记录，覆盖 27 座牵引变电所；",
+        "The framework integrates condition monitoring with predictive maintenance models.",
+    ]
+    pages = []
+    for page_number in range(1, count + 1):
+        lines = [f"第{page_number}章 牵引供电智能运维"] if page_number % 10 == 1 else []
+        for paragraph in range(4):
+            text = "".join(sentences[(page_number + paragraph + i) % len(sentences)] for i in range(3))
+            if paragraph == 2:
+                text = f"（{paragraph}）" + text
+            lines.extend(text[i:i + width] for i in range(0, len(text), width))
+            lines.append("")
+        lines.append(str(page_number))
+        pages.append("\n".join(lines))
+    return pages
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        import fitz  # PyMuPDF
+        with fitz.open(sys.argv[1]) as doc:
+            pages = [page.get_text() for page in doc]
+    else:
+        pages = synthetic_pages()
+    text = "".join(pages)
+    repeat = 5
+
+    splitter = ChineseTextSplitter(chunk_size=DEFAULT_CHUNK_SIZE, chunk_overlap=DEFAULT_CHUNK_OVERLAP)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        chunks = list(splitter.split_pages(pages))
+    elapsed = (time.perf_counter() - start) / repeat
+    print(f"ChineseTextSplitter: {len(chunks) / elapsed:,.0f} chunks/s, {len(text) / elapsed / 1e6:.1f} M 字符/s")
+    print(f"  {boundary_quality(chunks)}")
+
+    try:
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+    except ImportError:
+        print("未安装 langchain，跳过对比")
+        sys.exit(0)
+    baseline = RecursiveCharacterTextSplitter(chunk_size=DEFAULT_CHUNK_SIZE, chunk_overlap=DEFAULT_CHUNK_OVERLAP,
+                                              length_function=len)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        chunks = baseline.split_text(text)
+    elapsed = (time.perf_counter() - start) / repeat
+    print(f"RecursiveCharacterTextSplitter: {len(chunks) / elapsed:,.0f} chunks/s, "
+          f"{len(text) / elapsed / 1e6:.1f} M 字符/s")
+    print(f"  {boundary_quality(chunks)}")
@@ -0,0 +1,386 @@
+# 入库时的重复片段检测：同一报告的多个修订版、每页重复的页眉页脚不再重复生成向量
+#
+# - 完全相同（只忽略空白）的片段用摘要直接命中，不再生成向量
+# - 近似重复用 MinHash（字符 3-gram）+ LSH 分桶查找候选，估算的 Jaccard 相似度达到阈值即视为近似重复；
+#   默认只做统计、仍然生成向量：修订版中改动的数字、图表说明与旧版高度相似，跳过会丢失新内容，
+#   旧版删除后还会由新版接管旧文本。skip_near=True 时才跳过近似重复
+# - 签名、分桶和引用关系持久化在 SQLite（dedup_index.db）中，跨文件、跨多次运行都能识别重复；
+#   按 Milvus 集合分开记录，更换集合或模型后不会命中其他集合的向量
+# - 命中的片段先确认其向量仍在集合中（可能被手工删除或集合被重建），不存在时重新生成
+# - 只在同一项目内去重：按 project 过滤检索时，每个项目都有自己的一份片段，不会因为片段只存在于其他项目而漏检
+# - 重复片段不生成向量，只在 refs 表中记录“该片段也出现在哪个文档中”；
+#   原始文档被删除时，由仍引用该片段的文档接管（复用 Milvus 中已有的向量，不重新编码）
+# - 每页都出现的页眉页脚行在切分前去掉（remove_boilerplate）
+# - report() 统计节省的片段数、字符数
+#
+# 用法：
+#   python ChunkDedup.py report                   # 查看节省情况（--collection 指定集合，默认 doc_embeddings）
+#   python ChunkDedup.py refs 某文档.pdf          # 查看某个文档的片段引用
+
+import argparse
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from CollectionMigration import get_dual_writer, insert_chunks, metadata_names
+
+DEFAULT_DB_PATH = "dedup_index.db"
+NUM_PERM = 64
+BANDS = 8  # 8 个分桶 × 每桶 8 行，相似度约 0.77 以上的片段有较高概率落入同一个桶
+ROWS = NUM_PERM // BANDS
+DEFAULT_THRESHOLD = 0.8
+SHINGLE_SIZE = 3
+MIN_NEAR_LENGTH = 30  # 规范化后短于该长度的片段只做完全匹配
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_rng = np.random.RandomState(1)  # 固定种子，签名在多次运行之间保持一致
+_PERM_A = _rng.randint(1, (1 << 61) - 1, size=NUM_PERM, dtype=np.uint64)
+_PERM_B = _rng.randint(0, (1 << 61) - 1, size=NUM_PERM, dtype=np.uint64)
+
+_NOISE = re.compile(r"[\s\W_]+", re.UNICODE)
+_SPACES = re.compile(r"\s+", re.UNICODE)
+_DIGITS = re.compile(r"\d+")
+
+
+def normalize(text: str) -> str:
+    """去掉空白和标点并转小写，版式差异不影响比较"""
+    return _NOISE.sub("", text).lower()
+
+
+def digest(text: str) -> str:
+    """完全匹配用的摘要：只去掉空白（PDF 换行位置不同），数字、标点、大小写的差异都视为不同片段"""
+    return hashlib.blake2b(_SPACES.sub("", text).encode("utf-8"), digest_size=16).hexdigest()
+
+
+def minhash(normalized: str) -> np.ndarray:
+    """字符 3-gram 的 MinHash 签名，长度 NUM_PERM"""
+    grams = {normalized[i:i + SHINGLE_SIZE] for i in range(max(1, len(normalized) - SHINGLE_SIZE + 1))}
+    hashes = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(g.encode("utf-8"), digest_size=4).digest(), "little") for g in grams),
+        dtype=np.uint64, count=len(grams),
+    )
+    # 与 datasketch 相同的通用哈希：(a * h + b) mod p，取低 32 位
+    permuted = (np.outer(hashes, _PERM_A) + _PERM_B) % _MERSENNE_PRIME & _MAX_HASH
+    return permuted.min(axis=0).astype(np.uint32)
+
+
+def band_keys(signature: np.ndarray) -> List[int]:
+    return [int.from_bytes(hashlib.blake2b(signature[b * ROWS:(b + 1) * ROWS].tobytes(), digest_size=8).digest(),
+                           "little", signed=True)
+            for b in range(BANDS)]
+
+
+def remove_boilerplate(pages: List[str], min_ratio: float = 0.5, min_pages: int = 3) -> List[str]:
+    """去掉在多数页面上重复出现的行（页眉、页脚、带页码的版权行）
+
+    Args:
+        pages: 逐页文本
+        min_ratio: 出现在至少该比例的页面上的行视为页眉页脚
+        min_pages: 页数少于该值时不处理
+    """
+    if len(pages) < min_pages:
+        return pages
+
+    def key(line: str) -> str:
+        return _DIGITS.sub("#", normalize(line))  # 页码不同的页眉视为同一行
+
+    counts = Counter()
+    for page in pages:
+        counts.update({key(line) for line in page.splitlines() if line.strip()})
+    repeated = {k for k, n in counts.items() if k and n >= len(pages) * min_ratio}
+    if not repeated:
+        return pages
+    return ["\n".join(line for line in page.splitlines() if key(line) not in repeated) for page in pages]
+
+
+class ChunkDedupIndex:
+    def __init__(self, db_path: str = DEFAULT_DB_PATH, threshold: float = DEFAULT_THRESHOLD,
+                 collection: Any = None, skip_near: bool = False):
+        """
+        Args:
+            db_path: SQLite 数据库路径
+            threshold: 近似重复的 Jaccard 相似度阈值
+            collection: 片段所在的 Milvus 集合或集合名；索引按集合名分开记录，
+                        传入集合时，命中的片段先在集合中确认向量仍然存在
+            skip_near: 是否跳过近似重复的片段（默认只跳过完全相同的片段）
+        """
+        self.db_path = db_path
+        self.threshold = threshold
+        if isinstance(collection, str):
+            self.collection, self.collection_name = None, collection
+        else:
+            self.collection, self.collection_name = collection, collection.name if collection is not None else ""
+        self.skip_near = skip_near
+        self._local = threading.local()
+        conn = self._connect()
+        with conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS chunks ("
+                         "id INTEGER PRIMARY KEY, collection TEXT, project TEXT, digest TEXT, signature BLOB, "
+                         "owner TEXT, milvus_id INTEGER, length INTEGER, UNIQUE (collection, project, digest))")
+            conn.execute("CREATE TABLE IF NOT EXISTS bands (band INTEGER, key INTEGER, chunk_id INTEGER)")
+            conn.execute("CREATE INDEX IF NOT EXISTS bands_key ON bands (band, key)")
+            conn.execute("CREATE TABLE IF NOT EXISTS refs ("
+                         "chunk_id INTEGER, source TEXT, count INTEGER, PRIMARY KEY (chunk_id, source))")
+            conn.execute("CREATE INDEX IF NOT EXISTS refs_source ON refs (source)")
+            conn.execute("CREATE INDEX IF NOT EXISTS chunks_owner ON chunks (collection, owner)")
+            conn.execute("CREATE INDEX IF NOT EXISTS chunks_milvus_id ON chunks (collection, milvus_id)")
+            conn.execute("CREATE TABLE IF NOT EXISTS stats ("
+                         "collection TEXT, name TEXT, value INTEGER, PRIMARY KEY (collection, name))")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _live(self, milvus_ids: List[int]) -> set:
+        """集合中仍然存在的主键；没有指定集合时视为全部存在"""
+        if self.collection is None or not milvus_ids:
+            return set(milvus_ids)
+        self.collection.load()
+        found = set()
+        for i in range(0, len(milvus_ids), 1000):
+            rows = self.collection.query(expr=f"id in {milvus_ids[i:i + 1000]}", output_fields=["id"],
+                                         consistency_level="Strong")
+            found.update(row["id"] for row in rows)
+        return found
+
+    def _purge(self, conn: sqlite3.Connection, chunk_id: int) -> None:
+        conn.execute("DELETE FROM chunks WHERE id = ?", (chunk_id,))
+        conn.execute("DELETE FROM bands WHERE chunk_id = ?", (chunk_id,))
+        conn.execute("DELETE FROM refs WHERE chunk_id = ?", (chunk_id,))
+
+    def _find(self, conn: sqlite3.Connection, project: str, chunk_digest: str,
+              signature: Optional[np.ndarray]) -> Tuple[Optional[int], str]:
+        row = conn.execute("SELECT id FROM chunks WHERE collection = ? AND project = ? AND digest = ?",
+                           (self.collection_name, project, chunk_digest)).fetchone()
+        if row:
+            return row[0], "exact"
+        if signature is None:
+            return None, ""
+        candidates = set()
+        for band, band_key in enumerate(band_keys(signature)):
+            candidates.update(r[0] for r in conn.execute(
+                "SELECT bands.chunk_id FROM bands JOIN chunks ON chunks.id = bands.chunk_id "
+                "WHERE bands.band = ? AND bands.key = ? AND chunks.collection = ? AND chunks.project = ?",
+                (band, band_key, self.collection_name, project)))
+        best, best_score = None, 0.0
+        for chunk_id in candidates:
+            blob = conn.execute("SELECT signature FROM chunks WHERE id = ?", (chunk_id,)).fetchone()[0]
+            score = float(np.mean(np.frombuffer(blob, dtype=np.uint32) == signature))
+            if score > best_score:
+                best, best_score = chunk_id, score
+        if best is not None and best_score >= self.threshold:
+            return best, "near"
+        return None, ""
+
+    def filter(self, chunks: List[str], source: str, project: str = "") -> Tuple[List[str], List[int]]:
+        """找出需要生成向量的片段，重复片段只记录引用
+
+        Args:
+            chunks: 文档的全部片段
+            source: 文档名
+            project: 文档所属项目，只与同一项目中已入库的片段比较
+
+        Returns:
+            (需要生成向量的片段, 对应的 chunk_id)；写入 Milvus 后调用 attach，失败时调用 discard
+        """
+        conn = self._connect()
+        digests = [digest(text) for text in chunks]
+        # 完全匹配的候选先批量确认向量仍在集合中，已不存在的记录清除后按新片段处理
+        stored = []
+        unique_digests = list(dict.fromkeys(digests))
+        for i in range(0, len(unique_digests), 500):
+            batch = unique_digests[i:i + 500]
+            stored += conn.execute(
+                f"SELECT id, milvus_id FROM chunks WHERE collection = ? AND project = ? "
+                f"AND digest IN ({','.join('?' * len(batch))}) AND milvus_id IS NOT NULL",
+                (self.collection_name, project, *batch)).fetchall()
+        live = self._live([milvus_id for _, milvus_id in stored])
+
+        unique, chunk_ids = [], []
+        counts: Counter = Counter()
+        with conn:
+            for chunk_id, milvus_id in stored:
+                if milvus_id not in live:
+                    self._purge(conn, chunk_id)
+                    counts["stale_entries"] += 1
+            for text, chunk_digest in zip(chunks, digests):
+                normalized = normalize(text)
+                signature = minhash(normalized) if len(normalized) >= MIN_NEAR_LENGTH else None
+                chunk_id, kind = self._find(conn, project, chunk_digest, signature)
+                if kind == "near":
+                    milvus_id = conn.execute("SELECT milvus_id FROM chunks WHERE id = ?", (chunk_id,)).fetchone()[0]
+                    if not self.skip_near:
+                        counts["near_kept"] += 1
+                        chunk_id = None
+                    elif milvus_id is not None and not self._live([milvus_id]):
+                        chunk_id = None
+                if chunk_id is None:
+                    chunk_id = conn.execute(
+                        "INSERT INTO chunks (collection, project, digest, signature, owner, length) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        (self.collection_name, project, chunk_digest,
+                         signature.tobytes() if signature is not None else None, source, len(text))).lastrowid
+                    if signature is not None:
+                        conn.executemany("INSERT INTO bands (band, key, chunk_id) VALUES (?, ?, ?)",
+                                         [(band, key, chunk_id) for band, key in enumerate(band_keys(signature))])
+                    unique.append(text)
+                    chunk_ids.append(chunk_id)
+                else:
+                    counts[f"{kind}_duplicates"] += 1
+                    counts["chars_saved"] += len(text)
+                conn.execute("INSERT INTO refs (chunk_id, source, count) VALUES (?, ?, 1) "
+                             "ON CONFLICT (chunk_id, source) DO UPDATE SET count = count + 1", (chunk_id, source))
+            counts["chunks_seen"] += len(chunks)
+            counts["chunks_embedded"] += len(unique)
+            conn.executemany("INSERT INTO stats (collection, name, value) VALUES (?, ?, ?) "
+                             "ON CONFLICT (collection, name) DO UPDATE SET value = value + excluded.value",
+                             [(self.collection_name, name, value) for name, value in counts.items()])
+        return unique, chunk_ids
+
+    def attach(self, chunk_ids: List[int], milvus_ids: List[int]) -> None:
+        """记录片段在 Milvus 中的主键"""
+        conn = self._connect()
+        with conn:
+            conn.executemany("UPDATE chunks SET milvus_id = ? WHERE id = ?", zip(milvus_ids, chunk_ids))
+
+    def discard(self, chunk_ids: List[int]) -> None:
+        """写入 Milvus 失败时撤销 filter 新登记的片段"""
+        conn = self._connect()
+        with conn:
+            for chunk_id in chunk_ids:
+                self._purge(conn, chunk_id)
+
+    def remove_source(self, source: str) -> List[Tuple[int, str]]:
+        """删除文档的全部引用
+
+        Returns:
+            该文档拥有、但仍被其他文档引用的片段：[(milvus_id, 新的所属文档)]，
+            调用方需要把这些向量以新文档的名义重新写入，再删除原文档的片段
+        """
+        conn = self._connect()
+        transfers = []
+        with conn:
+            conn.execute("DELETE FROM refs WHERE source = ? AND chunk_id IN (SELECT id FROM chunks WHERE collection = ?)",
+                         (source, self.collection_name))
+            for chunk_id, milvus_id in conn.execute(
+                    "SELECT id, milvus_id FROM chunks WHERE collection = ? AND owner = ?",
+                    (self.collection_name, source)).fetchall():
+                heir = conn.execute("SELECT source FROM refs WHERE chunk_id = ? ORDER BY source LIMIT 1",
+                                    (chunk_id,)).fetchone()
+                if heir is None:
+                    conn.execute("DELETE FROM chunks WHERE id = ?", (chunk_id,))
+                    conn.execute("DELETE FROM bands WHERE chunk_id = ?", (chunk_id,))
+                else:
+                    conn.execute("UPDATE chunks SET owner = ? WHERE id = ?", (heir[0], chunk_id))
+                    if milvus_id is not None:
+                        transfers.append((milvus_id, heir[0]))
+        return transfers
+
+    def reassign(self, old_ids: List[int], new_ids: List[int]) -> None:
+        """接管后的向量重新写入 Milvus，主键随之变化"""
+        conn = self._connect()
+        with conn:
+            conn.executemany("UPDATE chunks SET milvus_id = ? WHERE collection = ? AND milvus_id = ?",
+                             [(new, self.collection_name, old) for old, new in zip(old_ids, new_ids)])
+
+    def references(self, milvus_ids: Iterable[int], collection: str = None) -> Dict[int, List[str]]:
+        """检索结果的片段还出现在哪些文档中
+
+        Args:
+            milvus_ids: 检索结果的主键
+            collection: 检索的集合名，默认为创建索引时指定的集合
+        """
+        conn = self._connect()
+        collection = collection or self.collection_name
+        result = {}
+        for milvus_id in milvus_ids:
+            result[milvus_id] = [r[0] for r in conn.execute(
+                "SELECT refs.source FROM chunks JOIN refs ON refs.chunk_id = chunks.id "
+                "WHERE chunks.collection = ? AND chunks.milvus_id = ? ORDER BY refs.source",
+                (collection, milvus_id))]
+        return result
+
+    def source_refs(self, source: str) -> Dict[str, int]:
+        """文档的片段中，有多少是与其他文档共用的（按所属文档统计）"""
+        rows = self._connect().execute(
+            "SELECT chunks.owner, sum(refs.count) FROM refs JOIN chunks ON chunks.id = refs.chunk_id "
+            "WHERE chunks.collection = ? AND refs.source = ? GROUP BY chunks.owner", (self.collection_name, source))
+        return dict(rows.fetchall())
+
+    def report(self) -> Dict[str, object]:
+        conn = self._connect()
+        stats = dict(conn.execute("SELECT name, value FROM stats WHERE collection = ?",
+                                  (self.collection_name,)).fetchall())
+        seen = stats.get("chunks_seen", 0)
+        skipped = stats.get("exact_duplicates", 0) + stats.get("near_duplicates", 0)
+        return {
+            "chunks_seen": seen,
+            "chunks_embedded": stats.get("chunks_embedded", 0),
+            "exact_duplicates": stats.get("exact_duplicates", 0),
+            "near_duplicates": stats.get("near_duplicates", 0),
+            "near_kept": stats.get("near_kept", 0),
+            "stale_entries": stats.get("stale_entries", 0),
+            "embeddings_saved": f"{skipped / seen:.1%}" if seen else "0%",
+            "chars_saved": stats.get("chars_saved", 0),
+            "unique_chunks": conn.execute("SELECT count(*) FROM chunks WHERE collection = ?",
+                                          (self.collection_name,)).fetchone()[0],
+            "sources": conn.execute("SELECT count(DISTINCT refs.source) FROM refs JOIN chunks ON chunks.id = refs.chunk_id "
+                                    "WHERE chunks.collection = ?", (self.collection_name,)).fetchone()[0],
+        }
+
+
+def transfer_owned(collection: Any, index: ChunkDedupIndex, source: str) -> int:
+    """删除文档前，把仍被其他文档引用的片段转给其他文档
+
+    复制 Milvus 中已有的文本和向量，以接管文档的名义写入，不重新编码。
+    调用方随后按 source 删除原文档的片段。
+
+    Returns:
+        转移的片段数
+    """
+    heirs = dict(index.remove_source(source))
+    if not heirs:
+        return 0
+    collection.load()
+    fields = metadata_names(collection)
+    rows = collection.query(expr=f"id in {sorted(heirs)}", output_fields=["id", "text", "embedding", *fields])
+    if not rows:
+        return 0
+    texts = [row["text"] for row in rows]
+    vectors = np.asarray([row["embedding"] for row in rows], dtype=np.float32)
+    sources = [heirs[row["id"]] for row in rows]
+    # 项目、日期、页码沿用原片段（去重只在同一项目内进行，接管文档与原文档属于同一项目）
+    metadata = {name: [row[name] for row in rows] for name in fields}
+    ids = insert_chunks(collection, texts, vectors, sources, metadata)
+    index.reassign([row["id"] for row in rows], ids)
+    get_dual_writer().insert(collection.name, ids, texts, sources, metadata)
+    return len(ids)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="入库近重复片段索引")
+    parser.add_argument("command", choices=["report", "refs"])
+    parser.add_argument("source", nargs="?", help="文档名（refs 命令）")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="索引数据库路径")
+    parser.add_argument("--collection", default="doc_embeddings", help="Milvus 集合名")
+    args = parser.parse_args()
+
+    index = ChunkDedupIndex(args.db, collection=args.collection)
+    if args.command == "report":
+        print(json.dumps(index.report(), ensure_ascii=False, indent=2))
+    else:
+        if not args.source:
+            parser.error("refs 需要文档名")
+        print(json.dumps(index.source_refs(args.source), ensure_ascii=False, indent=2))
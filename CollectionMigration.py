@@ -0,0 +1,523 @@
+# 向量集合的不停机迁移：更换向量模型（nomic-embed-text ↔ m3e-base 或以后的模型）时不再删除 doc_embeddings
+#
+# 流程：
+#   1. start    为目标模型创建影子集合 doc_embeddings__<模型>_<维度>，集合描述中记录模型信息和来源集合
+#   2. 双写     DocEmbedding 写入当前集合后，同时用目标模型编码并写入影子集合（删除同样双写）
+#   3. backfill 按主键顺序读取当前集合的片段，用目标模型重新编码后写入影子集合，按 --rate 限速，可断点续跑
+#   4. swap     影子集合建好索引并加载后，把别名 doc_search 原子地指向影子集合
+#   在 swap 之前，检索端一直使用原来的集合和模型；swap 之后检索端自动切换模型（ServingCollection）。
+#   旧集合保留，rollback 可把别名指回去，确认无误后再手动删除。
+#
+# 影子集合的主键与来源集合一致（auto_id=False），双写和回填都用 upsert，重复执行不会产生重复片段。
+#
+# 用法：
+#   python CollectionMigration.py start --backend sentence_transformers --model moka-ai/m3e-base
+#   python CollectionMigration.py start --backend ollama --model nomic-embed-text --partition-by-project
+#                                                 # 模型不变，迁移到带 project / date / page / parent_id 的 schema
+#   python CollectionMigration.py backfill --rate 200
+#   python CollectionMigration.py status
+#   python CollectionMigration.py swap
+#   python CollectionMigration.py rollback
+
+import argparse
+import json
+import os
+import random
+import re
+import threading
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+MILVUS_HOST = "192.168.0.245"
+MILVUS_PORT = "19530"
+LEGACY_COLLECTION = "doc_embeddings"  # 迁移前的集合（auto_id，没有记录模型信息）
+SERVING_ALIAS = "doc_search"  # 检索端使用的别名；不存在时使用 LEGACY_COLLECTION
+STATE_PATH = "migration_state.json"  # 回填进度
+DISCOVERY_TTL = 30  # 写入端每隔多久重新检查一次是否有进行中的迁移（秒）
+INDEX_PARAMS = {"metric_type": "L2", "index_type": "IVF_FLAT", "params": {"nlist": 1024}}
+SCHEMA_VERSION = 3  # 2：增加 project / date / page 元数据字段；3：增加 parent_id（父子索引，见 ParentChildIndex.py）
+# 片段元数据字段及其标量索引；检索时的过滤条件在向量检索内部执行，不再对 top_k 结果做后过滤
+METADATA_DEFAULTS = {"project": "", "date": 0, "page": 0, "parent_id": ""}
+SCALAR_INDEXES = {"source": "INVERTED", "project": "INVERTED", "date": "STL_SORT", "page": "STL_SORT",
+                  "parent_id": "INVERTED"}
+FILTER_OPERATORS = {"==", "!=", ">", ">=", "<", "<="}
+
+
+class ModelSpec(NamedTuple):
+    backend: str  # "ollama" 或 "sentence_transformers"
+    model: str
+    dim: int
+
+
+OLLAMA_SPEC = ModelSpec("ollama", "nomic-embed-text", 768)
+SENTENCE_TRANSFORMERS_SPEC = ModelSpec("sentence_transformers", "moka-ai/m3e-base", 768)
+
+
+def collection_name(spec: ModelSpec) -> str:
+    """模型对应的集合名，例如 doc_embeddings__moka_ai_m3e_base_768_v3"""
+    slug = re.sub(r"[^0-9a-zA-Z]+", "_", spec.model).strip("_").lower()
+    return f"{LEGACY_COLLECTION}__{slug}_{spec.dim}_v{SCHEMA_VERSION}"
+
+
+def metadata_fields(partition_by_project: bool = False) -> List[Any]:
+    """片段元数据字段：project（项目）、date（文档日期 yyyymmdd，未知为 0）、page（起始页码，未知为 0）、
+    parent_id（子块所属的父窗口，不分父子时为空）
+
+    Args:
+        partition_by_project: 以 project 作为分区键，Milvus 按项目分区存储，按项目过滤时只检索对应分区
+    """
+    from pymilvus import DataType, FieldSchema
+
+    return [
+        FieldSchema(name="project", dtype=DataType.VARCHAR, max_length=255, is_partition_key=partition_by_project),
+        FieldSchema(name="date", dtype=DataType.INT64),
+        FieldSchema(name="page", dtype=DataType.INT64),
+        FieldSchema(name="parent_id", dtype=DataType.VARCHAR, max_length=64),
+    ]
+
+
+def create_scalar_indexes(collection: Any) -> None:
+    """为集合中存在的元数据字段建立标量索引（已存在的跳过）"""
+    names = {field.name for field in collection.schema.fields}
+    for field, index_type in SCALAR_INDEXES.items():
+        if field in names and not collection.has_index(index_name=f"{field}_index"):
+            collection.create_index(field_name=field, index_name=f"{field}_index",
+                                    index_params={"index_type": index_type})
+
+
+def metadata_names(collection: Any) -> List[str]:
+    """集合中存在的元数据字段；迁移前创建的集合返回空列表"""
+    names = {field.name for field in collection.schema.fields}
+    return [name for name in METADATA_DEFAULTS if name in names]
+
+
+def build_filter(filter: Any, fields: List[str]) -> str:
+    """把过滤条件转换为 Milvus 布尔表达式
+
+    Args:
+        filter: Milvus 表达式字符串原样使用；字典的键为字段名，值可以是
+            单个值（==）、列表（in）或 {"运算符": 值} 形式的范围，例如
+            {"project": "朔黄", "date": {">=": 20230101}, "source": ["a.pdf", "b.pdf"]}
+        fields: 集合中可用于过滤的字段
+
+    Returns:
+        表达式；没有过滤条件时为空字符串
+    """
+    if not filter:
+        return ""
+    if isinstance(filter, str):
+        return filter
+
+    def literal(value: Any) -> str:
+        return json.dumps(value, ensure_ascii=False)
+
+    clauses = []
+    for field, value in filter.items():
+        if field not in fields:
+            hint = "，请使用 CollectionMigration.py 迁移到带元数据的集合" if field in METADATA_DEFAULTS else ""
+            raise ValueError(f"集合没有字段 {field}，可用于过滤的字段: {', '.join(fields)}{hint}")
+        if isinstance(value, dict):
+            for operator, bound in value.items():
+                if operator not in FILTER_OPERATORS:
+                    raise ValueError(f"不支持的运算符 {operator}")
+                clauses.append(f"{field} {operator} {literal(bound)}")
+        elif isinstance(value, (list, tuple, set)):
+            clauses.append(f"{field} in {literal(list(value))}")
+        else:
+            clauses.append(f"{field} == {literal(value)}")
+    return " and ".join(clauses)
+
+
+def read_spec(collection: Any) -> Tuple[Optional[ModelSpec], Dict[str, Any]]:
+    """从集合描述中读取模型信息；旧集合没有记录时返回 (None, {})"""
+    try:
+        info = json.loads(collection.description)
+        return ModelSpec(info["backend"], info["model"], int(info["dim"])), info
+    except (ValueError, KeyError, TypeError):
+        return None, {}
+
+
+def make_embedder(spec: ModelSpec, embedding_url: Optional[str] = None) -> Any:
+    """创建模型对应的向量客户端；embedding_url 为共享向量服务（EmbeddingServer.py）地址"""
+    if spec.backend == "ollama":
+        from OllamaEmbedder import OllamaEmbedder
+        return OllamaEmbedder(model=spec.model)
+    if spec.backend == "sentence_transformers":
+        from EmbeddingServer import load_embeddings
+        return load_embeddings(spec.model, embedding_url)
+    raise ValueError(f"Unknown embedding backend: {spec.backend}")
+
+
+def embed_documents(embedder: Any, texts: List[str]) -> Any:
+    """兼容 SentenceTransformer（encode）和 OllamaEmbedder / LangChain（embed_documents）"""
+    if hasattr(embedder, "encode"):
+        return embedder.encode(texts)
+    return embedder.embed_documents(texts)
+
+
+def embed_query(embedder: Any, text: str) -> Any:
+    if hasattr(embedder, "encode"):
+        return embedder.encode(text)
+    return embedder.embed_query(text)
+
+
+def new_ids(count: int) -> List[int]:
+    """为 auto_id=False 的集合生成主键：毫秒时间戳左移 18 位加随机低位，与 Milvus 自动主键的量级一致"""
+    base = int(time.time() * 1000) << 18
+    low = random.sample(range(1 << 18), count) if count <= (1 << 18) else range(count)
+    return [base | i for i in low]
+
+
+def serving_collection_name() -> str:
+    """检索和写入当前使用的集合名：别名存在时使用别名，否则使用旧集合"""
+    from pymilvus import utility
+    return SERVING_ALIAS if utility.has_collection(SERVING_ALIAS) else LEGACY_COLLECTION
+
+
+def resolve_serving(default_spec: ModelSpec) -> Tuple[str, ModelSpec]:
+    """返回 (当前服务的物理集合名, 模型信息)；旧集合按 default_spec 处理"""
+    from pymilvus import Collection
+    collection = Collection(serving_collection_name())
+    spec, _ = read_spec(collection)
+    return collection.describe()["collection_name"], spec or default_spec
+
+
+def chunk_columns(collection: Any, ids: Optional[List[int]], texts: List[str], vectors: Any, sources: List[str],
+                  metadata: Optional[Dict[str, List[Any]]] = None) -> List[Any]:
+    """按集合 schema 的字段顺序组织写入数据；集合没有的元数据字段忽略，缺少的元数据填默认值"""
+    metadata = metadata or {}
+    columns = {"id": ids, "text": texts, "embedding": vectors, "source": sources}
+    for name in metadata_names(collection):
+        columns[name] = metadata.get(name) or [METADATA_DEFAULTS[name]] * len(texts)
+    return [columns[field.name] for field in collection.schema.fields
+            if not (field.name == "id" and ids is None)]
+
+
+def insert_chunks(collection: Any, texts: List[str], vectors: Any, sources: List[str],
+                  metadata: Optional[Dict[str, List[Any]]] = None) -> List[int]:
+    """写入片段，返回主键；兼容 auto_id 的旧集合和迁移创建的集合
+
+    Args:
+        metadata: 元数据字段名 -> 与 texts 对应的值列表（project / date / page）
+    """
+    if collection.schema.auto_id:
+        return list(collection.insert(chunk_columns(collection, None, texts, vectors, sources, metadata)).primary_keys)
+    ids = new_ids(len(texts))
+    collection.insert(chunk_columns(collection, ids, texts, vectors, sources, metadata))
+    return ids
+
+
+def create_collection(spec: ModelSpec, shadow_of: Optional[str] = None, partition_by_project: bool = False) -> Any:
+    from pymilvus import Collection, CollectionSchema, DataType, FieldSchema, utility
+
+    name = collection_name(spec)
+    if utility.has_collection(name):
+        return Collection(name)
+    fields = [
+        FieldSchema(name="id", dtype=DataType.INT64, is_primary=True, auto_id=False),
+        FieldSchema(name="text", dtype=DataType.VARCHAR, max_length=65535),
+        FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=spec.dim),
+        FieldSchema(name="source", dtype=DataType.VARCHAR, max_length=255),
+        *metadata_fields(partition_by_project),
+    ]
+    info = {"backend": spec.backend, "model": spec.model, "dim": spec.dim, "schema": SCHEMA_VERSION,
+            "shadow_of": shadow_of, "created_at": time.time()}
+    collection = Collection(name=name, schema=CollectionSchema(fields=fields, description=json.dumps(info)))
+    collection.create_index(field_name="embedding", index_params=INDEX_PARAMS)
+    create_scalar_indexes(collection)
+    return collection
+
+
+class DualWriter:
+    def __init__(self):
+        """写入端的双写钩子：有影子集合以当前集合为来源时，把新增和删除同步到影子集合"""
+        self._checked_at = 0.0
+        self._target: Optional[Tuple[str, ModelSpec]] = None
+        self._embedders: Dict[ModelSpec, Any] = {}
+        self._lock = threading.Lock()
+
+    def _shadow(self, source: str) -> Optional[Tuple[str, ModelSpec]]:
+        from pymilvus import Collection, utility
+
+        with self._lock:
+            if time.monotonic() - self._checked_at < DISCOVERY_TTL:
+                return self._target
+            target = None
+            for name in utility.list_collections():
+                if name.startswith(f"{LEGACY_COLLECTION}__"):
+                    spec, info = read_spec(Collection(name))
+                    if spec and info.get("shadow_of") == source and name != source:
+                        target = (name, spec)
+                        break
+            self._target = target
+            self._checked_at = time.monotonic()
+            return target
+
+    def insert(self, source_collection: str, ids: List[int], texts: List[str], sources: List[str],
+               metadata: Optional[Dict[str, List[Any]]] = None) -> None:
+        from pymilvus import Collection
+
+        shadow = self._shadow(source_collection)
+        if not shadow or not ids:
+            return
+        name, spec = shadow
+        if spec not in self._embedders:
+            self._embedders[spec] = make_embedder(spec)
+        vectors = embed_documents(self._embedders[spec], texts)
+        target = Collection(name)
+        target.upsert(chunk_columns(target, ids, texts, vectors, sources, metadata))
+
+    def delete(self, source_collection: str, expr: str) -> None:
+        from pymilvus import Collection
+
+        shadow = self._shadow(source_collection)
+        if shadow:
+            Collection(shadow[0]).delete(expr=expr)
+
+
+_dual_writer = DualWriter()
+
+
+def get_dual_writer() -> DualWriter:
+    return _dual_writer
+
+
+class ServingCollection:
+    def __init__(self, default_spec: ModelSpec, embedding_url: Optional[str] = None,
+                 refresh_interval: float = DISCOVERY_TTL):
+        """检索端使用的集合和查询模型；别名切换后在 refresh_interval 秒内跟随切换
+
+        Args:
+            default_spec: 旧集合（没有记录模型信息）使用的模型
+            embedding_url: 共享向量服务地址（sentence_transformers 模型）
+            refresh_interval: 检查别名指向的间隔（秒）
+        """
+        self.default_spec = default_spec
+        self.embedding_url = embedding_url
+        self.refresh_interval = refresh_interval
+        self.name: Optional[str] = None
+        self.spec: Optional[ModelSpec] = None
+        self.collection: Any = None
+        self.embedder: Any = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self) -> Tuple[Any, Any]:
+        """返回 (已加载的集合, 查询模型)"""
+        from pymilvus import Collection
+
+        with self._lock:
+            if self.collection is None or time.monotonic() - self._checked_at >= self.refresh_interval:
+                name, spec = resolve_serving(self.default_spec)
+                if name != self.name:
+                    collection = Collection(name)
+                    collection.load()
+                    if spec != self.spec:
+                        self.embedder = make_embedder(spec, self.embedding_url)
+                    if self.name:
+                        print(f"检索集合已切换: {self.name} -> {name}（{spec.model}）")
+                    self.name, self.spec, self.collection = name, spec, collection
+                self._checked_at = time.monotonic()
+            return self.collection, self.embedder
+
+
+class Migration:
+    def __init__(self, state_path: str = STATE_PATH, legacy_spec: ModelSpec = OLLAMA_SPEC):
+        """
+        Args:
+            state_path: 回填进度文件
+            legacy_spec: 旧集合 doc_embeddings 使用的模型
+        """
+        self.state_path = state_path
+        self.legacy_spec = legacy_spec
+        try:
+            with open(state_path, "r", encoding="utf-8") as f:
+                self.state = json.load(f)
+        except (OSError, ValueError):
+            self.state = {}
+
+    def _save(self) -> None:
+        temp_path = f"{self.state_path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, self.state_path)
+
+    def start(self, spec: ModelSpec, partition_by_project: bool = False) -> str:
+        """创建影子集合，写入端在 DISCOVERY_TTL 秒内开始双写
+
+        模型相同但来源集合缺少元数据字段时，迁移到带元数据字段和标量索引的新 schema
+
+        Args:
+            spec: 目标模型
+            partition_by_project: 影子集合以 project 作为分区键
+        """
+        from pymilvus import Collection
+
+        source, source_spec = resolve_serving(self.legacy_spec)
+        if spec == source_spec and len(metadata_names(Collection(source))) == len(METADATA_DEFAULTS):
+            raise ValueError(f"{source} 已经使用 {spec.model}，无需迁移")
+        target = create_collection(spec, shadow_of=source, partition_by_project=partition_by_project)
+        self.state = {"source": source, "target": target.name, "spec": spec._asdict(),
+                      "started_at": time.time(), "cutoff": None, "last_id": None, "copied": 0, "done": False}
+        self._save()
+        print(f"已创建影子集合 {target.name}，来源 {source}")
+        return target.name
+
+    def _max_id(self, collection: Any) -> Optional[int]:
+        max_id = None
+        iterator = collection.query_iterator(batch_size=10000, output_fields=["id"])
+        while True:
+            rows = iterator.next()
+            if not rows:
+                break
+            batch_max = max(row["id"] for row in rows)
+            max_id = batch_max if max_id is None else max(max_id, batch_max)
+        iterator.close()
+        return max_id
+
+    def backfill(self, rate: float = 100, batch_size: int = 64) -> int:
+        """把来源集合中的片段用目标模型重新编码后写入影子集合
+
+        Args:
+            rate: 每秒最多处理的片段数，避免影响线上检索和 Ollama / 向量服务
+            batch_size: 每批片段数
+
+        Returns:
+            本次写入的片段数
+        """
+        from pymilvus import Collection
+
+        if not self.state:
+            raise RuntimeError("没有进行中的迁移，请先执行 start")
+        # 等写入端都发现影子集合并开始双写，之后的新片段不需要回填
+        wait = self.state["started_at"] + DISCOVERY_TTL - time.time()
+        if wait > 0:
+            print(f"等待写入端开始双写（{wait:.0f}s）...")
+            time.sleep(wait)
+
+        source, target = Collection(self.state["source"]), Collection(self.state["target"])
+        source.load()
+        if self.state["cutoff"] is None:
+            self.state["cutoff"] = self._max_id(source)
+            self._save()
+        if self.state["cutoff"] is None:
+            return 0  # 来源集合为空
+
+        embedder = make_embedder(ModelSpec(**self.state["spec"]))
+        expr = f"id <= {self.state['cutoff']}"
+        if self.state["last_id"] is not None:
+            expr = f"id > {self.state['last_id']} and {expr}"
+        # 迁移前的集合没有元数据字段，回填时写入默认值，重新入库文档后补全
+        fields = metadata_names(source)
+        iterator = source.query_iterator(batch_size=batch_size, expr=expr,
+                                         output_fields=["id", "text", "source", *fields])
+        copied = 0
+        try:
+            while True:
+                start = time.perf_counter()
+                rows = iterator.next()
+                if not rows:
+                    break
+                ids = [row["id"] for row in rows]
+                vectors = embed_documents(embedder, [row["text"] for row in rows])
+                metadata = {name: [row[name] for row in rows] for name in fields}
+                target.upsert(chunk_columns(target, ids, [row["text"] for row in rows], vectors,
+                                            [row["source"] for row in rows], metadata))
+
+                # 读取之后来源中被删除的片段（文档被修改或删除），双写的删除可能早于这里的写入
+                remaining = {row["id"] for row in source.query(expr=f"id in {ids}", output_fields=["id"])}
+                deleted = [i for i in ids if i not in remaining]
+                if deleted:
+                    target.delete(expr=f"id in {deleted}")
+
+                copied += len(rows)
+                self.state["last_id"] = max(ids)
+                self.state["copied"] += len(rows)
+                self._save()
+                time.sleep(max(0.0, len(rows) / rate - (time.perf_counter() - start)))
+        finally:
+            iterator.close()
+        target.flush()
+        self.state["done"] = True
+        self._save()
+        print(f"回填完成，本次 {copied} 个片段，累计 {self.state['copied']} 个")
+        return copied
+
+    def status(self) -> Dict[str, Any]:
+        from pymilvus import Collection
+
+        if not self.state:
+            return {"serving": resolve_serving(self.legacy_spec)[0], "migration": None}
+        source, target = Collection(self.state["source"]), Collection(self.state["target"])
+        return {
+            "serving": resolve_serving(self.legacy_spec)[0],
+            "source": source.name,
+            "target": target.name,
+            "source_entities": source.num_entities,
+            "target_entities": target.num_entities,
+            "copied": self.state["copied"],
+            "backfill_done": self.state["done"],
+        }
+
+    def swap(self, force: bool = False) -> None:
+        """加载影子集合并把别名原子地指向它"""
+        from pymilvus import Collection
+
+        source, target = Collection(self.state["source"]), Collection(self.state["target"])
+        source.flush()
+        target.flush()
+        if not force and target.num_entities < source.num_entities:
+            raise RuntimeError(f"影子集合只有 {target.num_entities} 个片段，来源有 {source.num_entities} 个，"
+                               "请先完成 backfill（或使用 --force）")
+        target.load()  # 先加载，别名切换后第一次检索不需要等待
+        self._point_alias(target.name)
+        print(f"别名 {SERVING_ALIAS} 已指向 {target.name}，旧集合 {source.name} 保留，可执行 rollback")
+
+    def rollback(self) -> None:
+        from pymilvus import Collection
+
+        Collection(self.state["source"]).load()
+        self._point_alias(self.state["source"])
+        print(f"别名 {SERVING_ALIAS} 已指回 {self.state['source']}")
+
+    @staticmethod
+    def _point_alias(name: str) -> None:
+        from pymilvus import utility
+
+        if utility.has_collection(SERVING_ALIAS):
+            utility.alter_alias(name, SERVING_ALIAS)
+        else:
+            utility.create_alias(name, SERVING_ALIAS)
+
+
+if __name__ == "__main__":
+    from pymilvus import connections
+
+    parser = argparse.ArgumentParser(description="向量集合的不停机迁移")
+    parser.add_argument("command", choices=["start", "backfill", "status", "swap", "rollback"])
+    parser.add_argument("--backend", choices=["ollama", "sentence_transformers"], help="目标模型的后端")
+    parser.add_argument("--model", help="目标模型名称")
+    parser.add_argument("--dim", type=int, default=768, help="目标模型的向量维度")
+    parser.add_argument("--legacy-backend", choices=["ollama", "sentence_transformers"], default="ollama",
+                        help=f"旧集合 {LEGACY_COLLECTION} 使用的模型")
+    parser.add_argument("--rate", type=float, default=100, help="回填速度上限（片段/秒）")
+    parser.add_argument("--partition-by-project", action="store_true", help="影子集合以 project 作为分区键")
+    parser.add_argument("--force", action="store_true", help="片段数不一致时也切换")
+    parser.add_argument("--state", default=STATE_PATH, help="回填进度文件")
+    args = parser.parse_args()
+
+    connections.connect(host=MILVUS_HOST, port=MILVUS_PORT)
+    legacy = OLLAMA_SPEC if args.legacy_backend == "ollama" else SENTENCE_TRANSFORMERS_SPEC
+    migration = Migration(args.state, legacy)
+    if args.command == "start":
+        if not args.backend or not args.model:
+            parser.error("start 需要 --backend 和 --model")
+        migration.start(ModelSpec(args.backend, args.model, args.dim), args.partition_by_project)
+    elif args.command == "backfill":
+        migration.backfill(rate=args.rate)
+    elif args.command == "status":
+        print(json.dumps(migration.status(), ensure_ascii=False, indent=2))
+    elif args.command == "swap":
+        migration.swap(force=args.force)
+    else:
+        migration.rollback()
@@ -1,50 +1,69 @@
 # 文档 Embedding 的实现
 import os
-from typing import List
+import re
+import time
+from typing import Any, Dict, List, Tuple
 import fitz  # PyMuPDF
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.embeddings import OllamaEmbeddings
+from ChineseTextSplitter import ChineseTextSplitter
 from pymilvus import connections, Collection, FieldSchema, CollectionSchema, DataType, utility
+from ChunkDedup import ChunkDedupIndex, remove_boilerplate, transfer_owned
+from ParentChildIndex import ParentChildSplitter, ParentDocStore, delete_orphan_parents
+from CollectionMigration import (OLLAMA_SPEC, create_scalar_indexes, get_dual_writer, insert_chunks, metadata_fields,
+                                 metadata_names, resolve_serving, serving_collection_name)
 import numpy as np
+from OllamaEmbedder import OllamaEmbedder
 
 class DocEmbedding:
-    def __init__(self, milvus_host: str = "192.168.0.245", milvus_port: str = "19530"):
+    def __init__(self, milvus_host: str = "192.168.0.245", milvus_port: str = "19530",
+                 partition_by_project: bool = False, skip_near: bool = False):
+        """
+        Args:
+            partition_by_project: 新建集合时以 project 作为分区键（按项目分区存储，按项目检索时只搜索对应分区）
+            skip_near: 近似重复的片段也不生成向量（默认只跳过完全相同的片段）
+        """
         # 初始化 Milvus 连接
         connections.connect(host=milvus_host, port=milvus_port)
         
-        # 初始化文本分割器
-        self.text_splitter = RecursiveCharacterTextSplitter(
+        # 初始化文本分割器（按中文句末标点和 PDF 版式换行切分，逐页流式处理）
+        self.text_splitter = ChineseTextSplitter(
             chunk_size=500,
             chunk_overlap=100,
             length_function=len,
         )
         
-        # 初始化 Ollama embeddings
-        self.embeddings = OllamaEmbeddings(
+        # 初始化 Ollama embeddings（/api/embed 批量请求，多个请求并发，返回 float32 数组）
+        self.embeddings = OllamaEmbedder(
             model="nomic-embed-text",
             base_url="http://192.168.0.245:11434"
         )
         
+        # 父子索引：集合有 parent_id 字段时，约 250 字的子块生成向量，约 1200 字的父窗口存入 docstore
+        self.parent_child_splitter = ParentChildSplitter()
+        self.docstore = ParentDocStore()
+        
         # 创建或获取集合
         self.collection_name = "doc_embeddings"
+        self.partition_by_project = partition_by_project
         self._setup_collection()
+        self.parent_child = "parent_id" in metadata_names(self.collection)
+        
+        # 重复片段索引：按集合记录，跨文件、跨多次运行识别同一项目内完全相同的片段，重复片段只记录引用，不再生成向量
+        self.dedup = ChunkDedupIndex(collection=self.collection, skip_near=skip_near)
     
     def _setup_collection(self):
-        """设置或获取 Milvus 集合"""
-        # 如果集合存在且维度不匹配，则删除它
-        if utility.has_collection(self.collection_name):
-            collection = Collection(self.collection_name)
-            if collection.schema.fields[2].params["dim"] != 768:  # 检查 embedding 字段的维度
-                utility.drop_collection(self.collection_name)
-                print("已删除维度不匹配的旧集合")
-                
-        if not utility.has_collection(self.collection_name):
+        """设置或获取 Milvus 集合
+
+        别名 doc_search 存在时写入它指向的集合。维度或模型不匹配时不再删除集合
+        （删除后检索会中断到全量重建完成），更换模型请使用 CollectionMigration.py 迁移。
+        """
+        if not utility.has_collection(serving_collection_name()):
             # 定义集合的字段
             fields = [
                 FieldSchema(name="id", dtype=DataType.INT64, is_primary=True, auto_id=True),
                 FieldSchema(name="text", dtype=DataType.VARCHAR, max_length=65535),
                 FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=768),  # nomic-embed-text 模型的向量维度是 768
                 FieldSchema(name="source", dtype=DataType.VARCHAR, max_length=255),
+                *metadata_fields(self.partition_by_project),  # project / date / page
             ]
             
             # 创建集合
@@ -58,29 +77,109 @@ class DocEmbedding:
                 "params": {"nlist": 1024}
             }
             collection.create_index(field_name="embedding", index_params=index_params)
-        else:
-            collection = Collection(self.collection_name)
-        
+            create_scalar_indexes(collection)
+        name, spec = resolve_serving(OLLAMA_SPEC)
+        collection = Collection(name)
+        self.collection_name = name
+
+        dim = next(f.params["dim"] for f in collection.schema.fields if f.name == "embedding")
+        if dim != 768 or spec.model != OLLAMA_SPEC.model:  # 检查 embedding 字段的维度和模型
+            raise ValueError(f"集合 {name} 使用 {spec.model}（{dim} 维），与当前模型不一致，"
+                             "请使用 CollectionMigration.py 迁移")
+
         self.collection = collection
     
     def extract_text_from_pdf(self, pdf_path: str) -> str:
         """从 PDF 文件中提取文本"""
-        doc = fitz.open(pdf_path)
-        text = ""
-        for page in doc:
-            text += page.get_text()
-        return text
+        return "".join(self.iter_pdf_pages(pdf_path))
+
+    def iter_pdf_pages(self, pdf_path: str):
+        """逐页提取 PDF 文本"""
+        with fitz.open(pdf_path) as doc:
+            for page in doc:
+                yield page.get_text()
+
+    def split_document(self, pdf_path: str, source: str
+                       ) -> Tuple[List[Tuple[str, int, str]], List[Tuple[str, str, int]]]:
+        """提取并切分文档，切分前去掉每页重复的页眉页脚
+
+        Returns:
+            ([(用于生成向量的片段, 起始页码, parent_id)], [(parent_id, 父窗口文本, 起始页码)])；
+            集合没有 parent_id 字段时按 500/100 切分，没有父窗口
+        """
+        pages = remove_boilerplate(list(self.iter_pdf_pages(pdf_path)))
+        if self.parent_child:
+            return self.parent_child_splitter.split_pages(pages, source)
+        return [(chunk, page, "") for chunk, page in self.text_splitter.split_pages_with_numbers(pages)], []
+
+    def document_metadata(self, pdf_path: str, project: str = None, mtime_ns: int = None) -> Dict[str, Any]:
+        """文档级元数据
+
+        Args:
+            pdf_path: PDF 文件路径
+            project: 项目名称，默认为文档所在目录名
+            mtime_ns: 原始文件的修改时间（纳秒），默认使用 pdf_path 的修改时间；
+                      处理下载到临时目录的副本时由调用方传入
+
+        Returns:
+            project，以及 date（PDF 创建日期，没有时使用文件修改日期，格式 yyyymmdd）
+        """
+        with fitz.open(pdf_path) as doc:
+            info = doc.metadata or {}
+        match = re.match(r"D:(\d{8})", info.get("creationDate") or info.get("modDate") or "")
+        if match:
+            date = int(match.group(1))
+        else:
+            mtime = mtime_ns / 1e9 if mtime_ns is not None else os.path.getmtime(pdf_path)
+            date = int(time.strftime("%Y%m%d", time.localtime(mtime)))
+        return {
+            "project": project or os.path.basename(os.path.dirname(os.path.abspath(pdf_path))),
+            "date": date,
+        }
+
+    def chunk_metadata(self, document: Dict[str, Any], chunks: List[str],
+                       pieces: List[Tuple[str, int, str]]) -> Dict[str, List[Any]]:
+        """去重后剩余片段的元数据列（页码和父窗口取片段在文档中第一次出现的位置）"""
+        first = {}
+        for chunk, page, pid in pieces:
+            first.setdefault(chunk, (page, pid))
+        return {
+            "project": [document["project"]] * len(chunks),
+            "date": [document["date"]] * len(chunks),
+            "page": [first.get(chunk, (0, ""))[0] for chunk in chunks],
+            "parent_id": [first.get(chunk, (0, ""))[1] for chunk in chunks],
+        }
     
-    def process_document(self, file_path: str):
-        """处理单个文档"""
-        # 提取文本
-        text = self.extract_text_from_pdf(file_path)
+    def process_document(self, file_path: str, source: str = None, project: str = None, mtime_ns: int = None,
+                         raise_errors: bool = False):
+        """处理单个文档
+
+        Args:
+            file_path: PDF 文件路径
+            source: 写入 source 字段的来源名称，默认为文件名
+            project: 写入 project 字段的项目名称，默认为文档所在目录名
+            mtime_ns: 原始文件的修改时间（纳秒），PDF 没有创建日期时用于 date 字段
+            raise_errors: 写入 Milvus 失败时抛出异常（增量入库据此保留事件重试），默认只打印错误
+        """
+        # 逐页提取并分割文本
+        source = source or os.path.basename(file_path)
+        pieces, parents = self.split_document(file_path, source)
+        chunks = [chunk for chunk, _, _ in pieces]
         
-        # 分割文本
-        chunks = self.text_splitter.split_text(text)
+        # 跳过同一项目中已入库的重复片段（只记录引用）
+        document = self.document_metadata(file_path, project, mtime_ns)
+        total = len(chunks)
+        chunks, chunk_ids = self.dedup.filter(chunks, source, document["project"])
+        if not chunks:
+            print(f"All {total} chunks from {file_path} are duplicates, nothing to embed")
+            return
         
         # 生成嵌入向量
-        embeddings = self.embeddings.embed_documents(chunks)
+        try:
+            embeddings = self.embeddings.embed_documents(chunks)
+        except Exception:
+            self.dedup.discard(chunk_ids)
+            raise
         
         # 确保向量维度正确
         for i, emb in enumerate(embeddings):
@@ -89,30 +188,54 @@ class DocEmbedding:
                 continue
         
         # 准备数据
-        data = [
-            chunks,  # text
-            embeddings,  # embedding
-            [os.path.basename(file_path)] * len(chunks)  # source
-        ]
+        sources = [source] * len(chunks)
+        metadata = self.chunk_metadata(document, chunks, pieces)
         
         # 插入数据到 Milvus
         try:
-            self.collection.insert(data)
+            ids = insert_chunks(self.collection, chunks, embeddings, sources, metadata)
             self.collection.flush()
-            print(f"Successfully inserted {len(chunks)} chunks from {file_path}")
+            self.dedup.attach(chunk_ids, ids)
+            self.docstore.add(source, parents)
+            # 有进行中的模型迁移时，同时用目标模型写入影子集合
+            get_dual_writer().insert(self.collection_name, ids, chunks, sources, metadata)
+            print(f"Successfully inserted {len(chunks)} chunks from {file_path} "
+                  f"({total - len(chunks)} duplicates skipped)")
         except Exception as e:
+            self.dedup.discard(chunk_ids)
             print(f"Error inserting data: {str(e)}")
             print(f"Number of chunks: {len(chunks)}")
-            print(f"Embedding shape: {len(embeddings)} x {len(embeddings[0]) if embeddings else 'None'}")
+            print(f"Embedding shape: {len(embeddings)} x {len(embeddings[0]) if len(embeddings) else 'None'}")
+            if raise_errors:
+                raise
     
-    def process_directory(self, directory_path: str):
-        """处理目录中的所有 PDF 文件"""
+    def delete_source(self, source: str) -> int:
+        """删除某个来源文档的全部片段（文档被修改或删除时调用）
+
+        其他文档仍引用的片段先转给引用它的文档，向量直接复用。
+        """
+        transfer_owned(self.collection, self.dedup, source)
+        escaped = source.replace('\\', '\\\\').replace('"', '\\"')
+        expr = f'source == "{escaped}"'
+        result = self.collection.delete(expr=expr)
+        get_dual_writer().delete(self.collection_name, expr)
+        delete_orphan_parents(self.collection, self.docstore, source)
+        return result.delete_count
+
+    def process_directory(self, directory_path: str, project: str = None):
+        """处理目录中的所有 PDF 文件
+
+        Args:
+            directory_path: 目录路径
+            project: 项目名称，默认为目录名
+        """
         for filename in os.listdir(directory_path):
             if filename.endswith('.pdf'):
                 file_path = os.path.join(directory_path, filename)
                 print(f"Processing {filename}...")
-                self.process_document(file_path)
+                self.process_document(file_path, project=project)
                 print(f"Completed processing {filename}")
+        print(f"去重统计: {self.dedup.report()}")
 
 if __name__ == "__main__":
     # 使用示例
@@ -0,0 +1,214 @@
+# 增量入库：订阅 MCP 文件服务的变更事件，只对新增或修改的 PDF 生成向量并写入 doc_embeddings
+#
+# - 通过 /api/files/changes 长轮询获取事件，文件上传后几秒内即可被检索到，不再手动全量执行 process_directory
+# - 已处理的事件序号和每个 PDF 的大小 / 修改时间保存在本地状态文件中，重启后从断点继续
+# - 同一批事件按路径合并，只处理最终状态；文件被修改时先删除旧片段再重新写入，被删除时删除其片段
+# - 事件日志被清理导致中间有缺失时，通过服务端的文件名检索按路径翻页取得完整列表，对比一次 PDF 列表
+#   （不扫描目录、不重复嵌入未变化的文件；列表不完整时不产生删除）
+#
+# 用法：
+#   python DocIngestWorker.py                 # 持续运行
+#   python DocIngestWorker.py --once          # 处理完当前积压的事件后退出
+#   python DocIngestWorker.py --skip-near     # 近似重复的片段也跳过，不生成向量
+
+import argparse
+import json
+import os
+import tempfile
+import time
+from typing import Dict, Any, List, Optional
+
+import requests
+
+from LLMMCP import FileServiceClient, FILE_SERVICE_URL
+
+DEFAULT_STATE_PATH = "ingest_state.json"
+POLL_TIMEOUT = 25  # 长轮询的等待时间（秒）
+RETRY_DELAY = 5  # 文件服务不可用时的重试间隔（秒）
+RESYNC_PAGE_SIZE = 1000  # 对比文件列表时每页的条数
+
+
+class ResyncError(RuntimeError):
+    pass
+
+
+def source_project(path: str) -> str:
+    """文件服务中的相对路径对应的项目名：所在目录名，根目录下的文件为空"""
+    return os.path.basename(os.path.dirname(path.replace("\\", "/")))
+
+
+class IngestWorker:
+    def __init__(
+        self,
+        embedder: Any = None,
+        files: Optional[FileServiceClient] = None,
+        state_path: str = DEFAULT_STATE_PATH,
+        extensions: tuple = (".pdf",),
+    ):
+        """初始化入库进程
+
+        Args:
+            embedder: 提供 process_document(path, source, project, mtime_ns, raise_errors) 和 delete_source(source) 的对象，
+                      默认使用 DocEmbeddingOllama.DocEmbedding
+            files: 文件服务客户端
+            state_path: 本地状态文件路径
+            extensions: 需要入库的文件扩展名
+        """
+        if embedder is None:
+            from DocEmbeddingOllama import DocEmbedding
+            embedder = DocEmbedding()
+        self.embedder = embedder
+        self.files = files or FileServiceClient(FILE_SERVICE_URL)
+        self.state_path = state_path
+        self.extensions = extensions
+        self.state = self._load_state()
+
+    def _load_state(self) -> Dict[str, Any]:
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+        state.setdefault("since", 0)
+        state.setdefault("files", {})  # path -> {"size", "mtime_ns"}
+        state.setdefault("failed", {})  # path -> 最近一次事件，下一轮重试
+        return state
+
+    def _save_state(self) -> None:
+        temp_path = f"{self.state_path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False)
+        os.replace(temp_path, self.state_path)
+
+    def _wanted(self, path: str) -> bool:
+        return path.lower().endswith(self.extensions)
+
+    def ingest(self, path: str, size: Optional[int], mtime_ns: Optional[int]) -> None:
+        """下载文件并重新生成该文件的全部片段"""
+        known = self.state["files"].get(path)
+        if known and known["size"] == size and known["mtime_ns"] == mtime_ns:
+            return  # 内容未变化（例如重复事件）
+
+        fd, temp_path = tempfile.mkstemp(suffix=os.path.splitext(path)[1])
+        os.close(fd)
+        try:
+            self.files.download(path, temp_path)
+            if known:
+                self.embedder.delete_source(path)
+            # 临时文件的目录和修改时间没有意义，项目名和日期取自文件服务中的路径和修改时间；
+            # 写入失败时抛出异常，事件进入 failed 重试，state["files"] 不更新
+            self.embedder.process_document(temp_path, source=path, project=source_project(path), mtime_ns=mtime_ns,
+                                           raise_errors=True)
+        finally:
+            os.remove(temp_path)
+        self.state["files"][path] = {"size": size, "mtime_ns": mtime_ns}
+
+    def remove(self, path: str) -> None:
+        if path in self.state["files"]:
+            self.embedder.delete_source(path)
+            del self.state["files"][path]
+
+    def apply(self, events: List[Dict[str, Any]]) -> None:
+        """处理一批事件：按路径合并后只处理每个文件的最终状态"""
+        latest: Dict[str, Dict[str, Any]] = dict(self.state["failed"])
+        for event in events:
+            if self._wanted(event["path"]):
+                latest[event["path"]] = event
+        self.state["failed"] = {}
+
+        for path, event in latest.items():
+            start = time.perf_counter()
+            try:
+                if event["type"] == "deleted":
+                    self.remove(path)
+                    action = "删除"
+                else:
+                    self.ingest(path, event["size"], event["mtime_ns"])
+                    action = "入库"
+                print(f"{action} {path}，耗时 {time.perf_counter() - start:.1f}s")
+            except requests.exceptions.HTTPError as e:
+                if e.response is not None and e.response.status_code == 404:
+                    self.remove(path)  # 处理前文件已被删除，后续会收到删除事件
+                else:
+                    print(f"处理 {path} 失败，稍后重试: {str(e)}")
+                    self.state["failed"][path] = event
+            except Exception as e:
+                print(f"处理 {path} 失败，稍后重试: {str(e)}")
+                self.state["failed"][path] = event
+
+    def list_all(self) -> Optional[Dict[str, Dict[str, Any]]]:
+        """按路径翻页获取服务端的完整文件列表，扩展名不区分大小写
+
+        Returns:
+            path -> 文件信息；服务端不支持翻页、无法确认列表完整时返回 None
+        """
+        current = {}
+        after = None
+        while True:
+            page = self.files.search(name="*", limit=RESYNC_PAGE_SIZE, after=after)
+            if "results" not in page:
+                raise ResyncError(f"获取文件列表失败: {page.get('error')}")
+            for item in page["results"]:
+                if self._wanted(item["path"]):
+                    current[item["path"]] = item
+            if "next_after" not in page:
+                return None
+            after = page["next_after"]
+            if after is None:
+                return current
+
+    def resync(self) -> None:
+        """事件有缺失时，与服务端当前的文件列表对比一次
+
+        只有确认拿到完整列表时才把本地有、服务端没有的文件当作已删除，避免误删片段。
+        """
+        print("变更日志有缺失，与服务端文件列表对比...")
+        current = self.list_all()
+        if current is None:
+            raise ResyncError("文件服务不支持列表翻页，无法确认列表完整，跳过本次对比")
+        events = [{"type": "deleted", "path": path} for path in self.state["files"] if path not in current]
+        for path, item in current.items():
+            known = self.state["files"].get(path)
+            if not known or known["size"] != item["size"] or known["mtime_ns"] != item["mtime_ns"]:
+                events.append({"type": "modified", "path": path, "size": item["size"], "mtime_ns": item["mtime_ns"]})
+        self.apply(events)
+
+    def poll_once(self, timeout: float = POLL_TIMEOUT) -> int:
+        """获取并处理一批事件，返回事件数"""
+        feed = self.files.changes(since=self.state["since"], timeout=timeout)
+        if feed.get("truncated"):
+            self.resync()
+        self.apply(feed["events"])
+        self.state["since"] = feed["next_since"]
+        self._save_state()
+        return len(feed["events"])
+
+    def run(self, once: bool = False) -> None:
+        print(f"开始订阅文件变更，从事件 {self.state['since']} 继续")
+        while True:
+            try:
+                count = self.poll_once(timeout=0 if once else POLL_TIMEOUT)
+                if once and count == 0:
+                    break
+            except (requests.exceptions.RequestException, ResyncError) as e:
+                print(f"文件服务不可用: {str(e)}，{RETRY_DELAY} 秒后重试")
+                if once:
+                    break
+                time.sleep(RETRY_DELAY)
+            except KeyboardInterrupt:
+                break
+        self._save_state()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="订阅文件服务变更，增量生成 PDF 向量")
+    parser.add_argument("--url", default=FILE_SERVICE_URL, help="文件服务地址")
+    parser.add_argument("--state", default=DEFAULT_STATE_PATH, help="本地状态文件")
+    parser.add_argument("--once", action="store_true", help="处理完当前积压的事件后退出")
+    parser.add_argument("--skip-near", action="store_true", help="近似重复的片段也不生成向量（默认只跳过完全相同的片段）")
+    args = parser.parse_args()
+
+    from DocEmbeddingOllama import DocEmbedding
+    worker = IngestWorker(embedder=DocEmbedding(skip_near=args.skip_near), files=FileServiceClient(args.url),
+                          state_path=args.state)
+    worker.run(once=args.once)
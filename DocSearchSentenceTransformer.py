@@ -2,46 +2,65 @@
 
 import os
 from typing import List, Dict, Any
-from sentence_transformers import SentenceTransformer
-from pymilvus import connections, Collection, utility
-import fitz  # PyMuPDF
+from CollectionMigration import SENTENCE_TRANSFORMERS_SPEC, ServingCollection, build_filter, embed_query, metadata_names
+from ParentChildIndex import CHILD_OVERSAMPLE, ParentDocStore, expand_parents
+DEDUP_DB_PATH = "dedup_index.db"  # 与 ChunkDedup.DEFAULT_DB_PATH 一致
+DOCSTORE_PATH = "docstore.db"  # 父窗口存储，与 ParentChildIndex.DEFAULT_DB_PATH 一致
+# 向量模型、pymilvus 和 PyMuPDF 导入较慢，在用到它们的方法中再导入
 
 class DocSearch:
-    def __init__(self, milvus_host: str = "192.168.0.245", milvus_port: str = "19530"):
+    def __init__(self, milvus_host: str = "192.168.0.245", milvus_port: str = "19530",
+                 embedding_url: str = None):
+        """
+        Args:
+            embedding_url: 共享向量服务（EmbeddingServer.py）地址，服务未启动时在当前进程加载模型
+        """
+        from pymilvus import connections
+
         # 初始化 Milvus 连接
         connections.connect(host=milvus_host, port=milvus_port)
-        
-        # 初始化 SentenceTransformer embeddings
-        self.embeddings = SentenceTransformer('moka-ai/m3e-base')
-        
-        # 获取集合
-        self.collection_name = "doc_embeddings"
-        self.collection = Collection(self.collection_name)
-        self.collection.load()
-        
+
+        # 获取集合：别名 doc_search 切换到新模型的集合后（CollectionMigration.py），查询模型随之切换
+        self.serving = ServingCollection(SENTENCE_TRANSFORMERS_SPEC, embedding_url)
+        self.collection, self.embeddings = self.serving.get()
+        self.collection_name = self.serving.name
+
+        # 入库时生成的重复片段索引：重复片段只入库一次，检索结果附带包含该片段的全部文档
+        self.dedup = None
+        if os.path.exists(DEDUP_DB_PATH):
+            from ChunkDedup import ChunkDedupIndex
+            self.dedup = ChunkDedupIndex(DEDUP_DB_PATH)
+
+        # 父子索引的父窗口存储：检索命中子块，返回所属父窗口的文本
+        self.docstore = None
+        if os.path.exists(DOCSTORE_PATH):
+            self.docstore = ParentDocStore(DOCSTORE_PATH)
+
         # 检查集合中的实体数量
-        collection = Collection("doc_embeddings")
-        print(f"集合中的实体数量: {collection.num_entities}")
+        print(f"集合中的实体数量: {self.collection.num_entities}")
     
-    def search(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
+    def search(self, query: str, top_k: int = 5, filter: Any = None) -> List[Dict[str, Any]]:
         """
         搜索与查询文本最相关的文档片段
         
         Args:
             query: 搜索文本
             top_k: 返回最相关的前 k 个结果
+            filter: 过滤条件，在向量检索内部执行（不是对 top_k 结果后过滤），可以是 Milvus 表达式或字典，
+                例如 {"project": "朔黄", "date": {">=": 20230101}}，见 CollectionMigration.build_filter
             
         Returns:
             包含搜索结果信息的列表，每个结果包含：
-            - text: 匹配的文本片段
+            - text: 匹配的文本片段；父子索引时为命中子块所属的父窗口（同一父窗口只返回一次）
+            - child_text: 父子索引时命中的子块
             - source: 来源文档
+            - sources: 包含该片段的全部文档
+            - project / date / page: 项目、文档日期、起始页码（集合有这些字段时）
             - score: 相似度分数
         """
         # 将查询文本转换为向量
-        # query_embedding = self.embeddings.embed_query(query)
-        
-        # 生成嵌入向量
-        query_embedding = self.embeddings.encode(query)
+        self.collection, self.embeddings = self.serving.get()
+        query_embedding = embed_query(self.embeddings, query)
         
         # 检查向量维度
         print(f"向量维度: {query_embedding}")
@@ -54,26 +73,41 @@ class DocSearch:
             "params": {"nprobe": 10}
         }
         
+        # 过滤条件下推到 Milvus：先按标量索引（以及 project 分区键）缩小范围，再做向量检索
+        fields = metadata_names(self.collection)
+        expr = build_filter(filter, ["source", *fields])
+
+        # 父子索引：多取几倍子块，按父窗口去重后仍有 top_k 个结果
+        parent_child = self.docstore is not None and "parent_id" in fields
+        limit = top_k * CHILD_OVERSAMPLE if parent_child else top_k
+
         # 执行向量搜索
         results = self.collection.search(
             data=[query_embedding],
             anns_field="embedding",
             param=search_params,
-            limit=top_k,
-            output_fields=["text", "source"]
+            limit=limit,
+            expr=expr or None,
+            output_fields=["text", "source", *fields]
         )
         print(f"搜索结果: {results}")
         # 处理搜索结果
+        references = (self.dedup.references([hit.id for hits in results for hit in hits], self.collection.name)
+                      if self.dedup else {})
         search_results = []
         for hits in results:
             for hit in hits:
                 result = {
                     "text": hit.entity.get("text"),
                     "source": hit.entity.get("source"),
+                    **{name: hit.entity.get(name) for name in fields},
+                    "sources": references.get(hit.id) or [hit.entity.get("source")],
                     "score": hit.score
                 }
                 search_results.append(result)
         
+        if parent_child:
+            search_results = expand_parents(search_results, self.docstore, top_k)
         return search_results
     
     def get_context_from_pdf(self, pdf_path: str, text: str) -> Dict[str, Any]:
@@ -89,6 +123,8 @@ class DocSearch:
             - page_number: 页码
             - surrounding_text: 周围文本
         """
+        import fitz  # PyMuPDF
+
         doc = fitz.open(pdf_path)
         for page_num in range(len(doc)):
             page = doc[page_num]
@@ -0,0 +1,391 @@
+# 常驻的 SentenceTransformer 向量服务：模型只在一个进程中加载一次，多个检索 / 入库进程通过本机 HTTP 共享
+#
+# - 动态批处理：并发到达的请求合并成一个批次调用 model.encode，第一个请求最多等待 max_wait_ms 毫秒凑批
+# - 向量以 float32 二进制返回（X-Embedding-Shape 头给出形状），避免把 768 维浮点数编码成 JSON
+# - GET /metrics 返回队列深度、批次数、平均批大小、平均等待 / 编码耗时，用于判断是否需要更多实例
+# - 排队的文本数超过 max_queue 时返回 503，调用方退避重试，而不是无限堆积
+#
+# 用法：
+#   python EmbeddingServer.py --model moka-ai/m3e-base --port 8765
+#   DocSearchSentenceTransformer / DocEmbeddingSentenceTransformer 通过 load_embeddings() 自动使用该服务，
+#   服务未启动时退回进程内加载模型
+
+import argparse
+import json
+import os
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Union
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import requests
+
+from HttpClient import HttpClient, backoff_delay, get_client
+
+DEFAULT_MODEL = "moka-ai/m3e-base"
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_URL = f"http://{DEFAULT_HOST}:{DEFAULT_PORT}"
+DEFAULT_MAX_BATCH_SIZE = 64
+DEFAULT_MAX_WAIT_MS = 5.0
+DEFAULT_MAX_QUEUE = 10000  # 排队文本数上限
+CLIENT_CHUNK_SIZE = 512  # 客户端单次请求最多携带的文本数
+CLIENT_RETRIES = 5  # 服务端队列已满（503）时的重试次数
+
+
+class QueueFullError(RuntimeError):
+    pass
+
+
+class _Pending:
+    __slots__ = ("texts", "enqueued", "done", "result", "error")
+
+    def __init__(self, texts: List[str]):
+        self.texts = texts
+        self.enqueued = time.perf_counter()
+        self.done = threading.Event()
+        self.result: Optional[np.ndarray] = None
+        self.error: Optional[BaseException] = None
+
+
+class DynamicBatcher:
+    def __init__(
+        self,
+        encode: Callable[[List[str]], np.ndarray],
+        max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+        max_wait_ms: float = DEFAULT_MAX_WAIT_MS,
+        max_queue: int = DEFAULT_MAX_QUEUE,
+    ):
+        """把并发的编码请求合并成批次，由单个后台线程调用模型
+
+        Args:
+            encode: 批量编码函数，输入文本列表，返回 (n, dim) 数组
+            max_batch_size: 每个批次的最大文本数（单个请求超过该值时单独成批）
+            max_wait_ms: 批次中第一个请求最多等待多久凑批
+            max_queue: 排队文本数上限，超过时 submit 抛出 QueueFullError
+        """
+        self.encode = encode
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_queue = max_queue
+        self._queue: deque = deque()
+        self._queued_texts = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self._stats = {"requests": 0, "texts": 0, "batches": 0, "rejected": 0, "errors": 0,
+                       "wait_seconds": 0.0, "encode_seconds": 0.0}
+        self._thread = threading.Thread(target=self._loop, name="embedding-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, texts: List[str], timeout: Optional[float] = None) -> np.ndarray:
+        """提交一组文本并等待结果"""
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        pending = _Pending(list(texts))
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("DynamicBatcher is closed")
+            if self._queued_texts + len(texts) > self.max_queue:
+                self._stats["rejected"] += 1
+                raise QueueFullError(f"queue full ({self._queued_texts} texts waiting)")
+            self._queue.append(pending)
+            self._queued_texts += len(texts)
+            self._cond.notify()
+        if not pending.done.wait(timeout):
+            raise TimeoutError("embedding request timed out")
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def _next_batch(self) -> List[_Pending]:
+        with self._cond:
+            while not self._queue and not self._closed:
+                self._cond.wait()
+            if not self._queue:
+                return []
+            # 从最早的请求入队开始计时，模型忙时积压的请求不需要再等待
+            deadline = self._queue[0].enqueued + self.max_wait
+            while self._queued_texts < self.max_batch_size and not self._closed:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch = [self._queue.popleft()]
+            size = len(batch[0].texts)
+            while self._queue and size + len(self._queue[0].texts) <= self.max_batch_size:
+                size += len(self._queue[0].texts)
+                batch.append(self._queue.popleft())
+            self._queued_texts -= size
+            return batch
+
+    def _loop(self) -> None:
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return
+            texts = [text for pending in batch for text in pending.texts]
+            start = time.perf_counter()
+            try:
+                vectors = np.asarray(self.encode(texts), dtype=np.float32)
+                error = None
+            except Exception as e:
+                vectors, error = None, e
+            finished = time.perf_counter()
+
+            offset = 0
+            for pending in batch:
+                if error is None:
+                    pending.result = vectors[offset:offset + len(pending.texts)]
+                    offset += len(pending.texts)
+                else:
+                    pending.error = error
+                pending.done.set()
+
+            with self._cond:
+                stats = self._stats
+                stats["requests"] += len(batch)
+                stats["texts"] += len(texts)
+                stats["batches"] += 1
+                stats["errors"] += error is not None
+                stats["wait_seconds"] += sum(start - p.enqueued for p in batch)
+                stats["encode_seconds"] += finished - start
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._cond:
+            stats = dict(self._stats)
+            queue_depth = len(self._queue)
+            queued_texts = self._queued_texts
+        batches = stats["batches"] or 1
+        requests_done = stats["requests"] or 1
+        return {
+            "queue_depth": queue_depth,
+            "queued_texts": queued_texts,
+            "requests": stats["requests"],
+            "texts": stats["texts"],
+            "batches": stats["batches"],
+            "rejected": stats["rejected"],
+            "errors": stats["errors"],
+            "avg_batch_size": round(stats["texts"] / batches, 2),
+            "avg_wait_ms": round(stats["wait_seconds"] * 1000 / requests_done, 3),
+            "avg_encode_ms": round(stats["encode_seconds"] * 1000 / batches, 3),
+        }
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+
+def make_handler(batcher: DynamicBatcher, model_name: str, dimension: int):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # 支持 keep-alive
+        disable_nagle_algorithm = True
+
+        def _send(self, status: int, body: bytes, content_type: str = "application/json",
+                  headers: Optional[Dict[str, str]] = None) -> None:
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_json(self, status: int, data: Dict[str, Any]) -> None:
+            self._send(status, json.dumps(data, ensure_ascii=False).encode("utf-8"))
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._send_json(200, {"status": "ok", "model": model_name, "dimension": dimension})
+            elif self.path == "/metrics":
+                self._send_json(200, batcher.metrics())
+            else:
+                self._send_json(404, {"error": "Not found"})
+
+        def do_POST(self):
+            url = urlsplit(self.path)
+            if url.path != "/encode":
+                self._send_json(404, {"error": "Not found"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                data = json.loads(self.rfile.read(length) or b"{}")
+                texts = data["texts"]
+                if not isinstance(texts, list) or not all(isinstance(t, str) for t in texts):
+                    raise ValueError("texts must be a list of strings")
+            except (ValueError, KeyError) as e:
+                self._send_json(400, {"error": f"Invalid request: {e}"})
+                return
+
+            try:
+                vectors = batcher.submit(texts)
+            except QueueFullError as e:
+                self._send_json(503, {"error": str(e)})
+                return
+            except Exception as e:
+                self._send_json(500, {"error": f"Encoding failed: {e}"})
+                return
+
+            if data.get("normalize_embeddings"):
+                norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+                vectors = vectors / np.maximum(norms, 1e-12)
+            if parse_qs(url.query).get("format") == ["json"]:
+                self._send_json(200, {"embeddings": vectors.tolist()})
+            else:
+                vectors = np.ascontiguousarray(vectors, dtype="<f4")
+                self._send(200, vectors.tobytes(), "application/octet-stream",
+                           {"X-Embedding-Shape": f"{len(texts)},{dimension}"})
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def serve(
+    model_name: str = DEFAULT_MODEL,
+    host: str = DEFAULT_HOST,
+    port: int = DEFAULT_PORT,
+    max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+    max_wait_ms: float = DEFAULT_MAX_WAIT_MS,
+    max_queue: int = DEFAULT_MAX_QUEUE,
+    device: Optional[str] = None,
+) -> None:
+    """加载模型并启动向量服务（阻塞运行）"""
+    from sentence_transformers import SentenceTransformer
+
+    start = time.perf_counter()
+    model = SentenceTransformer(model_name, device=device)
+    dimension = model.get_sentence_embedding_dimension()
+    model.encode(["warmup"])  # 预热，第一次请求不再承担初始化开销
+    print(f"模型 {model_name} 已加载（{dimension} 维），耗时 {time.perf_counter() - start:.1f}s")
+
+    batcher = DynamicBatcher(
+        lambda texts: model.encode(texts, batch_size=max_batch_size, convert_to_numpy=True),
+        max_batch_size=max_batch_size, max_wait_ms=max_wait_ms, max_queue=max_queue,
+    )
+    server = ThreadingHTTPServer((host, port), make_handler(batcher, model_name, dimension))
+    server.daemon_threads = True
+    print(f"向量服务监听 http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.close()
+
+
+class EmbeddingClient:
+    def __init__(self, url: str = DEFAULT_URL, http: Optional[HttpClient] = None,
+                 chunk_size: int = CLIENT_CHUNK_SIZE):
+        """向量服务客户端，encode() 的用法与 SentenceTransformer.encode 一致
+
+        Args:
+            url: 向量服务地址
+            http: 共享的 HttpClient
+            chunk_size: 单次请求最多携带的文本数
+        """
+        self.url = url.rstrip("/")
+        self.http = http or get_client()
+        self.chunk_size = chunk_size
+        self._info: Optional[Dict[str, Any]] = None
+
+    def info(self) -> Dict[str, Any]:
+        if self._info is None:
+            response = self.http.get(f"{self.url}/health", timeout=(1, 5), retries=0)
+            response.raise_for_status()
+            self._info = response.json()
+        return self._info
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.info()["dimension"]
+
+    def metrics(self) -> Dict[str, Any]:
+        response = self.http.get(f"{self.url}/metrics")
+        response.raise_for_status()
+        return response.json()
+
+    def _encode_chunk(self, texts: List[str], normalize: bool) -> np.ndarray:
+        for attempt in range(CLIENT_RETRIES + 1):
+            response = self.http.post(f"{self.url}/encode",
+                                      json={"texts": texts, "normalize_embeddings": normalize})
+            if response.status_code != 503 or attempt == CLIENT_RETRIES:
+                break
+            time.sleep(backoff_delay(attempt))  # 编码请求是幂等的，排队已满时退避后重试
+        if response.status_code != 200:
+            raise requests.exceptions.HTTPError(
+                f"Embedding server error {response.status_code}: {response.text}", response=response)
+        rows, dim = (int(x) for x in response.headers["X-Embedding-Shape"].split(","))
+        return np.frombuffer(response.content, dtype="<f4").reshape(rows, dim)
+
+    def encode(self, sentences: Union[str, List[str]], batch_size: Optional[int] = None,
+               normalize_embeddings: bool = False, convert_to_numpy: bool = True,
+               **kwargs: Any) -> Union[np.ndarray, List[List[float]]]:
+        """
+        Args:
+            sentences: 单个文本或文本列表
+            batch_size: 兼容 SentenceTransformer 的参数，批大小由服务端决定
+            normalize_embeddings: 是否返回单位长度的向量
+            convert_to_numpy: False 时返回嵌套列表
+
+        Returns:
+            单个文本返回 (dim,) 数组，文本列表返回 (n, dim) 的 float32 数组
+        """
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        parts = [self._encode_chunk(texts[i:i + self.chunk_size], normalize_embeddings)
+                 for i in range(0, len(texts), self.chunk_size)]
+        vectors = np.concatenate(parts) if parts else np.zeros((0, 0), dtype=np.float32)
+        if single:
+            vectors = vectors[0]
+        return vectors if convert_to_numpy else vectors.tolist()
+
+    # 与 LangChain Embeddings 接口一致，可替换 OllamaEmbeddings
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.encode(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.encode(text).tolist()
+
+
+def load_embeddings(model_name: str = DEFAULT_MODEL, server_url: Optional[str] = None) -> Any:
+    """获取向量模型：优先使用共享的向量服务，未启动时在当前进程加载 SentenceTransformer
+
+    Args:
+        model_name: 模型名称，服务端加载的模型不同时不使用该服务
+        server_url: 向量服务地址，默认读取环境变量 EMBEDDING_SERVER_URL，否则尝试本机默认端口
+    """
+    url = server_url or os.environ.get("EMBEDDING_SERVER_URL") or DEFAULT_URL
+    client = EmbeddingClient(url)
+    try:
+        served = client.info()["model"]
+        if served == model_name:
+            print(f"使用向量服务 {url}（{model_name}）")
+            return client
+        print(f"向量服务加载的是 {served}，不是 {model_name}，改为在当前进程加载模型")
+    except (requests.exceptions.RequestException, ValueError, KeyError):
+        if server_url or os.environ.get("EMBEDDING_SERVER_URL"):
+            print(f"无法连接向量服务 {url}，改为在当前进程加载模型")
+
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(model_name)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="常驻的 SentenceTransformer 向量服务")
+    parser.add_argument("--model", default=DEFAULT_MODEL, help="模型名称")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="监听地址")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="监听端口")
+    parser.add_argument("--max-batch-size", type=int, default=DEFAULT_MAX_BATCH_SIZE, help="每批最多文本数")
+    parser.add_argument("--max-wait-ms", type=float, default=DEFAULT_MAX_WAIT_MS, help="凑批最长等待时间（毫秒）")
+    parser.add_argument("--max-queue", type=int, default=DEFAULT_MAX_QUEUE, help="排队文本数上限")
+    parser.add_argument("--device", default=None, help="cpu / cuda，默认自动选择")
+    args = parser.parse_args()
+
+    serve(args.model, args.host, args.port, args.max_batch_size, args.max_wait_ms, args.max_queue, args.device)
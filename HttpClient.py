@@ -0,0 +1,251 @@
+# 共享的 HTTP 客户端：供 Ollama / MCP 文件服务等所有调用方复用
+# - 基于 requests.Session 的长连接池，避免每次请求重新建立 TCP 连接
+# - 按主机限制并发请求数
+# - 默认超时，防止后端无响应时线程永久阻塞
+# - 带随机抖动的指数退避重试；POST 等非幂等请求只在连接阶段失败时重试，避免重复提交
+# - 同步（HttpClient）与异步（AsyncHttpClient）两种用法
+
+import asyncio
+import random
+import threading
+import time
+from typing import Dict, Optional, Any, Tuple, Union
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+# (连接超时, 读取超时)，模型生成可能较慢，读取超时放宽
+DEFAULT_TIMEOUT: Tuple[float, float] = (5, 300)
+DEFAULT_POOL_SIZE = 16
+DEFAULT_MAX_PER_HOST = 8
+DEFAULT_RETRIES = 2
+DEFAULT_BACKOFF = 0.2
+DEFAULT_MAX_BACKOFF = 5.0
+
+# 遇到这些状态码时，对幂等请求进行重试
+RETRY_STATUS = {429, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+
+def backoff_delay(attempt: int, base: float = DEFAULT_BACKOFF, cap: float = DEFAULT_MAX_BACKOFF) -> float:
+    """第 attempt 次重试前的等待时间（full jitter 指数退避）"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def connect_failed(error: requests.exceptions.RequestException) -> bool:
+    """请求是否在建立连接阶段就失败（请求还没有发出，非幂等请求重试也不会重复提交）"""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+
+
+class HttpClient:
+    def __init__(
+        self,
+        timeout: Union[float, Tuple[float, float]] = DEFAULT_TIMEOUT,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        max_per_host: int = DEFAULT_MAX_PER_HOST,
+        retries: int = DEFAULT_RETRIES,
+        backoff: float = DEFAULT_BACKOFF,
+        headers: Optional[Dict[str, str]] = None,
+    ):
+        """初始化客户端
+
+        Args:
+            timeout: 默认超时时间，单个数字或 (连接超时, 读取超时)
+            pool_size: 每个主机保持的长连接数量
+            max_per_host: 每个主机同时进行的最大请求数
+            retries: 失败后的最大重试次数
+            backoff: 退避的基础时间（秒）
+            headers: 每个请求都携带的默认请求头
+        """
+        self.timeout = timeout
+        self.max_per_host = max_per_host
+        self.retries = retries
+        self.backoff = backoff
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        if headers:
+            self.session.headers.update(headers)
+
+        self._host_limits: Dict[str, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+
+    def _host_semaphore(self, url: str) -> threading.BoundedSemaphore:
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self._host_limits:
+                self._host_limits[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self._host_limits[host]
+
+    def request(self, method: str, url: str, retries: Optional[int] = None, **kwargs: Any) -> requests.Response:
+        """发送请求，参数与 requests.request 相同
+
+        Args:
+            method: HTTP 方法
+            url: 请求地址
+            retries: 覆盖默认的重试次数
+            **kwargs: 透传给 requests 的参数；未指定 timeout 时使用默认超时
+
+        Returns:
+            requests.Response；stream=True 时，主机并发名额在响应关闭后才释放
+        """
+        method = method.upper()
+        kwargs.setdefault("timeout", self.timeout)
+        retries = self.retries if retries is None else retries
+        stream = kwargs.get("stream", False)
+        semaphore = self._host_semaphore(url)
+
+        attempt = 0
+        while True:
+            semaphore.acquire()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.exceptions.ReadTimeout:
+                semaphore.release()
+                # 读取超时说明请求已经发出，非幂等请求不重试
+                if attempt >= retries or method not in IDEMPOTENT_METHODS:
+                    raise
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                semaphore.release()
+                # 连接被重置等错误可能发生在请求发出之后，非幂等请求只在连接阶段失败时重试
+                if attempt >= retries or (method not in IDEMPOTENT_METHODS and not connect_failed(e)):
+                    raise
+            except Exception:
+                semaphore.release()
+                raise
+            else:
+                if (response.status_code in RETRY_STATUS and method in IDEMPOTENT_METHODS
+                        and attempt < retries):
+                    response.close()
+                    semaphore.release()
+                else:
+                    if stream:
+                        self._release_on_close(response, semaphore)
+                    else:
+                        semaphore.release()
+                    return response
+
+            time.sleep(backoff_delay(attempt, self.backoff))
+            attempt += 1
+
+    @staticmethod
+    def _release_on_close(response: requests.Response, semaphore: threading.BoundedSemaphore) -> None:
+        """流式响应在读取完毕并关闭后才归还并发名额"""
+        original_close = response.close
+        released = [False]
+
+        def close() -> None:
+            try:
+                original_close()
+            finally:
+                if not released[0]:
+                    released[0] = True
+                    semaphore.release()
+
+        response.close = close
+
+    def get(self, url: str, **kwargs: Any) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs: Any) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url: str, **kwargs: Any) -> requests.Response:
+        return self.request("PUT", url, **kwargs)
+
+    def delete(self, url: str, **kwargs: Any) -> requests.Response:
+        return self.request("DELETE", url, **kwargs)
+
+    def close(self) -> None:
+        self.session.close()
+
+
+class AsyncHttpClient:
+    def __init__(self, client: Optional[HttpClient] = None, max_per_host: int = DEFAULT_MAX_PER_HOST):
+        """异步客户端：在线程池中执行共享连接池上的请求，供 asyncio 代码使用
+
+        Args:
+            client: 底层同步客户端，默认使用全局共享的客户端
+            max_per_host: 每个主机同时进行的最大协程请求数
+        """
+        self.client = client or get_client()
+        self.max_per_host = max_per_host
+        self._host_limits: Dict[str, asyncio.Semaphore] = {}
+
+    async def request(self, method: str, url: str, **kwargs: Any) -> requests.Response:
+        host = urlsplit(url).netloc
+        if host not in self._host_limits:
+            self._host_limits[host] = asyncio.Semaphore(self.max_per_host)
+        async with self._host_limits[host]:
+            return await asyncio.to_thread(self.client.request, method, url, **kwargs)
+
+    async def get(self, url: str, **kwargs: Any) -> requests.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs: Any) -> requests.Response:
+        return await self.request("POST", url, **kwargs)
+
+    async def delete(self, url: str, **kwargs: Any) -> requests.Response:
+        return await self.request("DELETE", url, **kwargs)
+
+
+_default_client: Optional[HttpClient] = None
+_default_lock = threading.Lock()
+
+
+def get_client() -> HttpClient:
+    """获取进程内共享的 HttpClient"""
+    global _default_client
+    with _default_lock:
+        if _default_client is None:
+            _default_client = HttpClient()
+        return _default_client
+
+
+if __name__ == "__main__":
+    # 基准测试：对比每次新建连接的 requests.get 与共享连接池的每次调用耗时
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # 支持 keep-alive
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            body = b'{"status": "ok"}'
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/health"
+    n = 500
+
+    start = time.perf_counter()
+    for _ in range(n):
+        requests.get(url, timeout=5).json()
+    bare_ms = (time.perf_counter() - start) * 1000 / n
+
+    client = HttpClient()
+    client.get(url).json()  # 预热，建立连接
+    start = time.perf_counter()
+    for _ in range(n):
+        client.get(url).json()
+    pooled_ms = (time.perf_counter() - start) * 1000 / n
+
+    print(f"requests.get（每次新建连接）: {bare_ms:.3f} ms/次")
+    print(f"HttpClient（长连接池）:        {pooled_ms:.3f} ms/次")
+    print(f"每次调用节省: {bare_ms - pooled_ms:.3f} ms")
+    server.shutdown()
@@ -0,0 +1,292 @@
+# Pre-warmed interpreter pool for running target scripts (used with LLMCallPython)
+#
+# Starting a fresh `python` for every script run pays interpreter startup plus every heavy import
+# (pandas, torch, ...) each time. This pool keeps worker interpreters that have already imported a
+# configurable set of modules and runs scripts inside them with runpy:
+# - sys.argv, sys.path[0] and the working directory are set for each run and restored afterwards
+# - stdout/stderr are captured; SystemExit (e.g. from argparse) becomes the return code
+# - a worker is recycled after max_jobs runs or when its memory grows by more than max_memory_growth_mb,
+#   and is replaced by a freshly pre-warmed one in the background
+# - a run that exceeds its timeout kills the worker (and replaces it); a replacement that fails to start is
+#   retried, and run() raises instead of waiting forever once no workers are left
+#
+# Scripts share the worker's already-imported modules, so a script that mutates module-level state of a
+# library can affect later runs in the same worker; recycling bounds how long such state can live.
+
+import contextlib
+import io
+import multiprocessing
+import os
+import queue
+import runpy
+import sys
+import threading
+import time
+import traceback
+
+DEFAULT_POOL_SIZE = 2
+DEFAULT_PRELOAD = ()
+DEFAULT_MAX_JOBS = 100
+DEFAULT_MAX_MEMORY_GROWTH_MB = 512
+DEFAULT_TIMEOUT = 300.0
+START_TIMEOUT = 120.0  # preloading torch can take a while
+START_ATTEMPTS = 3  # tries to start a replacement worker before the slot is given up
+IDLE_POLL_INTERVAL = 1.0
+
+
+def _current_rss() -> int | None:
+    try:
+        from ScriptJobPool import process_rss
+    except ImportError:
+        return None
+    return process_rss(os.getpid())
+
+
+def _worker_main(conn, preload: tuple) -> None:
+    """Worker process loop: import the preload modules once, then run scripts on request."""
+    failed = []
+    for name in preload:
+        try:
+            __import__(name)
+        except Exception as e:
+            failed.append(f"{name}: {e}")
+    conn.send(("ready", _current_rss(), failed))
+
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+        script_path, args, cwd = message
+        conn.send(("done",) + _run_script(script_path, args, cwd) + (_current_rss(),))
+
+
+def _run_script(script_path: str, args: list, cwd: str | None) -> tuple[int, str, str]:
+    stdout, stderr = io.StringIO(), io.StringIO()
+    saved_argv, saved_path, saved_cwd = sys.argv, list(sys.path), os.getcwd()
+    returncode = 0
+    try:
+        if cwd:
+            os.chdir(cwd)
+        script_path = os.path.abspath(script_path)
+        sys.argv = [script_path] + [str(a) for a in args]
+        sys.path.insert(0, os.path.dirname(script_path))
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            try:
+                runpy.run_path(script_path, run_name="__main__")
+            except SystemExit as e:
+                if e.code is None:
+                    returncode = 0
+                elif isinstance(e.code, int):
+                    returncode = e.code
+                else:
+                    print(e.code, file=sys.stderr)
+                    returncode = 1
+            except BaseException:
+                traceback.print_exc()
+                returncode = 1
+    finally:
+        sys.argv = saved_argv
+        sys.path[:] = saved_path
+        os.chdir(saved_cwd)
+    return returncode, stdout.getvalue(), stderr.getvalue()
+
+
+class _Worker:
+    def __init__(self, context, preload: tuple):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn, preload), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.jobs = 0
+        self.baseline_rss = None
+        self.rss = None
+
+    def wait_ready(self, timeout: float) -> list:
+        if not self.conn.poll(timeout):
+            raise TimeoutError("worker interpreter did not start in time")
+        _, self.baseline_rss, failed = self.conn.recv()
+        self.rss = self.baseline_rss
+        return failed
+
+    def stop(self, kill: bool = False) -> None:
+        try:
+            if kill:
+                self.process.kill()
+            else:
+                self.conn.send(None)
+                self.process.join(5)
+                if self.process.is_alive():
+                    self.process.kill()
+        except (OSError, ValueError, BrokenPipeError):
+            pass
+        self.conn.close()
+
+
+class InterpreterPool:
+    def __init__(
+        self,
+        size: int = DEFAULT_POOL_SIZE,
+        preload: tuple | list = DEFAULT_PRELOAD,
+        max_jobs: int = DEFAULT_MAX_JOBS,
+        max_memory_growth_mb: float | None = DEFAULT_MAX_MEMORY_GROWTH_MB,
+        timeout: float | None = DEFAULT_TIMEOUT,
+        start_method: str = "spawn",
+    ):
+        """
+        Args:
+            size: Number of worker interpreters.
+            preload: Modules every worker imports before accepting jobs (e.g. ("pandas", "torch")).
+            max_jobs: Recycle a worker after this many runs.
+            max_memory_growth_mb: Recycle a worker whose RSS grew by more than this since start.
+            timeout: Default per-run time limit in seconds; the worker is killed when exceeded.
+            start_method: multiprocessing start method. "spawn" gives clean interpreters on every
+                          platform; "fork" starts faster on Linux but inherits the parent's state.
+        """
+        self.preload = tuple(preload)
+        self.max_jobs = max_jobs
+        self.max_memory_growth_mb = max_memory_growth_mb
+        self.timeout = timeout
+        self._context = multiprocessing.get_context(start_method)
+        self._idle: "queue.Queue[_Worker]" = queue.Queue()
+        self._closed = False
+        self._lock = threading.Lock()
+        self.live = size  # workers that are idle, busy or being started
+        self.recycled = 0
+
+        workers = [_Worker(self._context, self.preload) for _ in range(size)]
+        for worker in workers:
+            failed = worker.wait_ready(START_TIMEOUT)
+            if failed:
+                print(f"Warning: could not preload {', '.join(failed)}")
+            self._idle.put(worker)
+
+    def _replace(self, worker: _Worker, kill: bool = False) -> None:
+        """Stops a worker and starts a pre-warmed replacement in the background."""
+        worker.stop(kill=kill)
+        self.recycled += 1
+        if self._closed:
+            return
+
+        def start() -> None:
+            for attempt in range(1, START_ATTEMPTS + 1):
+                if self._closed:
+                    break
+                try:
+                    replacement = _Worker(self._context, self.preload)
+                except OSError as e:
+                    print(f"Error starting worker interpreter (attempt {attempt}/{START_ATTEMPTS}): {e}")
+                    time.sleep(attempt)
+                    continue
+                try:
+                    replacement.wait_ready(START_TIMEOUT)
+                except (TimeoutError, EOFError, OSError) as e:
+                    print(f"Error starting worker interpreter (attempt {attempt}/{START_ATTEMPTS}): {e}")
+                    replacement.stop(kill=True)
+                    time.sleep(attempt)
+                    continue
+                if self._closed:
+                    replacement.stop()
+                else:
+                    self._idle.put(replacement)
+                return
+            # The slot is lost; run() stops waiting once no workers are left
+            with self._lock:
+                self.live -= 1
+
+        threading.Thread(target=start, name="interpreter-pool-start", daemon=True).start()
+
+    def run(self, script_path: str, args: list | None = None, cwd: str | None = None,
+            timeout: float | None = ...) -> tuple[int, str, str]:
+        """
+        Runs a script in a pre-warmed worker.
+
+        Returns:
+            (returncode, stdout, stderr)
+        """
+        if self._closed:
+            raise RuntimeError("InterpreterPool is closed")
+        timeout = self.timeout if timeout is ... else timeout
+        worker = self._acquire()
+        finished = False
+        try:
+            worker.conn.send((script_path, list(args or []), cwd))
+            if not worker.conn.poll(timeout):
+                return -9, "", f"Timed out after {timeout}s"
+            _, returncode, stdout, stderr, rss = worker.conn.recv()
+            finished = True
+        except (EOFError, OSError, BrokenPipeError) as e:
+            # The script crashed the interpreter (e.g. os._exit or a segfault in an extension)
+            return -1, "", f"Worker interpreter exited unexpectedly: {e}"
+        finally:
+            # Timeouts, crashes and anything unexpected (unpicklable args, KeyboardInterrupt)
+            # leave the pipe in an unknown state, so the worker is never reused
+            if not finished:
+                self._replace(worker, kill=True)
+
+        worker.jobs += 1
+        worker.rss = rss
+        grown = (rss is not None and worker.baseline_rss is not None and self.max_memory_growth_mb is not None
+                 and rss - worker.baseline_rss > self.max_memory_growth_mb * 1024 * 1024)
+        if worker.jobs >= self.max_jobs or grown:
+            self._replace(worker)
+        else:
+            self._idle.put(worker)
+        return returncode, stdout, stderr
+
+    def _acquire(self) -> _Worker:
+        """Waits for an idle worker; fails instead of blocking forever once every slot is lost."""
+        while True:
+            try:
+                return self._idle.get(timeout=IDLE_POLL_INTERVAL)
+            except queue.Empty:
+                if self._closed:
+                    raise RuntimeError("InterpreterPool is closed")
+                if self.live <= 0:
+                    raise RuntimeError("No worker interpreters available: replacements failed to start")
+
+    def close(self) -> None:
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().stop()
+            except queue.Empty:
+                break
+
+    def __enter__(self) -> "InterpreterPool":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+# --- Example Usage ---
+if __name__ == "__main__":
+    import subprocess
+
+    script = "dummy_target_script.py"
+    args = ["--input", "data/my_input.csv", "--verbose", "--names", "Alice", "Bob"]
+    runs = 10
+    preload = ("json", "argparse") + tuple(sys.argv[1:])  # e.g. python InterpreterPool.py pandas
+
+    # A fresh interpreter per run, importing the same modules the pool preloads
+    fresh_command = [sys.executable, "-c",
+                     f"import {', '.join(preload)}, runpy, sys; sys.argv = sys.argv[1:]; "
+                     "runpy.run_path(sys.argv[0], run_name='__main__')", script] + args
+    start = time.perf_counter()
+    for _ in range(runs):
+        subprocess.run(fresh_command, capture_output=True, text=True)
+    fresh = (time.perf_counter() - start) / runs
+
+    with InterpreterPool(size=2, preload=preload, max_jobs=50) as pool:
+        pool.run(script, args)  # first run also imports anything the preload list missed
+        start = time.perf_counter()
+        for _ in range(runs):
+            returncode, stdout, stderr = pool.run(script, args)
+        warm = (time.perf_counter() - start) / runs
+        print(stdout)
+        print(f"returncode={returncode}")
+        print(f"Fresh interpreter: {fresh * 1000:.1f} ms/run, pre-warmed pool: {warm * 1000:.1f} ms/run")
+        print(pool.run(script, ["--threshold", "x"]))
@@ -1,7 +1,8 @@
 # 使用本地 ollama 模型调用 mcp-server-fetch 服务
 
 import ollama
-import requests
+from BackendHealth import get_backend
+from HttpClient import get_client
 import json
 import os
 from typing import Dict, Any, List, Optional
@@ -11,6 +12,9 @@ OLLAMA_MODEL = "deepseek-r1:7b"
 MCP_SERVER_URL = "http://localhost:8000"  # mcp-server-fetch 默认地址，根据实际部署修改
 MCP_SERVER_API_KEY = os.environ.get("MCP_SERVER_API_KEY", "")  # 如果需要认证
 
+# MCP 服务的健康状态与熔断器，健康检查结果缓存 30 秒
+mcp_health = get_backend("mcp-server-fetch", f"{MCP_SERVER_URL}/health")
+
 def get_ollama_response(prompt: str) -> str:
     """从本地Ollama模型获取响应"""
     response = ollama.chat(model=OLLAMA_MODEL, messages=[
@@ -39,7 +43,10 @@ def call_mcp_server(query: str, context: Optional[List[Dict[str, Any]]] = None)
         payload["context"] = context
     
     # 调用mcp-server-fetch的API端点
-    response = requests.post(f"{MCP_SERVER_URL}/api/mcp", headers=headers, json=payload)
+    with mcp_health.guard():
+        response = get_client().post(f"{MCP_SERVER_URL}/api/mcp", headers=headers, json=payload)
+        if response.status_code >= 500:
+            response.raise_for_status()  # 5xx 计入熔断失败次数
     
     if response.status_code == 200:
         return response.json()
@@ -68,14 +75,13 @@ def process_with_local_and_mcp(user_query: str) -> Dict[str, Any]:
     }
 
 def check_mcp_server_status() -> bool:
-    """检查mcp-server-fetch是否正在运行"""
-    try:
-        response = requests.get(f"{MCP_SERVER_URL}/health", timeout=3)
-        return response.status_code == 200
-    except:
-        return False
+    """检查mcp-server-fetch是否正在运行（使用缓存的健康状态）"""
+    return mcp_health.is_healthy()
 
 if __name__ == "__main__":
+    # 后台定期探测 MCP 服务，请求路径上只读取缓存的健康状态
+    mcp_health.start_background_probe(interval=10)
+
     # 检查MCP服务器是否可用
     if not check_mcp_server_status():
         print("警告: 无法连接到mcp-server-fetch服务。请确保服务已启动并运行在配置的地址上。")
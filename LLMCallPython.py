@@ -1,7 +1,15 @@
 # model_name: str = "deepseek-r1:7b", base_url: str = "http://192.168.0.245:11434"
 
+import ast
+import hashlib
+import os
+import re
+import shlex
 import subprocess
+import sys
 import json
+import threading
+from collections import OrderedDict
 # from openai import OpenAI # Removed OpenAI import
 import ollama # Added ollama import
 
@@ -10,34 +18,253 @@ DEFAULT_MODEL_NAME = "deepseek-r1:7b" # Or your specific local model identifier
 # Adjusted default base URL for ollama library (no /v1)
 DEFAULT_BASE_URL = "http://192.168.0.245:11434" # Standard Ollama API endpoint path
 
-def execute_script_with_llm(
+# Execution modes:
+# - "auto":   build argv directly from params using the script's argparse definition;
+#             fall back to the LLM only when params cannot be mapped unambiguously
+# - "direct": never call the LLM; ambiguous params are reported as an error
+# - "llm":    always ask the LLM (results are still cached)
+EXECUTION_MODES = ("auto", "direct", "llm")
+COMMAND_CACHE_SIZE = 512
+
+# Parsed argparse definitions, keyed by script content hash
+_spec_cache = {}
+# LLM-generated argv, keyed by (script content hash, normalized params)
+_command_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+class AmbiguousParams(ValueError):
+    """params cannot be mapped onto the script's arguments without interpretation."""
+
+
+def script_hash(script_path: str) -> str:
+    with open(script_path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _literal(node):
+    try:
+        return ast.literal_eval(node)
+    except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+        return None
+
+
+def parse_argparse_spec(source: str) -> dict | None:
+    """
+    Statically extracts the argparse definition of a script (without running it).
+
+    Every `<parser>.add_argument(...)` call with literal option strings is collected.
+
+    Returns:
+        None if the script defines no arguments this way, otherwise a dict with:
+        - options: option string (e.g. "--input", "-i") -> argument
+        - dests: dest name (e.g. "input") -> argument
+        - positionals: positional arguments in definition order
+        Each argument is a dict with dest, flags, action, nargs, type, choices, required.
+    """
+    try:
+        tree = ast.parse(source)
+    except SyntaxError:
+        return None
+
+    spec = {"options": {}, "dests": {}, "positionals": []}
+    for node in ast.walk(tree):
+        if not (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)
+                and node.func.attr == "add_argument"):
+            continue
+        names = [_literal(a) for a in node.args]
+        if not names or not all(isinstance(n, str) for n in names):
+            continue
+        kwargs = {kw.arg: kw.value for kw in node.keywords if kw.arg}
+        flags = [n for n in names if n.startswith("-")]
+        type_node = kwargs.get("type")
+        argument = {
+            "flags": flags,
+            "action": _literal(kwargs["action"]) if "action" in kwargs else "store",
+            "nargs": _literal(kwargs["nargs"]) if "nargs" in kwargs else None,
+            "type": type_node.id if isinstance(type_node, ast.Name) else None,
+            "choices": _literal(kwargs["choices"]) if "choices" in kwargs else None,
+            "required": bool(_literal(kwargs["required"])) if "required" in kwargs else not flags,
+        }
+        if "dest" in kwargs and isinstance(_literal(kwargs["dest"]), str):
+            argument["dest"] = _literal(kwargs["dest"])
+        elif flags:
+            longest = max(flags, key=lambda f: (f.startswith("--"), len(f)))
+            argument["dest"] = longest.lstrip("-").replace("-", "_")
+        else:
+            argument["dest"] = names[0]
+
+        for flag in flags:
+            spec["options"][flag] = argument
+        spec["dests"][argument["dest"]] = argument
+        if not flags:
+            spec["positionals"].append(argument)
+    return spec if spec["dests"] else None
+
+
+def get_script_spec(script_path: str, digest: str | None = None) -> dict | None:
+    """Returns the cached argparse spec of a script; re-parsed only when the file content changes."""
+    digest = digest or script_hash(script_path)
+    with _cache_lock:
+        if digest in _spec_cache:
+            return _spec_cache[digest]
+    with open(script_path, "r", encoding="utf-8", errors="replace") as f:
+        spec = parse_argparse_spec(f.read())
+    with _cache_lock:
+        _spec_cache[digest] = spec
+    return spec
+
+
+_CONVERTERS = {"int": int, "float": float, "str": str}
+
+
+def _convert(argument: dict, key: str, value) -> str:
+    converter = _CONVERTERS.get(argument["type"])
+    if converter is not None:
+        try:
+            converter(value)
+        except (TypeError, ValueError):
+            raise AmbiguousParams(f"{key}: {value!r} is not a valid {argument['type']}")
+    if argument["choices"] is not None and value not in argument["choices"] \
+            and str(value) not in [str(c) for c in argument["choices"]]:
+        raise AmbiguousParams(f"{key}: {value!r} is not one of {argument['choices']}")
+    return str(value)
+
+
+def _values(argument: dict, key: str, value) -> list[str]:
+    """Converts one params value into the argv tokens that follow the option."""
+    nargs = argument["nargs"]
+    if nargs in ("+", "*") or isinstance(nargs, int) and nargs > 1:
+        items = shlex.split(value) if isinstance(value, str) else list(value) if isinstance(value, (list, tuple)) else [value]
+        if isinstance(nargs, int) and len(items) != nargs:
+            raise AmbiguousParams(f"{key}: expected {nargs} values, got {len(items)}")
+        return [_convert(argument, key, item) for item in items]
+    if isinstance(value, (list, tuple)):
+        raise AmbiguousParams(f"{key}: takes a single value, got {value!r}")
+    return [_convert(argument, key, value)]
+
+
+def build_argv(script_path: str, params: dict, spec: dict | None) -> list[str]:
+    """
+    Builds the argv for running a script directly from a params dict.
+
+    Keys may be option strings ("--input", "-i") or argparse dest names ("input").
+    Flags (store_true etc.) are included for None/True and omitted for False.
+    Lists, or space-separated strings, are expanded for nargs="+"/"*" options;
+    "append" options are repeated once per value.
+
+    Without an argparse spec, keys that look like options are passed through as-is
+    (the same command the LLM was previously asked to produce).
+
+    Raises:
+        AmbiguousParams: a key or value cannot be mapped onto the script's arguments.
+    """
+    argv = [sys.executable, script_path]
+    if spec is None:
+        for key, value in params.items():
+            if not str(key).startswith("-"):
+                raise AmbiguousParams(f"{key}: no argparse definition found to map it to")
+            if value is False:
+                continue
+            argv.append(str(key))
+            if value is not None and value is not True:
+                argv.extend(str(v) for v in value) if isinstance(value, (list, tuple)) else argv.append(str(value))
+        return argv
+
+    positionals = {}
+    seen = set()
+    for key, value in params.items():
+        key = str(key)
+        argument = spec["options"].get(key) or spec["dests"].get(key.lstrip("-").replace("-", "_"))
+        if argument is None:
+            raise AmbiguousParams(f"{key}: unknown argument for {os.path.basename(script_path)}")
+        seen.add(argument["dest"])
+        if not argument["flags"]:
+            positionals[argument["dest"]] = value
+            continue
+
+        flag = max(argument["flags"], key=len)
+        action = argument["action"]
+        if action in ("store_true", "store_false", "store_const", "append_const", "count", "help", "version"):
+            if value is None or value is True:
+                argv.append(flag)
+            elif action == "count" and isinstance(value, int) and not isinstance(value, bool):
+                argv.extend([flag] * value)
+            elif value is not False:
+                raise AmbiguousParams(f"{key}: flag expects True/False, got {value!r}")
+        elif action == "append":
+            for item in value if isinstance(value, (list, tuple)) else [value]:
+                argv.append(flag)
+                argv.extend(_values(argument, key, item))
+        elif value is None or value is True:
+            raise AmbiguousParams(f"{key}: requires a value")
+        elif value is not False:
+            argv.append(flag)
+            argv.extend(_values(argument, key, value))
+
+    missing = [a["dest"] for a in spec["dests"].values() if a["required"] and a["dest"] not in seen]
+    if missing:
+        raise AmbiguousParams(f"missing required arguments: {', '.join(missing)}")
+    for argument in spec["positionals"]:
+        if argument["dest"] in positionals:
+            argv.extend(_values(argument, argument["dest"], positionals[argument["dest"]]))
+    return argv
+
+
+def format_command(argv: list[str]) -> str:
+    """Human-readable command line for an argv list (for logs and the returned command)."""
+    return subprocess.list2cmdline(argv) if os.name == "nt" else shlex.join(argv)
+
+
+def _cache_key(digest: str, params) -> tuple:
+    return digest, json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)
+
+
+def _argv_from_llm_output(generated_command: str, script_path: str) -> list[str]:
+    """
+    Cleans up an LLM-generated command line and turns it into an argv list.
+
+    Only commands that run the requested script with python are accepted; anything else
+    (pipes, redirections, a different program) is rejected instead of being run through a shell.
+    """
+    generated_command = re.sub(r"<think>.*?</think>", "", generated_command, flags=re.S).strip()
+    # Basic validation/cleanup - remove potential markdown backticks
+    if generated_command.startswith("```"):
+        lines = [l for l in generated_command.splitlines() if l.strip() and not l.startswith("```")]
+        generated_command = lines[0].strip() if lines else ""
+    generated_command = generated_command.strip("`").strip()
+
+    tokens = shlex.split(generated_command, posix=os.name != "nt")
+    if tokens and tokens[0] not in ("python", "python3", sys.executable):
+        tokens.insert(0, "python")
+    if len(tokens) < 2 or os.path.normpath(tokens[1].strip('"')) != os.path.normpath(script_path):
+        raise ValueError(f"LLM command does not run {script_path}: {generated_command!r}")
+    lexer = shlex.shlex(generated_command, posix=os.name != "nt", punctuation_chars=True)
+    if any(t and set(t) <= set("();<>|&") for t in lexer):
+        raise ValueError(f"LLM command contains shell operators: {generated_command!r}")
+    return [sys.executable, script_path] + [t.strip('"') if os.name == "nt" else t for t in tokens[2:]]
+
+
+def generate_argv_with_llm(
     script_path: str,
-    params: dict = None,
+    params,
     model_name: str = DEFAULT_MODEL_NAME,
     base_url: str = DEFAULT_BASE_URL,
-    # api_key: str = "ollama", # API key not typically used directly with ollama library
-) -> tuple[str, str, str]:
+    digest: str | None = None,
+) -> list[str]:
     """
-    Uses a local Ollama LLM (via ollama library) to generate a command for executing a Python script with parameters,
-    then executes the command locally and returns the output.
+    Asks the LLM for the command line; results are cached by (script hash, params),
+    so a repeated request for the same script version costs nothing.
 
     Args:
-        script_path: Path to the Python script to execute.
-        params: A dictionary of parameters to pass to the script.
-                Keys will be argument names (e.g., "--input"), values will be argument values.
-                For flags (arguments without values), set the value to None or True.
-        model_name: The identifier of the local Ollama LLM model.
-        base_url: The base URL (host) of the local Ollama API endpoint (e.g., "http://localhost:11434").
-        # api_key: API key is generally not needed for local Ollama via this library.
-
-    Returns:
-        A tuple containing:
-        - The command generated by the LLM (str).
-        - The standard output of the executed script (str).
-        - The standard error of the executed script (str).
+        params: a params dict, or a natural-language description of the arguments.
     """
-    if params is None:
-        params = {}
+    digest = digest or script_hash(script_path)
+    key = _cache_key(digest, params)
+    with _cache_lock:
+        if key in _command_cache:
+            _command_cache.move_to_end(key)
+            return list(_command_cache[key])
 
     # Initialize Ollama client
     # Ensure base_url doesn't end with /v1 or similar paths
@@ -47,84 +274,155 @@ def execute_script_with_llm(
          host_url = base_url[:-1]
     else:
         host_url = base_url
+    client = ollama.Client(host=host_url)
+
+    if isinstance(params, dict):
+        # Construct the parameter string for the prompt
+        param_parts = []
+        for key_name, value in params.items():
+            if value is None or value is True: # Handle flags
+                 param_parts.append(f"{key_name}")
+            else:
+                 # Ensure string values are quoted if they contain spaces
+                 value_str = str(value)
+                 if ' ' in value_str:
+                     param_parts.append(f'{key_name} "{value_str}"')
+                 else:
+                     param_parts.append(f"{key_name} {value_str}")
+        params_str = " ".join(param_parts)
+    else:
+        params_str = str(params)
 
-    try:
-        client = ollama.Client(host=host_url)
-    except Exception as e:
-         print(f"Error initializing Ollama client with host '{host_url}': {e}")
-         return "", "", f"Error initializing Ollama client: {e}"
-
-
-    # Construct the parameter string for the prompt
-    param_parts = []
-    for key, value in params.items():
-        if value is None or value is True: # Handle flags
-             param_parts.append(f"{key}")
-        else:
-             # Ensure string values are quoted if they contain spaces
-             value_str = str(value)
-             if ' ' in value_str:
-                 param_parts.append(f'{key} "{value_str}"')
-             else:
-                 param_parts.append(f"{key} {value_str}")
-    params_str = " ".join(param_parts)
+    spec = get_script_spec(script_path, digest)
+    options_hint = ""
+    if spec is not None:
+        options_hint = "The script accepts these arguments: " + ", ".join(
+            "/".join(a["flags"]) or a["dest"] for a in spec["dests"].values()) + "\n"
 
     prompt = f"""
     Generate the exact command-line instruction to execute the Python script located at '{script_path}'.
-    The script should be run with the following arguments: {params_str}
+    {options_hint}The script should be run with the following arguments: {params_str}
     Only output the complete command line string, starting with 'python' or 'python3', and nothing else.
-    For example: python {script_path} {params_str}
+    For example: python {script_path} --input data.csv
     """
 
-    try:
-        # Use ollama client's chat method
-        response = client.chat(
-            model=model_name,
-            messages=[
-                {'role': 'system', 'content': 'You are a helpful assistant that generates command-line instructions.'},
-                {'role': 'user', 'content': prompt}
-            ],
-            options={ # Options equivalent to temperature, max_tokens etc.
-                'temperature': 0.1,
-                # 'num_predict': 150 # Equivalent to max_tokens, adjust if needed
-            }
-        )
-        # Extract content from the ollama response structure
-        generated_command = response['message']['content'].strip()
-
-        # Basic validation/cleanup - remove potential markdown backticks
-        if generated_command.startswith("`") and generated_command.endswith("`"):
-            generated_command = generated_command.strip("`")
-        if generated_command.startswith("```") and generated_command.endswith("```"):
-             generated_command = generated_command.splitlines()[1 if generated_command.startswith("```python") else 0].strip()
-
-
-        # Ensure the command starts with python or python3
-        if not (generated_command.startswith("python ") or generated_command.startswith("python3 ")):
-             # Fallback or raise error - maybe prepend python?
-             print(f"Warning: LLM generated command doesn't start with python/python3: '{generated_command}'. Prepending 'python'.")
-             if not generated_command.startswith(script_path): # Avoid "python python script.py"
-                 generated_command = f"python {generated_command}"
+    # Use ollama client's chat method
+    response = client.chat(
+        model=model_name,
+        messages=[
+            {'role': 'system', 'content': 'You are a helpful assistant that generates command-line instructions.'},
+            {'role': 'user', 'content': prompt}
+        ],
+        options={ # Options equivalent to temperature, max_tokens etc.
+            'temperature': 0.1,
+            # 'num_predict': 150 # Equivalent to max_tokens, adjust if needed
+        }
+    )
+    argv = _argv_from_llm_output(response['message']['content'], script_path)
+
+    with _cache_lock:
+        _command_cache[key] = list(argv)
+        _command_cache.move_to_end(key)
+        while len(_command_cache) > COMMAND_CACHE_SIZE:
+            _command_cache.popitem(last=False)
+    return argv
+
+
+def resolve_argv(
+    script_path: str,
+    params=None,
+    mode: str = "auto",
+    model_name: str = DEFAULT_MODEL_NAME,
+    base_url: str = DEFAULT_BASE_URL,
+) -> tuple[list[str], str]:
+    """
+    Determines the argv for a script run.
+
+    Returns:
+        (argv, source) where source is "direct", "cache" or "llm".
+
+    Raises:
+        AmbiguousParams: in "direct" mode when params cannot be mapped deterministically.
+    """
+    if mode not in EXECUTION_MODES:
+        raise ValueError(f"mode must be one of {EXECUTION_MODES}")
+    if params is None:
+        params = {}
+    digest = script_hash(script_path)
+
+    if mode != "llm":
+        try:
+            if not isinstance(params, dict):
+                raise AmbiguousParams("natural-language params require the LLM")
+            return build_argv(script_path, params, get_script_spec(script_path, digest)), "direct"
+        except AmbiguousParams:
+            if mode == "direct":
+                raise
+
+    with _cache_lock:
+        cached = _cache_key(digest, params) in _command_cache
+    argv = generate_argv_with_llm(script_path, params, model_name, base_url, digest)
+    return argv, "cache" if cached else "llm"
+
 
+def execute_script_with_llm(
+    script_path: str,
+    params: dict | str = None,
+    model_name: str = DEFAULT_MODEL_NAME,
+    base_url: str = DEFAULT_BASE_URL,
+    # api_key: str = "ollama", # API key not typically used directly with ollama library
+    mode: str = "auto",
+    pool=None,
+) -> tuple[str, str, str]:
+    """
+    Executes a Python script with parameters and returns the output.
 
+    By default the command is built directly from `params` using the script's argparse
+    definition, which takes microseconds. The local Ollama LLM is only asked to generate
+    the command when params cannot be mapped unambiguously (unknown keys, invalid values,
+    or a natural-language description), and its answers are cached by (script hash, params).
+    The script is always run without a shell.
+
+    Args:
+        script_path: Path to the Python script to execute.
+        params: A dictionary of parameters to pass to the script.
+                Keys will be argument names (e.g., "--input" or "input"), values will be argument values.
+                For flags (arguments without values), set the value to None or True.
+                May also be a natural-language description of the arguments (always uses the LLM).
+        model_name: The identifier of the local Ollama LLM model.
+        base_url: The base URL (host) of the local Ollama API endpoint (e.g., "http://localhost:11434").
+        # api_key: API key is generally not needed for local Ollama via this library.
+        mode: "auto" (default), "direct" (never use the LLM) or "llm" (always use the LLM).
+        pool: Optional InterpreterPool; the script then runs inside a pre-warmed interpreter
+              (heavy imports already done) instead of a new python process.
+
+    Returns:
+        A tuple containing:
+        - The executed command (str).
+        - The standard output of the executed script (str).
+        - The standard error of the executed script (str).
+    """
+    try:
+        argv, source = resolve_argv(script_path, params, mode, model_name, base_url)
+    except AmbiguousParams as e:
+        print(f"Cannot build command from params: {e}")
+        return "", "", f"Cannot build command from params: {e}"
     except Exception as e:
         print(f"Error interacting with Ollama LLM: {e}")
         return "", "", f"Error interacting with Ollama LLM: {e}"
 
-    # --- Execute the generated command ---
+    generated_command = format_command(argv)
+
+    # --- Execute the command ---
+    if pool is not None:
+        print(f"Executing command ({source}, pooled): {generated_command}")
+        _, stdout, stderr = pool.run(argv[1], argv[2:])
+        return generated_command, stdout, stderr
+
     try:
-        # Using shell=True can be a security risk if the command is not trusted.
-        # Here we trust the command generated based on our specific prompt structure,
-        # but be cautious in other contexts.
-        # We split the command for better cross-platform compatibility if possible,
-        # but complex commands with quotes might require shell=True.
-        # Let's try executing directly first for security.
-        # result = subprocess.run(generated_command.split(), capture_output=True, text=True, check=False)
-
-        # Using shell=True as LLM might generate complex commands with pipes or quotes
-        # Be aware of the security implications.
-        print(f"Executing command: {generated_command}")
-        result = subprocess.run(generated_command, capture_output=True, text=True, check=False, shell=True)
+        # argv is passed as a list without shell=True, so values are never interpreted by a shell
+        print(f"Executing command ({source}): {generated_command}")
+        result = subprocess.run(argv, capture_output=True, text=True, check=False)
 
         stdout = result.stdout
         stderr = result.stderr
@@ -132,7 +430,7 @@ def execute_script_with_llm(
         return generated_command, stdout, stderr
 
     except FileNotFoundError:
-         stderr_msg = f"Error: The command '{generated_command.split()[0]}' was not found. Is Python installed and in your PATH?"
+         stderr_msg = f"Error: The command '{argv[0]}' was not found. Is Python installed and in your PATH?"
          print(stderr_msg)
          return generated_command, "", stderr_msg
     except Exception as e:
@@ -140,6 +438,53 @@ def execute_script_with_llm(
         print(stderr_msg)
         return generated_command, "", stderr_msg
 
+def execute_scripts_concurrently(
+    jobs: list[tuple[str, dict | str | None]],
+    mode: str = "auto",
+    timeout: float | None = 300,
+    memory_limit_mb: float | None = None,
+    max_workers: int | None = None,
+) -> list[tuple[str, str, str]]:
+    """
+    Runs several scripts in parallel on a bounded worker pool (see ScriptJobPool).
+
+    Args:
+        jobs: (script_path, params) pairs.
+        mode: How commands are built, see execute_script_with_llm.
+        timeout: Per-job time limit in seconds.
+        memory_limit_mb: Per-job memory limit in MB.
+        max_workers: Concurrency; defaults to the number of CPUs.
+
+    Returns:
+        (command, stdout, stderr) for each job, in input order. Jobs that timed out or
+        exceeded the memory limit have the reason appended to stderr; jobs whose command
+        could not be built return ("", "", reason).
+    """
+    from ScriptJobPool import ScriptJobPool, DEFAULT_MAX_WORKERS
+
+    pool = ScriptJobPool(max_workers=max_workers or DEFAULT_MAX_WORKERS, timeout=timeout,
+                         memory_limit_mb=memory_limit_mb)
+    try:
+        # Keep the job objects themselves: the pool only retains a limited history of finished jobs
+        submitted = []
+        errors: dict[int, str] = {}  # input index -> reason the job could not be submitted
+        for index, (script_path, params) in enumerate(jobs):
+            try:
+                submitted.append(pool.get(pool.submit_script(script_path, params, mode)))
+            except Exception as e:
+                submitted.append(None)
+                errors[index] = f"Cannot build command for {script_path}: {e}"
+        results = []
+        for index, job in enumerate(submitted):
+            if job is None:
+                results.append(("", "", errors[index]))
+            else:
+                job.wait()
+                results.append(job.result())
+        return results
+    finally:
+        pool.shutdown()
+
 # --- Example Usage ---
 if __name__ == "__main__":
     # Create a dummy target script for testing
@@ -200,15 +545,16 @@ if __name__ == "__main__":
     }
 
     # --- Call the function ---
-    print("\n--- Calling LLM to execute script ---")
-    # Make sure your local LLM server (Ollama) is running
+    print("\n--- Executing script ---")
+    # The params map directly onto the script's argparse options, so no LLM call is made.
+    # Natural-language params (or mode="llm") need your local LLM server (Ollama) running
     # and accessible at the specified base_url.
     # You might need to adjust DEFAULT_BASE_URL and DEFAULT_MODEL_NAME above.
     try:
         command, stdout, stderr = execute_script_with_llm(target_script_path, script_params)
 
         print("\n--- Results ---")
-        print(f"LLM Generated Command:\n{command}")
+        print(f"Executed Command:\n{command}")
         print("\nScript Standard Output:")
         print(stdout)
         if stderr:
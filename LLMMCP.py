@@ -1,6 +1,9 @@
-import requests
 import json
-from typing import Dict, Any
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Set, Tuple
+from HttpClient import HttpClient, get_client
 
 # 配置
 OLLAMA_API_URL = "http://192.168.0.245:11434/api/chat"  # Ollama 默认端口
@@ -8,97 +11,357 @@ FILE_SERVICE_URL = "http://localhost:5000/api/files"    # 您的文件 MCP 服
 
 # 文件操作工具函数
 class FileServiceClient:
-    @staticmethod
-    def list_files(path: str = "") -> Dict[str, Any]:
+    def __init__(self, base_url: str = FILE_SERVICE_URL, http: Optional[HttpClient] = None):
+        self.base_url = base_url
+        self.http = http or get_client()
+
+    def list_files(self, path: str = "") -> Dict[str, Any]:
         """列出目录内容"""
-        response = requests.get(f"{FILE_SERVICE_URL}", params={"path": path})
+        response = self.http.get(self.base_url, params={"path": path})
         return response.json()
 
-    @staticmethod
-    def read_file(path: str) -> Dict[str, Any]:
+    def read_file(self, path: str) -> Dict[str, Any]:
         """读取文件内容"""
-        response = requests.get(f"{FILE_SERVICE_URL}/content", params={"path": path})
+        response = self.http.get(f"{self.base_url}/content", params={"path": path})
         return response.json()
 
-    @staticmethod
-    def create_file(path: str, content: str) -> Dict[str, Any]:
+    def create_file(self, path: str, content: str) -> Dict[str, Any]:
         """创建新文件"""
-        response = requests.post(FILE_SERVICE_URL, data={"path": path, "content": content})
+        response = self.http.post(self.base_url, data={"path": path, "content": content})
         return response.json()
 
-    @staticmethod
-    def delete_file(path: str) -> Dict[str, Any]:
+    def delete_file(self, path: str) -> Dict[str, Any]:
         """删除文件"""
-        response = requests.delete(FILE_SERVICE_URL, params={"path": path})
+        response = self.http.delete(self.base_url, params={"path": path})
+        return response.json()
+
+    def search(self, query: str = "", mode: str = "substring", name: Optional[str] = None,
+               path: str = "", limit: int = 50, after: Optional[str] = None) -> Dict[str, Any]:
+        """在服务端搜索文件名和文件内容，不需要逐个列目录、读文件
+
+        Args:
+            query: 查询内容
+            mode: substring（子串）或 terms（关键词，按相关度排序）
+            name: 文件名通配符，例如 *.txt
+            path: 只在该目录下搜索
+            limit: 最多返回的结果数
+            after: 翻页位置，传入上一页返回的 next_after
+
+        Returns:
+            包含 results（每项含 path / name / size / score / snippet）和 next_after（没有下一页时为 None）的字典
+        """
+        params = {"q": query, "mode": mode, "path": path, "limit": limit}
+        if name:
+            params["name"] = name
+        if after is not None:
+            params["after"] = after
+        response = self.http.get(f"{self.base_url}/search", params=params)
+        return response.json()
+
+    def changes(self, since: int = 0, timeout: float = 25, limit: int = 500) -> Dict[str, Any]:
+        """长轮询获取 since 之后的文件变更事件，没有新事件时最多等待 timeout 秒
+
+        Returns:
+            包含 events、next_since 和 truncated 的字典
+        """
+        response = self.http.get(f"{self.base_url}/changes",
+                                 params={"since": since, "timeout": timeout, "limit": limit})
+        response.raise_for_status()
+        return response.json()
+
+    def download(self, path: str, target_path: str) -> None:
+        """把服务端文件流式下载到本地 target_path"""
+        with self.http.get(f"{self.base_url}/download", params={"path": path}, stream=True) as response:
+            response.raise_for_status()
+            with open(target_path, "wb") as f:
+                for block in response.iter_content(64 * 1024):
+                    f.write(block)
+
+    def batch(self, operations: List[Dict[str, Any]], atomic: bool = False) -> Dict[str, Any]:
+        """一次请求执行多个文件操作
+
+        Args:
+            operations: 操作列表，例如 {"op": "read", "path": "a.txt"}；
+                        op 可选 list / read / create / delete / move / search
+            atomic: 为 True 时按顺序执行，任一失败则撤销全部写操作
+
+        Returns:
+            包含 ok 和按顺序排列的 results（每项含 op / status / result）的字典
+        """
+        response = self.http.post(f"{self.base_url}/batch", json={"operations": operations, "atomic": atomic})
         return response.json()
 
 # Ollama 交互函数
 class OllamaClient:
-    def __init__(self, model_name: str = "deepseek-r1:7b"):
+    def __init__(self, model_name: str = "deepseek-r1:7b", http: Optional[HttpClient] = None):
         self.model_name = model_name
-        
-    def generate_response(self, prompt: str, context: str = "") -> str:
-        """与Ollama大模型交互"""
+        self.http = http or get_client()
+
+    def generate_response(self, prompt: str, context: str = "", format: Any = None,
+                          options: Optional[Dict[str, Any]] = None) -> str:
+        """与Ollama大模型交互（/api/chat）
+
+        Args:
+            prompt: 用户消息
+            context: 系统提示，可为空
+            format: 结构化输出约束，"json" 或 JSON Schema
+            options: 模型参数，例如 {"temperature": 0}
+        """
+        messages = []
+        if context:
+            messages.append({"role": "system", "content": context})
+        messages.append({"role": "user", "content": prompt})
         data = {
             "model": self.model_name,
-            "prompt": prompt,
-            "context": context,
+            "messages": messages,
             "stream": False
         }
+        if format is not None:
+            data["format"] = format
+        if options:
+            data["options"] = options
         
-        response = requests.post(
+        response = self.http.post(
             OLLAMA_API_URL,
             json=data,
             headers={"Content-Type": "application/json"}
         )
         
         if response.status_code == 200:
-            return response.json().get("response", "")
+            content = response.json().get("message", {}).get("content", "")
+            # 推理模型会在回答前输出 <think>...</think>
+            return re.sub(r"<think>.*?</think>", "", content, flags=re.S).strip()
         else:
             raise Exception(f"Ollama API error: {response.text}")
 
+# 执行计划的结构：一次调用输出全部步骤，depends_on 为必须先完成的步骤序号（从 0 开始）
+PLAN_OPERATIONS = ["list", "read", "create", "delete", "move", "search"]
+PLAN_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "steps": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "op": {"type": "string", "enum": PLAN_OPERATIONS},
+                    "path": {"type": "string"},
+                    "content": {"type": "string"},
+                    "source": {"type": "string"},
+                    "target": {"type": "string"},
+                    "q": {"type": "string"},
+                    "name": {"type": "string"},
+                    "depends_on": {"type": "array", "items": {"type": "integer"}}
+                },
+                "required": ["op"]
+            }
+        }
+    },
+    "required": ["steps"]
+}
+
+PLANNER_PROMPT = """你是文件操作规划器。把用户指令拆成文件操作步骤，只输出 JSON。
+可用操作:
+- list: 列出目录，字段 path
+- read: 读取文件，字段 path
+- create: 创建文件，字段 path、content
+- delete: 删除文件或空目录，字段 path
+- move: 移动或重命名，字段 source、target
+- search: 搜索文件，字段 q（内容关键词）、name（文件名通配符，如 *.txt）、path（目录）
+没有先后关系的步骤会并发执行；如果某一步必须在其他步骤之后执行，用 depends_on 列出那些步骤的序号（从 0 开始）。
+路径使用相对路径，内容保持用户给出的原文。
+示例: {"steps": [{"op": "create", "path": "notes/a.txt", "content": "你好"}, {"op": "list", "path": "notes", "depends_on": [0]}]}"""
+
+WRITE_OPERATIONS = {"create", "delete", "move"}
+
+# 指令中可替换的部分：引号内的文本和文件路径，替换为占位符后作为计划缓存的键
+_SLOT_RE = re.compile(r"'([^']*)'|\"([^\"]*)\"|“([^”]*)”|‘([^’]*)’|([A-Za-z0-9_\-./\\]*[A-Za-z0-9_\-]\.[A-Za-z0-9]+|[A-Za-z0-9_\-.]+/[A-Za-z0-9_\-./]*)")
+
+
+def command_template(command: str) -> Tuple[str, List[str]]:
+    """把指令中的引号文本和路径替换为占位符
+
+    Returns:
+        (模板, 被替换的值)；例如 "读取 a.txt" -> ("读取 {0}", ["a.txt"])
+    """
+    values: List[str] = []
+
+    def replace(match: "re.Match") -> str:
+        value = next(g for g in match.groups() if g is not None)
+        values.append(value)
+        return "{%d}" % (len(values) - 1)
+
+    template = _SLOT_RE.sub(replace, " ".join(command.split()))
+    return template, values
+
+
+def step_paths(step: Dict[str, Any]) -> List[str]:
+    """步骤涉及的路径；没有路径的 list / search 作用于根目录，记为空字符串"""
+    return [step[k].strip("/") for k in ("path", "source", "target") if step.get(k)] or [""]
+
+
+def plan_waves(steps: List[Dict[str, Any]]) -> Tuple[List[List[int]], List[Set[int]]]:
+    """按依赖关系把步骤分成若干批，同一批内的步骤可以并发执行
+
+    除了显式的 depends_on，涉及同一路径（或其上级目录）且其中一方是写操作的步骤也按原顺序执行。
+
+    Returns:
+        (每批的步骤序号, 每个步骤依赖的步骤序号集合（包括路径冲突产生的隐式依赖）)
+    """
+    level: List[int] = []
+    dependencies: List[Set[int]] = []
+    for i, step in enumerate(steps):
+        deps = {d for d in step.get("depends_on") or [] if isinstance(d, int) and 0 <= d < i}
+        for j in range(i):
+            if step["op"] not in WRITE_OPERATIONS and steps[j]["op"] not in WRITE_OPERATIONS:
+                continue
+            if any(a == b or a.startswith(b + "/") or b.startswith(a + "/") or not a or not b
+                   for a in step_paths(step) for b in step_paths(steps[j])):
+                deps.add(j)
+        dependencies.append(deps)
+        level.append(max((level[d] + 1 for d in deps), default=0))
+    waves: List[List[int]] = [[] for _ in range(max(level, default=-1) + 1)]
+    for i, lv in enumerate(level):
+        waves[lv].append(i)
+    return waves, dependencies
+
+
+class PlanCache:
+    """按指令模板缓存执行计划：计划中的具体值替换为占位符，命中时代入新指令中的值"""
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, List[Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, command: str) -> Optional[List[Dict[str, Any]]]:
+        template, values = command_template(command)
+        with self._lock:
+            cached = self._entries.get(template)
+            if cached is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(template)
+            self.hits += 1
+        return [{k: self._fill(v, values) for k, v in step.items()} for step in cached]
+
+    def put(self, command: str, steps: List[Dict[str, Any]]) -> bool:
+        """缓存计划；指令中的某个值没有出现在计划里时（无法可靠地代入）不缓存"""
+        template, values = command_template(command)
+        abstract = [{k: self._abstract(v, values) for k, v in step.items()} for step in steps]
+        used = json.dumps(abstract, ensure_ascii=False)
+        if any("{%d}" % i not in used for i in range(len(values))):
+            return False
+        with self._lock:
+            self._entries[template] = abstract
+            self._entries.move_to_end(template)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return True
+
+    @staticmethod
+    def _abstract(value: Any, values: List[str]) -> Any:
+        if not isinstance(value, str):
+            return value
+        value = value.replace("{", "{{").replace("}", "}}")
+        # 先替换较长的值，避免 a.txt 被 data.txt 的一部分误替换
+        for i in sorted(range(len(values)), key=lambda i: -len(values[i])):
+            if values[i]:
+                value = value.replace(values[i].replace("{", "{{").replace("}", "}}"), "{%d}" % i)
+        return value
+
+    @staticmethod
+    def _fill(value: Any, values: List[str]) -> Any:
+        return value.format(*values) if isinstance(value, str) else value
+
+
 # 协调层 - 解析大模型指令并执行文件操作
 class FileOperationOrchestrator:
-    def __init__(self):
-        self.ollama = OllamaClient()
-        self.file_service = FileServiceClient()
-        
+    def __init__(self, ollama: Optional[OllamaClient] = None, file_service: Optional[FileServiceClient] = None,
+                 plan_cache: Optional[PlanCache] = None):
+        self.ollama = ollama or OllamaClient()
+        self.file_service = file_service or FileServiceClient()
+        self.plan_cache = plan_cache or PlanCache()
+
+    def plan(self, natural_language_command: str) -> Tuple[List[Dict[str, Any]], bool]:
+        """一次模型调用生成完整的执行计划
+
+        Returns:
+            (步骤列表, 是否命中缓存)
+        """
+        cached = self.plan_cache.get(natural_language_command)
+        if cached is not None:
+            return cached, True
+
+        analysis = self.ollama.generate_response(
+            f"用户指令: {natural_language_command}",
+            context=PLANNER_PROMPT,
+            format=PLAN_SCHEMA,
+            options={"temperature": 0}
+        )
+        steps = json.loads(analysis).get("steps")
+        if not isinstance(steps, list):
+            raise ValueError("计划中缺少 steps")
+        steps = [s for s in steps if isinstance(s, dict) and s.get("op") in PLAN_OPERATIONS]
+        if not steps:
+            raise ValueError("计划为空")
+        self.plan_cache.put(natural_language_command, steps)
+        return steps, False
+
+    def execute_plan(self, steps: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """按依赖分批执行，每批通过一次批量请求在服务端并发执行
+
+        前置步骤失败时跳过依赖它的步骤，包括显式的 depends_on 和操作同一路径的前序写操作。
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * len(steps)
+        failed = set()
+        waves, dependencies = plan_waves(steps)
+        for wave in waves:
+            runnable = []
+            for i in wave:
+                if dependencies[i] & failed:
+                    results[i] = {"op": steps[i]["op"], "status": 424, "result": {"error": "前置步骤失败，已跳过"}}
+                    failed.add(i)
+                else:
+                    runnable.append(i)
+            if not runnable:
+                continue
+            operations = [{k: v for k, v in steps[i].items() if k != "depends_on"} for i in runnable]
+            response = self.file_service.batch(operations)
+            # 请求被拒绝（例如 400）时响应中没有 results，缺少结果的步骤按失败处理
+            returned = response.get("results") or []
+            error = response.get("error") or "批量请求没有返回该步骤的结果"
+            for position, i in enumerate(runnable):
+                if position < len(returned):
+                    results[i] = returned[position]
+                else:
+                    results[i] = {"op": steps[i]["op"], "status": 502, "result": {"error": error}}
+                if results[i]["status"] >= 400:
+                    failed.add(i)
+        return results
+
     def parse_and_execute(self, natural_language_command: str) -> Dict[str, Any]:
-        """解析自然语言指令并执行相应文件操作"""
-        # 第一步：让大模型理解指令意图
-        prompt = f"""
-        请分析以下用户指令，判断用户想要执行什么文件操作，并以JSON格式返回。
-        可用的操作类型: list_files, read_file, create_file, delete_file
-        示例输出: {{"operation": "list_files", "path": "documents/"}}
-        
-        用户指令: {natural_language_command}
+        """解析自然语言指令并执行相应文件操作
+
+        Returns:
+            包含 plan（执行计划）、results（每步的 op / status / result）、ok 和 cached 的字典
         """
-        
-        # 获取大模型的分析结果
-        analysis = self.ollama.generate_response(prompt)
-        
         try:
-            # 尝试解析大模型的JSON响应
-            command = json.loads(analysis.strip())
-            operation = command.get("operation")
-            path = command.get("path", "")
-            content = command.get("content", "")
-            
-            # 执行相应操作
-            if operation == "list_files":
-                return self.file_service.list_files(path)
-            elif operation == "read_file":
-                return self.file_service.read_file(path)
-            elif operation == "create_file":
-                return self.file_service.create_file(path, content)
-            elif operation == "delete_file":
-                return self.file_service.delete_file(path)
-            else:
-                return {"error": "Unsupported operation"}
-                
-        except json.JSONDecodeError:
-            # 如果大模型没有返回有效JSON，尝试直接执行
+            steps, cached = self.plan(natural_language_command)
+        except (ValueError, json.JSONDecodeError) as e:
+            # 如果大模型没有返回有效的计划，尝试直接执行
+            print(f"解析执行计划失败: {str(e)}")
             return self.fallback_execution(natural_language_command)
+
+        results = self.execute_plan(steps)
+        return {
+            "plan": steps,
+            "results": results,
+            "ok": all(r["status"] < 400 for r in results),
+            "cached": cached
+        }
     
     def fallback_execution(self, command: str) -> Dict[str, Any]:
         """当大模型无法返回结构化响应时的备用方案"""
@@ -5,40 +5,41 @@ from typing import List, Dict
 import json
 import os
 from datetime import datetime
-from duckduckgo_search import DDGS
+from BackendHealth import ollama_backend
+from HttpClient import get_client
+from OllamaSession import OllamaChatSession, DEFAULT_KEEP_ALIVE
+from WebSearch import WebSearch, ddgs_provider
+from SearchRouter import SearchRouter, speculative_answer
 
 class NetChatBot:
-    def __init__(self, model_name: str = "deepseek-r1:7b", base_url: str = "http://192.168.0.245:11434"):
+    def __init__(self, model_name: str = "deepseek-r1:7b", base_url: str = "http://192.168.0.245:11434",
+                 keep_alive=DEFAULT_KEEP_ALIVE, search_budget: float = 2.0, speculative: bool = True):
         self.model_name = model_name
         self.base_url = base_url
-        self.ddgs = DDGS()
+        # 搜索在后台线程执行，最多等待 search_budget 秒；结果按规范化查询缓存
+        # DDGS 客户端在第一次搜索时才创建（duckduckgo_search 不在启动时导入）
+        self.web_search = WebSearch(ddgs_provider(), max_results=5, budget=search_budget)
+        # 判断每轮是否需要搜索；不确定时可同时发起搜索和无上下文草稿（投机执行）
+        self.router = SearchRouter()
+        self.speculative = speculative
+        self.http = get_client()
+        # 固定的系统提示放在最前面，保证每次请求的前缀一致，可复用 Ollama 的 KV 缓存
+        self.session = OllamaChatSession(model_name, base_url, keep_alive=keep_alive, http=self.http)
         
-        # 测试 Ollama 连接
-        try:
-            response = requests.get(f"{self.base_url}/api/tags")
-            if response.status_code != 200:
-                print(f"警告：无法连接到 Ollama 服务，请确保服务正在运行。状态码：{response.status_code}")
-        except requests.exceptions.ConnectionError:
+        # 测试 Ollama 连接（结果按TTL缓存，熔断期间直接返回不可用）
+        if not ollama_backend(self.base_url).is_healthy():
             print("错误：无法连接到 Ollama 服务，请确保服务正在运行。")
         
-    def search_web(self, query: str) -> List[Dict]:
-        """使用 DuckDuckGo 进行网络搜索"""
-        try:
-            results = []
-            # 获取搜索结果
-            for r in self.ddgs.text(query, max_results=5):
-                results.append({
-                    "title": r.get("title", ""),
-                    "snippet": r.get("body", ""),
-                    "link": r.get("link", "")
-                })
-            return results
-        except Exception as e:
-            print(f"搜索出错: {str(e)}")
-            return []
+    def search_web(self, query: str, budget: float = None) -> List[Dict]:
+        """使用 DuckDuckGo 进行网络搜索
+
+        最多等待 budget 秒（默认 search_budget），超时返回已经到达的部分结果；
+        剩余结果在后台继续获取并写入缓存。
+        """
+        return self.web_search.search(query, budget)
 
-    def generate_response(self, prompt: str, search_results: List[Dict] = None) -> str:
-        """使用Ollama生成回复"""
+    def generate_response(self, prompt: str, search_results: List[Dict] = None, cancel=None) -> str:
+        """使用Ollama生成回复，传入 cancel 事件时以流式方式生成并可被中途取消"""
         messages = [
             {"role": "system", "content": "你是一个智能助手，可以回答用户的问题。请基于搜索结果提供准确的信息。"},
             {"role": "user", "content": prompt}
@@ -50,16 +51,8 @@ class NetChatBot:
             messages.append({"role": "system", "content": f"以下是相关搜索结果：\n{context}"})
 
         try:
-            response = requests.post(
-                f"{self.base_url}/api/chat",
-                json={
-                    "model": self.model_name,
-                    "messages": messages,
-                    "stream": False
-                }
-            )
-            response.raise_for_status()
-            return response.json().get("message", {}).get("content", "")
+            content, _ = self.session.send(messages, stream=cancel is not None, cancel=cancel)
+            return content
         except requests.exceptions.ConnectionError:
             return "错误：无法连接到 Ollama 服务，请确保服务正在运行。"
         except requests.exceptions.HTTPError as e:
@@ -69,9 +62,20 @@ class NetChatBot:
 
     def chat(self, user_input: str) -> str:
         """处理用户输入并返回回复"""
-        # 首先进行网络搜索
-        search_results = self.search_web(user_input)
-        
+        decision = self.router.route(user_input)
+
+        # 无法确定是否需要搜索时，搜索与无上下文草稿并行，取先完成的一方
+        if decision["uncertain"] and self.speculative:
+            result = speculative_answer(
+                search=lambda: self.search_web(user_input),
+                draft=lambda cancel: self.generate_response(user_input, cancel=cancel),
+                answer=lambda results: self.generate_response(user_input, results),
+            )
+            return result["response"]
+
+        # 需要时进行网络搜索，超出时间预算后用已到达的结果开始生成
+        search_results = self.search_web(user_input) if decision["need_search"] else None
+
         # 生成回复
         response = self.generate_response(user_input, search_results)
         return response
@@ -0,0 +1,205 @@
+# 批量并发的 Ollama 向量客户端：用于 DocEmbeddingOllama 入库，替代逐条请求的 OllamaEmbeddings / get_ollama_embedding
+#
+# - 使用 /api/embed 的批量输入，一次请求编码 batch_size 个片段
+# - 同时保持多个请求在途，Ollama 端可以把它们排进 OLLAMA_NUM_PARALLEL 个并行槽
+# - 自适应并发（AIMD）：服务端过载（429 / 503 / 读取超时）时并发减半并退避重试，连续成功后逐个恢复
+# - 结果按输入顺序返回 float32 的 NumPy 数组，不再是 Python float 列表
+#
+# 用法：
+#   python OllamaEmbedder.py --texts 2000 --batch-size 32 --in-flight 4   # 对比逐条请求与批量并发的吞吐
+
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Union
+
+import numpy as np
+import requests
+
+from BackendHealth import CircuitOpenError, ollama_backend
+from HttpClient import HttpClient, backoff_delay, get_client
+from OllamaSession import DEFAULT_KEEP_ALIVE
+
+DEFAULT_MODEL = "nomic-embed-text"
+DEFAULT_BASE_URL = "http://192.168.0.245:11434"
+DEFAULT_BATCH_SIZE = 32
+DEFAULT_MAX_IN_FLIGHT = 4  # 不超过 HttpClient 的单主机并发上限
+DEFAULT_RETRIES = 6
+DEFAULT_TIMEOUT = 120  # 单个批次的读取超时（秒）
+OVERLOAD_STATUS = {429, 502, 503, 504}
+
+
+class OllamaOverloadedError(RuntimeError):
+    pass
+
+
+class AdaptiveLimiter:
+    def __init__(self, limit: int, max_limit: int, increase_after: int = 4):
+        """自适应的并发上限：过载时减半，连续成功 increase_after 次后加一
+
+        Args:
+            limit: 初始并发数
+            max_limit: 并发上限
+            increase_after: 连续成功多少次后提高一次并发
+        """
+        self.limit = limit
+        self.max_limit = max_limit
+        self.increase_after = increase_after
+        self.in_flight = 0
+        self.overloads = 0
+        self._successes = 0
+        self._cond = threading.Condition()
+
+    def acquire(self) -> None:
+        with self._cond:
+            while self.in_flight >= self.limit:
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self) -> None:
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+    def on_success(self) -> None:
+        with self._cond:
+            self._successes += 1
+            if self._successes >= self.increase_after and self.limit < self.max_limit:
+                self.limit += 1
+                self._successes = 0
+                self._cond.notify()
+
+    def on_overload(self) -> None:
+        with self._cond:
+            self.overloads += 1
+            self._successes = 0
+            self.limit = max(1, self.limit // 2)
+
+
+class OllamaEmbedder:
+    def __init__(
+        self,
+        model: str = DEFAULT_MODEL,
+        base_url: str = DEFAULT_BASE_URL,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+        keep_alive: Union[str, int] = DEFAULT_KEEP_ALIVE,
+        retries: int = DEFAULT_RETRIES,
+        timeout: float = DEFAULT_TIMEOUT,
+        http: Optional[HttpClient] = None,
+    ):
+        """
+        Args:
+            model: 向量模型名称
+            base_url: Ollama 服务地址
+            batch_size: 每个请求携带的片段数
+            max_in_flight: 同时在途的请求数上限（过载时自动降低）
+            keep_alive: 模型驻留时间，入库期间避免模型被换出
+            retries: 单个批次在过载时的最大重试次数
+            timeout: 单个批次的读取超时（秒）
+            http: 共享的 HttpClient
+        """
+        self.model = model
+        self.base_url = base_url.rstrip("/")
+        self.batch_size = batch_size
+        self.keep_alive = keep_alive
+        self.retries = retries
+        self.timeout = timeout
+        self.http = http or get_client()
+        self.health = ollama_backend(self.base_url)
+        self.limiter = AdaptiveLimiter(max_in_flight, max_in_flight)
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="ollama-embed")
+        self.stats: Dict[str, Any] = {}
+
+    def _post_batch(self, texts: List[str]) -> np.ndarray:
+        payload = {"model": self.model, "input": texts, "truncate": True, "keep_alive": self.keep_alive}
+        for attempt in range(self.retries + 1):
+            self.limiter.acquire()
+            try:
+                # 连接失败计入熔断器；读取超时和过载响应说明服务仍然可用，不计入熔断器，在这里退避处理
+                overloaded = False
+                with self.health.guard():
+                    try:
+                        response = self.http.post(f"{self.base_url}/api/embed", json=payload,
+                                                  timeout=(5, self.timeout), retries=0)
+                    except requests.exceptions.ReadTimeout:
+                        overloaded = True
+                if not overloaded:
+                    overloaded = response.status_code in OVERLOAD_STATUS
+                if not overloaded:
+                    response.raise_for_status()
+                    embeddings = response.json()["embeddings"]
+            except CircuitOpenError:
+                # 熔断中：等到熔断器允许试探后再重试，重试次数用完时抛出
+                if attempt == self.retries:
+                    raise
+                time.sleep(self.health.reset_timeout)
+                continue
+            finally:
+                self.limiter.release()
+
+            if not overloaded:
+                self.limiter.on_success()
+                return np.asarray(embeddings, dtype=np.float32)
+            self.limiter.on_overload()
+            time.sleep(backoff_delay(attempt))
+        raise OllamaOverloadedError(f"Ollama 持续过载，{len(texts)} 个片段在 {self.retries} 次重试后仍未完成")
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """编码文本列表
+
+        Returns:
+            (len(texts), dim) 的 float32 数组，顺序与输入一致
+        """
+        start = time.perf_counter()
+        overloads = self.limiter.overloads
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        parts = list(self._executor.map(self._post_batch, batches))
+        vectors = np.concatenate(parts) if parts else np.zeros((0, 0), dtype=np.float32)
+
+        seconds = time.perf_counter() - start
+        self.stats = {
+            "texts": len(texts),
+            "batches": len(batches),
+            "seconds": round(seconds, 3),
+            "texts_per_s": round(len(texts) / seconds, 1) if seconds else 0.0,
+            "in_flight_limit": self.limiter.limit,
+            "overloads": self.limiter.overloads - overloads,
+        }
+        return vectors
+
+    # 与 LangChain Embeddings 接口同名，可直接替换 OllamaEmbeddings
+    def embed_documents(self, texts: List[str]) -> np.ndarray:
+        return self.embed(texts)
+
+    def embed_query(self, text: str) -> np.ndarray:
+        return self.embed([text])[0]
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="对比逐条请求与批量并发的 Ollama 向量吞吐")
+    parser.add_argument("--base-url", default=DEFAULT_BASE_URL, help="Ollama 服务地址")
+    parser.add_argument("--model", default=DEFAULT_MODEL, help="向量模型")
+    parser.add_argument("--texts", type=int, default=500, help="测试文本数")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="每个请求的片段数")
+    parser.add_argument("--in-flight", type=int, default=DEFAULT_MAX_IN_FLIGHT, help="在途请求数上限")
+    args = parser.parse_args()
+
+    texts = [f"第 {i} 段：牵引供电设备智能运维技术架构，以数据为驱动。" * (1 + i % 8) for i in range(args.texts)]
+    http = get_client()
+
+    sample = texts[:min(50, len(texts))]
+    start = time.perf_counter()
+    for text in sample:
+        http.post(f"{args.base_url}/api/embeddings", json={"model": args.model, "prompt": text}).json()
+    single = len(sample) / (time.perf_counter() - start)
+    print(f"逐条 /api/embeddings: {single:.1f} texts/s")
+
+    embedder = OllamaEmbedder(args.model, args.base_url, args.batch_size, args.in_flight)
+    vectors = embedder.embed(texts)
+    print(f"批量并发 /api/embed: {embedder.stats}, 结果 {vectors.shape} {vectors.dtype}")
+    embedder.close()
@@ -0,0 +1,279 @@
+# 基于本地 ollama 的多轮会话层：model_name: str = "deepseek-r1:7b", base_url: str = "http://192.168.0.245:11434"
+# 保持对话前缀稳定且逐字节一致，让 Ollama 复用上一轮的 KV 缓存（只 prefill 新增部分），
+# 并通过 keep_alive 让模型常驻显存，同时统计每轮的 prefill / 生成耗时。
+
+import json
+import time
+import threading
+from typing import List, Dict, Any, Optional, Tuple
+
+import requests
+
+from BackendHealth import ollama_backend
+from HttpClient import HttpClient, get_client
+
+# 模型在显存中的驻留时间，-1 表示永久驻留
+DEFAULT_KEEP_ALIVE = "30m"
+
+
+def stable_window(messages: List[Dict[str, str]], limit: int) -> List[Dict[str, str]]:
+    """截取最近的消息，但窗口起点按块跳动而不是每轮滑动
+
+    逐条滑动的窗口每一轮都会改变对话开头，导致服务端前缀缓存全部失效。
+    这里窗口起点只在累计超出 limit/2 条消息时整体前移一次，两次前移之间
+    发送给模型的前缀保持不变。
+
+    Args:
+        messages: 完整的消息列表
+        limit: 窗口的最大消息数
+
+    Returns:
+        窗口内的消息
+    """
+    if limit <= 0:
+        return []
+    if len(messages) <= limit:
+        return messages
+    step = max(limit // 2, 2)
+    step += step % 2  # 保证按 user/assistant 成对丢弃
+    overflow = len(messages) - limit
+    start = ((overflow + step - 1) // step) * step
+    return messages[start:]
+
+
+def parse_timings(data: Dict[str, Any]) -> Dict[str, float]:
+    """从 Ollama 最终响应中提取耗时信息（Ollama 返回的单位是纳秒）"""
+    def ms(key: str) -> float:
+        return (data.get(key) or 0) / 1e6
+
+    return {
+        "prompt_eval_count": data.get("prompt_eval_count") or 0,
+        "prompt_eval_ms": ms("prompt_eval_duration"),
+        "eval_count": data.get("eval_count") or 0,
+        "eval_ms": ms("eval_duration"),
+        "load_ms": ms("load_duration"),
+        "total_ms": ms("total_duration"),
+    }
+
+
+class OllamaChatSession:
+    def __init__(
+        self,
+        model_name: str = "deepseek-r1:7b",
+        base_url: str = "http://192.168.0.245:11434",
+        system_prompt: str = "",
+        keep_alive: Any = DEFAULT_KEEP_ALIVE,
+        max_history: int = 20,
+        options: Optional[Dict[str, Any]] = None,
+        timeout: float = 300,
+        http: Optional[HttpClient] = None,
+    ):
+        """初始化会话
+
+        Args:
+            model_name: Ollama模型名称
+            base_url: Ollama API基础URL
+            system_prompt: 固定的系统提示词，始终位于对话最前面
+            keep_alive: 模型驻留时间，传给 Ollama 的 keep_alive 参数
+            max_history: 历史消息窗口大小
+            options: 模型参数；同一会话内保持不变，修改 num_ctx 等参数会导致模型重新加载
+            timeout: 单次请求读取超时时间（秒）
+            http: HTTP 客户端，默认使用全局共享的连接池
+        """
+        self.model_name = model_name
+        self.base_url = base_url
+        self.system_prompt = system_prompt
+        self.keep_alive = keep_alive
+        self.max_history = max_history
+        self.options = dict(options) if options else None
+        self.timeout = timeout
+        self.http = http or get_client()
+        self.health = ollama_backend(base_url)
+        self.history: List[Dict[str, str]] = []
+        self.stats: List[Dict[str, float]] = []
+        self._lock = threading.Lock()
+
+    def build_messages(self, user_content: Optional[str] = None) -> List[Dict[str, str]]:
+        """组装发送给模型的消息：固定系统提示 + 稳定窗口内的历史 + 新消息"""
+        messages = []
+        if self.system_prompt:
+            messages.append({"role": "system", "content": self.system_prompt})
+        # 只保留 role/content，避免时间戳等元数据进入请求
+        for msg in stable_window(self.history, self.max_history):
+            messages.append({"role": msg["role"], "content": msg["content"]})
+        if user_content is not None:
+            messages.append({"role": "user", "content": user_content})
+        return messages
+
+    def send(
+        self,
+        messages: List[Dict[str, str]],
+        stream: bool = False,
+        cancel: Optional[threading.Event] = None,
+    ) -> Tuple[str, Dict[str, float]]:
+        """发送一次 /api/chat 请求，返回 (回复内容, 耗时统计)
+
+        调用方自行维护历史时直接使用该方法，同样会记录耗时统计。
+        流式请求中 cancel 被置位时立即停止读取并关闭连接，返回已生成的部分内容。
+        """
+        payload = {
+            "model": self.model_name,
+            "messages": messages,
+            "stream": stream,
+            "keep_alive": self.keep_alive,
+        }
+        if self.options:
+            payload["options"] = self.options
+
+        start = time.perf_counter()
+        # Ollama 不可用（熔断中）时立即抛出 CircuitOpenError，不再等待连接超时
+        with self.health.guard(), self.http.post(
+            f"{self.base_url}/api/chat",
+            json=payload,
+            stream=stream,
+            timeout=(5, self.timeout),
+        ) as response:
+            response.raise_for_status()
+            if stream:
+                content, final = self._read_stream(response, cancel)
+            else:
+                final = response.json()
+                content = final.get("message", {}).get("content", "")
+
+        timings = parse_timings(final)
+        timings["wall_ms"] = (time.perf_counter() - start) * 1000
+        if cancel is not None and cancel.is_set():
+            return content, timings
+        with self._lock:
+            timings["turn"] = len(self.stats) + 1
+            self.stats.append(timings)
+        return content, timings
+
+    @staticmethod
+    def _read_stream(
+        response: requests.Response, cancel: Optional[threading.Event] = None
+    ) -> Tuple[str, Dict[str, Any]]:
+        """逐行读取流式响应，返回完整内容和最后一个（包含耗时字段的）JSON"""
+        content = ""
+        final: Dict[str, Any] = {}
+        for line in response.iter_lines():
+            if cancel is not None and cancel.is_set():
+                break
+            if not line:
+                continue
+            try:
+                data = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            content += data.get("message", {}).get("content", "")
+            if data.get("done", False):
+                final = data
+                break
+        return content, final
+
+    def chat(self, user_content: str, stream: bool = False) -> str:
+        """发送一轮对话并把问答追加到历史中"""
+        content, _ = self.send(self.build_messages(user_content), stream=stream)
+        # 原样保存模型回复，下一轮才能与服务端缓存的前缀完全一致
+        self.history.append({"role": "user", "content": user_content})
+        self.history.append({"role": "assistant", "content": content})
+        return content
+
+    def reset(self) -> None:
+        """清空历史和统计"""
+        self.history = []
+        self.stats = []
+
+    def report(self) -> str:
+        """生成每轮 prefill / 生成耗时报告"""
+        lines = [f"{'轮次':<6}{'prefill tokens':>16}{'prefill ms':>12}{'gen tokens':>12}{'gen ms':>10}{'总耗时 ms':>12}"]
+        for s in self.stats:
+            lines.append(
+                f"{int(s['turn']):<6}{int(s['prompt_eval_count']):>16}{s['prompt_eval_ms']:>12.1f}"
+                f"{int(s['eval_count']):>12}{s['eval_ms']:>10.1f}{s['total_ms']:>12.1f}"
+            )
+        if self.stats:
+            avg_prefill = sum(s["prompt_eval_ms"] for s in self.stats) / len(self.stats)
+            avg_eval = sum(s["eval_ms"] for s in self.stats) / len(self.stats)
+            lines.append(f"平均 prefill: {avg_prefill:.1f} ms, 平均生成: {avg_eval:.1f} ms")
+        return "\n".join(lines)
+
+
+# 本地模拟的 Ollama 服务：按与上一次请求的公共前缀计算需要 prefill 的 token 数
+def _run_mock_ollama(port: int = 0):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    cache = {"prompt": ""}
+    prefill_ms_per_char = 0.05
+    eval_ms_per_token = 2.0
+
+    class Handler(BaseHTTPRequestHandler):
+        def _send_json(self, data):
+            out = json.dumps(data, ensure_ascii=False).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(out)))
+            self.end_headers()
+            self.wfile.write(out)
+
+        def do_GET(self):
+            # 健康检查地址，与真实服务一样返回本地模型列表
+            if self.path != "/api/tags":
+                self.send_error(404)
+                return
+            self._send_json({"models": [{"name": "deepseek-r1:7b", "model": "deepseek-r1:7b"}]})
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            prompt = json.dumps(body["messages"], ensure_ascii=False)
+            common = 0
+            for a, b in zip(cache["prompt"], prompt):
+                if a != b:
+                    break
+                common += 1
+            cache["prompt"] = prompt
+            new_chars = len(prompt) - common
+            reply = f"第{len(body['messages'])}条消息的回复。" * 5
+            prompt_ns = int(new_chars * prefill_ms_per_char * 1e6)
+            eval_ns = int(len(reply) * eval_ms_per_token * 1e6)
+            time.sleep((prompt_ns + eval_ns) / 1e9)
+            data = {
+                "message": {"role": "assistant", "content": reply},
+                "done": True,
+                "prompt_eval_count": new_chars,
+                "prompt_eval_duration": prompt_ns,
+                "eval_count": len(reply),
+                "eval_duration": eval_ns,
+                "total_duration": prompt_ns + eval_ns,
+            }
+            self._send_json(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    # 使用本地模拟服务对比“逐条滑动窗口”和“稳定前缀窗口”的每轮耗时
+    server = _run_mock_ollama()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    questions = [f"请介绍一下第{i}个知识点，并给出详细的例子。" * 3 for i in range(1, 13)]
+
+    class SlidingSession(OllamaChatSession):
+        def build_messages(self, user_content=None):
+            messages = [{"role": "system", "content": self.system_prompt}]
+            messages += self.history[-self.max_history:]
+            messages.append({"role": "user", "content": user_content})
+            return messages
+
+    for name, cls in [("逐条滑动窗口", SlidingSession), ("稳定前缀窗口", OllamaChatSession)]:
+        session = cls(base_url=base_url, system_prompt="你是一个智能助手。" * 20, max_history=8)
+        for q in questions:
+            session.chat(q)
+        print(f"\n=== {name} ===")
+        print(session.report())
+
+    server.shutdown()
@@ -0,0 +1,125 @@
+# OllamaSession 的测试：使用本地模拟的 Ollama 服务，不需要真实模型
+#
+# 用法：
+#   python OllamaSession_test.py
+#   python -m pytest OllamaSession_test.py
+
+import json
+import threading
+import unittest
+
+from BackendHealth import CLOSED
+
+from OllamaSession import OllamaChatSession, _run_mock_ollama, parse_timings, stable_window
+
+
+class SlidingSession(OllamaChatSession):
+    """逐条滑动窗口，作为对照"""
+
+    def build_messages(self, user_content=None):
+        messages = [{"role": "system", "content": self.system_prompt}]
+        messages += self.history[-self.max_history:]
+        messages.append({"role": "user", "content": user_content})
+        return messages
+
+
+def run_session(cls, turns: int = 12, max_history: int = 8) -> OllamaChatSession:
+    server = _run_mock_ollama()
+    try:
+        session = cls(base_url=f"http://127.0.0.1:{server.server_address[1]}",
+                      system_prompt="你是一个智能助手。" * 5, max_history=max_history)
+        for i in range(1, turns + 1):
+            session.chat(f"请介绍一下第{i}个知识点。")
+        return session
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+class StableWindowTest(unittest.TestCase):
+    def test_short_history_is_unchanged(self):
+        messages = [{"role": "user", "content": str(i)} for i in range(4)]
+        self.assertEqual(stable_window(messages, 8), messages)
+        self.assertEqual(stable_window(messages, 0), [])
+
+    def test_window_start_moves_in_pairs_and_stays_put_between_jumps(self):
+        messages = [{"role": "user" if i % 2 == 0 else "assistant", "content": str(i)} for i in range(40)]
+        starts = []
+        for n in range(9, 41):
+            window = stable_window(messages[:n], 8)
+            self.assertLessEqual(len(window), 8)
+            self.assertEqual(window[-1], messages[n - 1])
+            starts.append(int(window[0]["content"]))
+        self.assertTrue(all(start % 2 == 0 for start in starts))
+        # 起点按块跳动：相邻两轮的起点大多数时候相同
+        self.assertLess(len(set(starts)), len(starts) // 2)
+
+
+class ParseTimingsTest(unittest.TestCase):
+    def test_converts_nanoseconds_and_missing_fields(self):
+        timings = parse_timings({"prompt_eval_count": 10, "prompt_eval_duration": 2_500_000, "eval_duration": None})
+        self.assertEqual(timings["prompt_eval_count"], 10)
+        self.assertAlmostEqual(timings["prompt_eval_ms"], 2.5)
+        self.assertEqual(timings["eval_ms"], 0)
+        self.assertEqual(timings["eval_count"], 0)
+
+
+class MockServerTest(unittest.TestCase):
+    def test_chat_records_history_and_timings(self):
+        session = run_session(OllamaChatSession, turns=3)
+        self.assertEqual(len(session.history), 6)
+        self.assertEqual([s["turn"] for s in session.stats], [1, 2, 3])
+        self.assertTrue(all(s["prompt_eval_count"] > 0 and s["wall_ms"] > 0 for s in session.stats))
+        report = session.report().splitlines()
+        self.assertEqual(len(report), 1 + 3 + 1)
+        self.assertTrue(report[-1].startswith("平均 prefill"))
+
+    def test_stream_returns_same_content(self):
+        server = _run_mock_ollama()
+        try:
+            session = OllamaChatSession(base_url=f"http://127.0.0.1:{server.server_address[1]}")
+            messages = session.build_messages("你好")
+            plain, _ = session.send(messages)
+            streamed, timings = session.send(messages, stream=True)
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual(plain, streamed)
+        self.assertGreater(timings["eval_count"], 0)
+
+    def test_mock_answers_health_check_and_session_does_not_start_probing(self):
+        server = _run_mock_ollama()
+        try:
+            session = OllamaChatSession(base_url=f"http://127.0.0.1:{server.server_address[1]}")
+            self.assertFalse(any(t.name == "health-ollama" and t.is_alive() for t in threading.enumerate()))
+            self.assertTrue(session.health.probe())
+            self.assertIn("models", session.health.last_payload)
+            self.assertEqual(session.health.state, CLOSED)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_stable_prefix_needs_less_prefill_than_sliding_window(self):
+        sliding = run_session(SlidingSession)
+        stable = run_session(OllamaChatSession)
+        sliding_prefill = sum(s["prompt_eval_count"] for s in sliding.stats)
+        stable_prefill = sum(s["prompt_eval_count"] for s in stable.stats)
+        self.assertLess(stable_prefill, sliding_prefill)
+
+    def test_request_prefix_is_byte_identical_between_jumps(self):
+        session = OllamaChatSession(system_prompt="系统提示", max_history=8)
+        previous, checked = None, 0
+        for i in range(1, 10):
+            session.history += [{"role": "user", "content": f"问{i}"}, {"role": "assistant", "content": f"答{i}"}]
+            messages = session.build_messages("新问题")
+            if previous is not None and messages[1] == previous[1]:
+                # 窗口没有前移时，上一轮发送的历史部分是本轮请求的前缀
+                self.assertEqual(json.dumps(messages[:len(previous) - 1], ensure_ascii=False),
+                                 json.dumps(previous[:-1], ensure_ascii=False))
+                checked += 1
+            previous = messages
+        self.assertGreater(checked, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
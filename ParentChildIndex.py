@@ -0,0 +1,189 @@
+# 父子多粒度索引：小片段（子块）用于向量匹配，较大的父窗口作为提供给大模型的上下文
+#
+# - 文档先切成约 1200 字的父窗口（不重叠），每个父窗口再切成约 250 字的子块
+# - 只有子块生成向量写入 Milvus，parent_id 字段指向父窗口；父窗口文本保存在本地 SQLite（docstore.db）
+# - 检索时多取几倍的子块，按父窗口去重后返回父窗口文本：
+#   同一父窗口的多个子块命中时只占一个结果，提示词中不再出现重复的上下文
+# - 向量数据量与原来 500/100 的切分大致相同（子块重叠比例相同），入库开销不增加
+#
+# 用法：
+#   python ParentChildIndex.py                    # 合成文本上对比两种切分的片段数、向量字符数和上下文长度
+#   python ParentChildIndex.py stats              # 查看 docstore 中的父窗口数量
+
+import hashlib
+import json
+import sqlite3
+import sys
+import threading
+from typing import Any, Dict, Iterable, List, Tuple
+
+from ChineseTextSplitter import ChineseTextSplitter
+
+DEFAULT_DB_PATH = "docstore.db"
+PARENT_CHUNK_SIZE = 1200
+CHILD_CHUNK_SIZE = 250
+CHILD_CHUNK_OVERLAP = 50
+# 检索 top_k 个父窗口时取 top_k × 8 个子块：一个父窗口通常切成 6～8 个子块，
+# 即使命中集中在少数父窗口，按父窗口去重后通常仍能凑够 top_k 个
+CHILD_OVERSAMPLE = 8
+
+
+def parent_id(source: str, text: str) -> str:
+    """父窗口编号：同一文档的相同文本得到相同编号，重复入库时覆盖而不是新增"""
+    return hashlib.blake2b(f"{source}\0{text}".encode("utf-8"), digest_size=16).hexdigest()
+
+
+class ParentChildSplitter:
+    def __init__(
+        self,
+        parent_size: int = PARENT_CHUNK_SIZE,
+        child_size: int = CHILD_CHUNK_SIZE,
+        child_overlap: int = CHILD_CHUNK_OVERLAP,
+    ):
+        """
+        Args:
+            parent_size: 父窗口最大长度
+            child_size: 子块最大长度
+            child_overlap: 同一父窗口内相邻子块的重叠长度
+        """
+        self.parent_splitter = ChineseTextSplitter(chunk_size=parent_size, chunk_overlap=0)
+        self.child_splitter = ChineseTextSplitter(chunk_size=child_size, chunk_overlap=child_overlap)
+
+    def split_pages(self, pages: Iterable[str], source: str
+                    ) -> Tuple[List[Tuple[str, int, str]], List[Tuple[str, str, int]]]:
+        """切分逐页文本
+
+        Returns:
+            (子块列表 [(子块, 起始页码, parent_id)], 父窗口列表 [(parent_id, 父窗口文本, 起始页码)])
+        """
+        children, parents = [], []
+        for text, page in self.parent_splitter.split_pages_with_numbers(pages):
+            pid = parent_id(source, text)
+            parents.append((pid, text, page))
+            # 子块不跨父窗口，页码沿用父窗口的起始页
+            children.extend((child, page, pid) for child in self.child_splitter.split_text(text))
+        return children, parents
+
+
+class ParentDocStore:
+    def __init__(self, db_path: str = DEFAULT_DB_PATH):
+        """
+        Args:
+            db_path: SQLite 数据库路径
+        """
+        self.db_path = db_path
+        self._local = threading.local()
+        conn = self._connect()
+        with conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS parents ("
+                         "id TEXT PRIMARY KEY, source TEXT, page INTEGER, text TEXT)")
+            conn.execute("CREATE INDEX IF NOT EXISTS parents_source ON parents (source)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def add(self, source: str, parents: List[Tuple[str, str, int]]) -> None:
+        """保存父窗口（子块写入 Milvus 成功后调用）"""
+        conn = self._connect()
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO parents (id, source, page, text) VALUES (?, ?, ?, ?)",
+                             [(pid, source, page, text) for pid, text, page in parents])
+
+    def get(self, ids: Iterable[str]) -> Dict[str, str]:
+        """parent_id -> 父窗口文本；不存在的编号不出现在结果中"""
+        ids = list(dict.fromkeys(i for i in ids if i))
+        if not ids:
+            return {}
+        placeholders = ",".join("?" * len(ids))
+        rows = self._connect().execute(f"SELECT id, text FROM parents WHERE id IN ({placeholders})", ids)
+        return dict(rows.fetchall())
+
+    def ids_for_source(self, source: str) -> List[str]:
+        return [r[0] for r in self._connect().execute("SELECT id FROM parents WHERE source = ?", (source,))]
+
+    def reassign(self, owners: Dict[str, str]) -> None:
+        """更改父窗口所属的文档：parent_id -> 新的 source"""
+        conn = self._connect()
+        with conn:
+            conn.executemany("UPDATE parents SET source = ? WHERE id = ?",
+                             [(source, pid) for pid, source in owners.items()])
+
+    def delete(self, ids: List[str]) -> None:
+        conn = self._connect()
+        with conn:
+            conn.executemany("DELETE FROM parents WHERE id = ?", [(i,) for i in ids])
+
+    def count(self) -> int:
+        return self._connect().execute("SELECT count(*) FROM parents").fetchone()[0]
+
+
+def expand_parents(hits: List[Dict[str, Any]], store: ParentDocStore, top_k: int) -> List[Dict[str, Any]]:
+    """把子块命中替换为父窗口：按得分顺序保留每个父窗口的第一个命中，最多 top_k 个
+
+    没有 parent_id（迁移前的片段）或 docstore 中找不到父窗口时保留片段本身。
+    命中的子块保存在 child_text 中。
+    """
+    parents = store.get(hit.get("parent_id") for hit in hits)
+    results, seen = [], set()
+    for hit in hits:
+        pid = hit.get("parent_id")
+        if pid in parents:
+            if pid in seen:
+                continue
+            seen.add(pid)
+            hit = {**hit, "child_text": hit["text"], "text": parents[pid]}
+        results.append(hit)
+        if len(results) >= top_k:
+            break
+    return results
+
+
+def delete_orphan_parents(collection: Any, store: ParentDocStore, source: str) -> int:
+    """删除文档的片段后，清理不再被任何子块引用的父窗口
+
+    去重时被转给其他文档的子块仍指向原来的父窗口：这些父窗口保留，并改为属于接管子块的文档，
+    该文档以后被删除时一并清理。
+
+    Returns:
+        删除的父窗口数
+    """
+    ids = store.ids_for_source(source)
+    if not ids:
+        return 0
+    collection.load()
+    owners: Dict[str, str] = {}
+    for i in range(0, len(ids), 1000):
+        batch = ids[i:i + 1000]
+        rows = collection.query(expr=f"parent_id in {json.dumps(batch)}", output_fields=["parent_id", "source"],
+                                consistency_level="Strong")
+        for row in rows:
+            if row["source"] != source:
+                owners.setdefault(row["parent_id"], row["source"])
+    store.reassign(owners)
+    orphans = [i for i in ids if i not in owners]
+    store.delete(orphans)
+    return len(orphans)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["stats"]:
+        print(f"父窗口数: {ParentDocStore().count()}")
+        sys.exit(0)
+
+    from ChineseTextSplitter import synthetic_pages
+
+    pages = synthetic_pages()
+    flat = ChineseTextSplitter(chunk_size=500, chunk_overlap=100).split_text("\n".join(pages))
+    children, parents = ParentChildSplitter().split_pages(pages, "synthetic.pdf")
+    child_lengths = [len(child) for child, _, _ in children]
+    print(f"500/100 切分: {len(flat)} 个片段，向量字符数 {sum(len(c) for c in flat):,}，"
+          f"平均片段 {sum(len(c) for c in flat) / len(flat):.0f} 字")
+    print(f"父子切分: {len(children)} 个子块，向量字符数 {sum(child_lengths):,}，"
+          f"平均子块 {sum(child_lengths) / len(children):.0f} 字；{len(parents)} 个父窗口，"
+          f"平均 {sum(len(t) for _, t, _ in parents) / len(parents):.0f} 字")
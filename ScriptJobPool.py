@@ -0,0 +1,432 @@
+# Concurrent execution engine for target scripts (used with LLMCallPython)
+#
+# - A bounded worker pool runs many script jobs in parallel; extra jobs wait in the queue
+# - stdout/stderr are read line by line while the script runs and can be consumed incrementally
+# - Per-job timeouts and memory (RSS) limits; the whole process group is killed when exceeded
+# - The ---JSON START--- / ---JSON END--- block is parsed as soon as its end marker arrives
+# - Jobs are identified by id and can be queried, waited on or cancelled later
+
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterator
+
+JSON_START = "---JSON START---"
+JSON_END = "---JSON END---"
+
+DEFAULT_MAX_WORKERS = os.cpu_count() or 4
+DEFAULT_TIMEOUT = 300.0  # seconds
+DEFAULT_MEMORY_LIMIT_MB = None  # no limit
+DEFAULT_MAX_OUTPUT_BYTES = 10 * 1024 * 1024  # per stream; older output is dropped beyond this
+DEFAULT_HISTORY = 1000  # finished jobs kept for lookup by id
+MONITOR_INTERVAL = 0.1
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+TIMEOUT = "timeout"
+MEMORY_EXCEEDED = "memory_exceeded"
+CANCELLED = "cancelled"
+FINISHED_STATES = {SUCCEEDED, FAILED, TIMEOUT, MEMORY_EXCEEDED, CANCELLED}
+
+
+class JsonBlockParser:
+    """Incrementally extracts JSON blocks delimited by ---JSON START--- / ---JSON END--- lines."""
+
+    def __init__(self, on_block: Callable[[Any], None] | None = None):
+        self.blocks: list[Any] = []
+        self.errors: list[str] = []
+        self.on_block = on_block
+        self._lines: list[str] | None = None
+
+    def feed(self, line: str) -> None:
+        stripped = line.strip()
+        if stripped == JSON_START:
+            self._lines = []
+        elif stripped == JSON_END and self._lines is not None:
+            text = "".join(self._lines)
+            self._lines = None
+            try:
+                block = json.loads(text)
+            except json.JSONDecodeError as e:
+                self.errors.append(f"Invalid JSON block: {e}")
+                return
+            self.blocks.append(block)
+            if self.on_block:
+                self.on_block(block)
+        elif self._lines is not None:
+            self._lines.append(line)
+
+
+def process_rss(pid: int) -> int | None:
+    """Resident memory of a process and its children in bytes (psutil if installed, else /proc)."""
+    try:
+        import psutil
+    except ImportError:
+        psutil = None
+    if psutil is not None:
+        try:
+            proc = psutil.Process(pid)
+            total = proc.memory_info().rss
+            for child in proc.children(recursive=True):
+                try:
+                    total += child.memory_info().rss
+                except psutil.Error:
+                    pass
+            return total
+        except psutil.Error:
+            return None
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+class OutputBuffer:
+    """Keeps the most recent max_bytes of a stream."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.parts: list[str] = []
+        self.size = 0
+        self.dropped = 0
+
+    def append(self, text: str) -> None:
+        self.parts.append(text)
+        self.size += len(text)
+        while self.size > self.max_bytes and len(self.parts) > 1:
+            removed = self.parts.pop(0)
+            self.size -= len(removed)
+            self.dropped += len(removed)
+
+    def getvalue(self) -> str:
+        return "".join(self.parts)
+
+
+class ScriptJob:
+    """One script run. Updated by the pool; safe to read from any thread."""
+
+    def __init__(self, argv: list[str], command: str, timeout: float | None,
+                 memory_limit_mb: float | None, max_output_bytes: int, cwd: str | None, env: dict | None):
+        self.id = uuid.uuid4().hex
+        self.argv = argv
+        self.command = command
+        self.timeout = timeout
+        self.memory_limit_mb = memory_limit_mb
+        self.cwd = cwd
+        self.env = env
+        self.status = QUEUED
+        self.returncode: int | None = None
+        self.error: str | None = None
+        self.submitted_at = time.time()
+        self.started_at: float | None = None
+        self.finished_at: float | None = None
+        self.peak_rss: int = 0
+        self.stdout = OutputBuffer(max_output_bytes)
+        self.stderr = OutputBuffer(max_output_bytes)
+        self.json = JsonBlockParser()
+        self.process: subprocess.Popen | None = None
+        self.done = threading.Event()
+        self._cancel = threading.Event()
+        self._condition = threading.Condition()
+        # (stream, line) in arrival order, bounded like the output buffers; _events_dropped counts
+        # lines discarded from the front so readers can keep absolute positions
+        self._events: deque[tuple[str, str]] = deque()
+        self._events_size = 0
+        self._events_dropped = 0
+        self._max_event_bytes = 2 * max_output_bytes
+
+    def _emit(self, stream: str, line: str) -> None:
+        with self._condition:
+            (self.stdout if stream == "stdout" else self.stderr).append(line)
+            if stream == "stdout":
+                self.json.feed(line)
+            self._events.append((stream, line))
+            self._events_size += len(line)
+            while self._events_size > self._max_event_bytes and len(self._events) > 1:
+                self._events_size -= len(self._events.popleft()[1])
+                self._events_dropped += 1
+            self._condition.notify_all()
+
+    def _finish(self, status: str) -> None:
+        with self._condition:
+            self.status = status
+            self.finished_at = time.time()
+            self._condition.notify_all()
+        self.done.set()
+
+    def iter_output(self, timeout: float | None = None) -> Iterator[tuple[str, str]]:
+        """
+        Yields (stream, line) pairs as the script produces them, from the beginning of the run,
+        until the job finishes. timeout bounds the wait for each new line. Lines older than the
+        retained output (see max_output_bytes) are skipped.
+        """
+        index = 0  # absolute position: lines yielded or skipped so far
+        while True:
+            with self._condition:
+                while index >= self._events_dropped + len(self._events) and not self.done.is_set():
+                    if not self._condition.wait(timeout):
+                        return
+                start = max(0, index - self._events_dropped)
+                pending = list(islice(self._events, start, None))
+                index = self._events_dropped + len(self._events)
+                finished = self.done.is_set()
+            yield from pending
+            if finished:
+                with self._condition:
+                    if index >= self._events_dropped + len(self._events):
+                        return
+
+    def wait(self, timeout: float | None = None) -> bool:
+        return self.done.wait(timeout)
+
+    def result(self) -> tuple[str, str, str]:
+        """(command, stdout, stderr), the same shape as execute_script_with_llm."""
+        return self.command, self.stdout.getvalue(), self.stderr.getvalue()
+
+    def to_dict(self) -> dict:
+        duration = None
+        if self.started_at:
+            duration = (self.finished_at or time.time()) - self.started_at
+        return {
+            "id": self.id,
+            "command": self.command,
+            "status": self.status,
+            "returncode": self.returncode,
+            "error": self.error,
+            "duration": duration,
+            "peak_rss_mb": round(self.peak_rss / 1024 / 1024, 1),
+            "json_blocks": list(self.json.blocks),
+            "stdout_dropped": self.stdout.dropped,
+            "stderr_dropped": self.stderr.dropped,
+        }
+
+
+class ScriptJobPool:
+    def __init__(
+        self,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        timeout: float | None = DEFAULT_TIMEOUT,
+        memory_limit_mb: float | None = DEFAULT_MEMORY_LIMIT_MB,
+        max_output_bytes: int = DEFAULT_MAX_OUTPUT_BYTES,
+        history: int = DEFAULT_HISTORY,
+    ):
+        """
+        Args:
+            max_workers: Number of scripts that may run at the same time.
+            timeout: Default per-job wall-clock limit in seconds (None for no limit).
+            memory_limit_mb: Default per-job RSS limit in MB, including child processes (None for no limit).
+            max_output_bytes: Per-stream output kept in memory for each job.
+            history: Number of finished jobs kept for lookup by id.
+        """
+        self.timeout = timeout
+        self.memory_limit_mb = memory_limit_mb
+        self.max_output_bytes = max_output_bytes
+        self.history = history
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="script-job")
+        self._jobs: "OrderedDict[str, ScriptJob]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(
+        self,
+        argv: list[str],
+        command: str | None = None,
+        timeout: float | None = ...,
+        memory_limit_mb: float | None = ...,
+        cwd: str | None = None,
+        env: dict | None = None,
+    ) -> str:
+        """Queues a job and returns its id. timeout / memory_limit_mb default to the pool settings."""
+        job = ScriptJob(
+            argv,
+            command or " ".join(argv),
+            self.timeout if timeout is ... else timeout,
+            self.memory_limit_mb if memory_limit_mb is ... else memory_limit_mb,
+            self.max_output_bytes,
+            cwd,
+            env,
+        )
+        with self._lock:
+            self._jobs[job.id] = job
+            self._trim_history()
+        self._executor.submit(self._run, job)
+        return job.id
+
+    def submit_script(self, script_path: str, params: dict | str | None = None, mode: str = "auto", **kwargs) -> str:
+        """Resolves the command for a script with LLMCallPython (argparse fast path, LLM fallback) and queues it."""
+        from LLMCallPython import resolve_argv, format_command
+        argv, _ = resolve_argv(script_path, params, mode)
+        return self.submit(argv, format_command(argv), **kwargs)
+
+    def _trim_history(self) -> None:
+        finished = [job_id for job_id, job in self._jobs.items() if job.done.is_set()]
+        for job_id in finished[:max(0, len(finished) - self.history)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id: str) -> ScriptJob | None:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def status(self, job_id: str) -> dict | None:
+        job = self.get(job_id)
+        return job.to_dict() if job else None
+
+    def jobs(self) -> list[dict]:
+        with self._lock:
+            return [job.to_dict() for job in self._jobs.values()]
+
+    def wait(self, job_id: str, timeout: float | None = None) -> ScriptJob:
+        job = self.get(job_id)
+        if job is None:
+            raise KeyError(job_id)
+        job.wait(timeout)
+        return job
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancels a queued job or kills a running one. Returns False if the job is unknown or finished."""
+        job = self.get(job_id)
+        if job is None or job.done.is_set():
+            return False
+        job._cancel.set()
+        if job.process is not None:
+            self._kill(job.process)
+        return True
+
+    def shutdown(self, cancel_running: bool = False) -> None:
+        if cancel_running:
+            with self._lock:
+                pending = list(self._jobs)
+            for job_id in pending:
+                self.cancel(job_id)
+        self._executor.shutdown(wait=True)
+
+    @staticmethod
+    def _kill(process: subprocess.Popen) -> None:
+        """Kills the script together with any processes it started."""
+        try:
+            if os.name == "nt":
+                process.kill()
+            else:
+                os.killpg(process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError, OSError):
+            pass
+
+    def _run(self, job: ScriptJob) -> None:
+        if job._cancel.is_set():
+            job._finish(CANCELLED)
+            return
+
+        env = dict(os.environ if job.env is None else job.env)
+        env.setdefault("PYTHONUNBUFFERED", "1")  # flush prints immediately so output streams
+        env.setdefault("PYTHONIOENCODING", "utf-8")
+        try:
+            job.process = subprocess.Popen(
+                job.argv,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                stdin=subprocess.DEVNULL,
+                cwd=job.cwd,
+                env=env,
+                start_new_session=os.name != "nt",
+            )
+        except OSError as e:
+            job.error = f"Error executing command '{job.command}': {e}"
+            job.stderr.append(job.error)
+            job._finish(FAILED)
+            return
+
+        job.status = RUNNING
+        job.started_at = time.time()
+        readers = [
+            threading.Thread(target=self._read_stream, args=(job, job.process.stdout, "stdout"), daemon=True),
+            threading.Thread(target=self._read_stream, args=(job, job.process.stderr, "stderr"), daemon=True),
+        ]
+        for reader in readers:
+            reader.start()
+
+        status = None
+        while job.process.poll() is None:
+            if job._cancel.is_set():
+                status = CANCELLED
+            elif job.timeout is not None and time.time() - job.started_at > job.timeout:
+                status = TIMEOUT
+                job.error = f"Timed out after {job.timeout}s"
+            elif job.memory_limit_mb is not None:
+                rss = process_rss(job.process.pid) or 0
+                job.peak_rss = max(job.peak_rss, rss)
+                if rss > job.memory_limit_mb * 1024 * 1024:
+                    status = MEMORY_EXCEEDED
+                    job.error = f"Memory limit exceeded: {rss / 1024 / 1024:.0f} MB > {job.memory_limit_mb} MB"
+            if status:
+                self._kill(job.process)
+                break
+            time.sleep(MONITOR_INTERVAL)
+
+        job.returncode = job.process.wait()
+        for reader in readers:
+            reader.join()
+        if status is None:
+            status = SUCCEEDED if job.returncode == 0 else FAILED
+        if job.error:
+            job._emit("stderr", job.error + "\n")
+        job._finish(status)
+        with self._lock:
+            self._trim_history()
+
+    @staticmethod
+    def _read_stream(job: ScriptJob, stream, name: str) -> None:
+        with stream:
+            for raw in iter(stream.readline, b""):
+                job._emit(name, raw.decode("utf-8", errors="replace"))
+
+
+_default_pool: ScriptJobPool | None = None
+_default_pool_lock = threading.Lock()
+
+
+def get_pool() -> ScriptJobPool:
+    """Process-wide shared pool with default settings."""
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = ScriptJobPool()
+        return _default_pool
+
+
+# --- Example Usage ---
+if __name__ == "__main__":
+    pool = ScriptJobPool(max_workers=4, timeout=5, memory_limit_mb=200)
+
+    # Ten runs of the dummy script in parallel, plus a job that times out and one that exceeds its memory limit
+    script = "dummy_target_script.py"
+    ids = [pool.submit([sys.executable, script, "--input", f"data/{i}.csv", "--names", "a", "b"]) for i in range(10)]
+    slow = pool.submit([sys.executable, "-c", "import time\nfor i in range(100):\n    print(i, flush=True); time.sleep(0.5)"],
+                       timeout=1.2)
+    hog = pool.submit([sys.executable, "-c", "import time\nx = bytearray(400 * 1024 * 1024)\ntime.sleep(5)"])
+
+    print("Streaming output of the slow job:")
+    for stream, line in pool.get(slow).iter_output():
+        print(f"  [{stream}] {line.rstrip()}")
+
+    start = time.perf_counter()
+    for job_id in ids + [slow, hog]:
+        pool.wait(job_id)
+    print(f"\nAll jobs finished in {time.perf_counter() - start:.2f}s")
+    for job_id in ids[:2] + [slow, hog]:
+        info = pool.status(job_id)
+        print(f"{job_id[:8]} {info['status']:<16} rc={info['returncode']} "
+              f"json={info['json_blocks'][0]['processed_input'] if info['json_blocks'] else None} {info['error'] or ''}")
+    pool.shutdown()
@@ -0,0 +1,192 @@
+# 检索路由：判断本轮对话是否需要检索（网络搜索或 RAG）
+# 使用小型的嵌入相似度分类器：把问题与两组原型句子（需要检索 / 不需要检索）比较，
+# 原型向量只计算一次并缓存。默认的嵌入是字符 n-gram 哈希向量，纯本地计算、
+# 不依赖模型，每次判断耗时在毫秒以内；也可以换成 Ollama 等真实的嵌入模型。
+
+import math
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from functools import lru_cache
+from typing import List, Dict, Callable, Optional, Any, Sequence
+
+# 嵌入函数：文本 -> 稀疏向量 {维度: 权重}（已归一化）
+Embedder = Callable[[str], Dict[int, float]]
+
+NEED_RETRIEVAL_EXAMPLES = [
+    "今天的新闻有哪些", "最新的消息是什么", "现在的天气怎么样", "明天北京天气",
+    "这个股票现在的价格是多少", "比特币今天多少钱", "最近发布了什么新产品",
+    "谁赢得了昨天的比赛", "现任的总统是谁", "某公司的最新财报",
+    "帮我搜索一下相关资料", "查询一下这个信息", "网上有什么评价",
+    "这篇文档里是怎么说的", "根据资料回答", "项目文档中关于基金的内容",
+    "最新版本有什么新特性", "今年的政策有什么变化", "航班什么时候起飞",
+    "what is the latest news", "current weather in london", "who won the game yesterday",
+    "search the web for", "latest release of python", "stock price today",
+]
+
+NO_RETRIEVAL_EXAMPLES = [
+    "你好", "您好啊", "谢谢", "再见", "你是谁", "早上好", "哈哈",
+    "帮我写一首诗", "给我讲个笑话", "把这句话翻译成英文", "帮我润色这段文字",
+    "计算一下 23 乘以 47", "用 Python 写一个冒泡排序", "解释一下什么是递归",
+    "总结一下我们刚才的对话", "你觉得呢", "继续", "好的", "没问题",
+    "hello", "hi there", "thanks", "tell me a joke", "write a poem about the sea",
+    "translate this sentence", "what is 2 plus 2",
+]
+
+# 显式要求检索的关键词，命中时直接判为需要检索
+EXPLICIT_KEYWORDS = ["搜索", "查询", "search", "google"]
+
+
+def hashed_ngram_embedding(text: str, dim: int = 1024, ngram_range: Sequence[int] = (1, 2, 3)) -> Dict[int, float]:
+    """字符 n-gram 哈希向量，对中文和英文都适用"""
+    text = " ".join(text.lower().split())
+    vec: Dict[int, float] = {}
+    for n in ngram_range:
+        for i in range(len(text) - n + 1):
+            gram = text[i:i + n]
+            if gram.strip() == "":
+                continue
+            idx = zlib.crc32(gram.encode("utf-8")) % dim
+            vec[idx] = vec.get(idx, 0.0) + 1.0
+    norm = math.sqrt(sum(v * v for v in vec.values()))
+    if norm:
+        vec = {k: v / norm for k, v in vec.items()}
+    return vec
+
+
+def dense_embedder(embed: Callable[[str], List[float]]) -> Embedder:
+    """把返回稠密向量的嵌入函数（如 OllamaEmbeddings.embed_query）包装成 Embedder"""
+    def wrapper(text: str) -> Dict[int, float]:
+        values = embed(text)
+        norm = math.sqrt(sum(v * v for v in values)) or 1.0
+        return {i: v / norm for i, v in enumerate(values) if v}
+    return wrapper
+
+
+def cosine(a: Dict[int, float], b: Dict[int, float]) -> float:
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(v * b.get(k, 0.0) for k, v in a.items())
+
+
+class SearchRouter:
+    def __init__(
+        self,
+        embed: Optional[Embedder] = None,
+        need_examples: Optional[List[str]] = None,
+        skip_examples: Optional[List[str]] = None,
+        threshold: float = 0.0,
+        margin: float = 0.05,
+        cache_size: int = 1024,
+    ):
+        """初始化路由器
+
+        Args:
+            embed: 嵌入函数，默认使用字符 n-gram 哈希向量
+            need_examples: 需要检索的原型句子
+            skip_examples: 不需要检索的原型句子
+            threshold: 分数大于该值时判为需要检索
+            margin: 分数落在 threshold ± margin 内时视为不确定，可以走投机执行
+            cache_size: 问题嵌入的 LRU 缓存大小
+        """
+        self.embed = lru_cache(maxsize=cache_size)(embed or hashed_ngram_embedding)
+        self.need_examples = need_examples or NEED_RETRIEVAL_EXAMPLES
+        self.skip_examples = skip_examples or NO_RETRIEVAL_EXAMPLES
+        self.threshold = threshold
+        self.margin = margin
+        self._prototypes: Optional[Dict[str, List[Dict[int, float]]]] = None
+        self._lock = threading.Lock()
+
+    def _get_prototypes(self) -> Dict[str, List[Dict[int, float]]]:
+        """原型向量只计算一次"""
+        with self._lock:
+            if self._prototypes is None:
+                self._prototypes = {
+                    "need": [self.embed(t) for t in self.need_examples],
+                    "skip": [self.embed(t) for t in self.skip_examples],
+                }
+            return self._prototypes
+
+    def score(self, query: str) -> float:
+        """需要检索的倾向：与“需要检索”原型的最大相似度减去与“不需要检索”原型的最大相似度"""
+        prototypes = self._get_prototypes()
+        q = self.embed(query.strip())
+        need = max(cosine(q, p) for p in prototypes["need"])
+        skip = max(cosine(q, p) for p in prototypes["skip"])
+        return need - skip
+
+    def route(self, query: str) -> Dict[str, Any]:
+        """判断本轮是否需要检索
+
+        Returns:
+            包含判断结果的字典：
+            - need_search: 是否需要检索
+            - uncertain: 分数是否落在不确定区间
+            - score: 分类分数
+        """
+        lowered = query.lower()
+        if any(k in lowered for k in EXPLICIT_KEYWORDS):
+            return {"need_search": True, "uncertain": False, "score": 1.0}
+        s = self.score(query)
+        return {
+            "need_search": s > self.threshold,
+            "uncertain": abs(s - self.threshold) <= self.margin,
+            "score": s,
+        }
+
+
+def speculative_answer(
+    search: Callable[[], List[Dict[str, Any]]],
+    draft: Callable[[threading.Event], str],
+    answer: Callable[[List[Dict[str, Any]]], str],
+) -> Dict[str, Any]:
+    """投机执行：同时发起检索和不带上下文的草稿生成，取先完成且有效的一方
+
+    - 检索先完成且有结果：取消草稿，用检索结果生成回答
+    - 草稿先完成（或检索没有结果）：直接使用草稿，检索结果留在缓存中
+
+    Args:
+        search: 执行检索，返回结果列表
+        draft: 生成不带上下文的回答；参数为取消事件，被置位时应尽快停止生成
+        answer: 根据检索结果生成回答
+
+    Returns:
+        包含 response / searched / search_results 的字典
+    """
+    cancel = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="speculative")
+    try:
+        search_future = executor.submit(search)
+        draft_future = executor.submit(draft, cancel)
+        done, _ = wait([search_future, draft_future], return_when=FIRST_COMPLETED)
+
+        if search_future in done:
+            results = search_future.exception() is None and search_future.result()
+            if results:
+                cancel.set()
+                return {"response": answer(results), "searched": True, "search_results": results}
+        return {"response": draft_future.result(), "searched": False, "search_results": None}
+    finally:
+        executor.shutdown(wait=False)
+
+
+if __name__ == "__main__":
+    import time
+
+    labeled = [
+        ("hello", False), ("你好呀", False), ("谢谢你的帮助", False), ("写一首关于春天的诗", False),
+        ("把这段话翻译成英文", False), ("用 Java 实现快速排序", False), ("解释一下什么是闭包", False),
+        ("今天上海的天气怎么样", True), ("最新的 iPhone 价格是多少", True), ("昨天的比赛谁赢了", True),
+        ("搜索一下 Milvus 的最新版本", True), ("最近有什么科技新闻", True), ("what's the latest news on AI", True),
+        ("特斯拉今天的股价", True),
+    ]
+    router = SearchRouter()
+    router.route("预热")
+    start = time.perf_counter()
+    correct = 0
+    for text, expected in labeled:
+        decision = router.route(text)
+        correct += decision["need_search"] == expected
+        print(f"{text:<30} 检索: {decision['need_search']!s:<6} 不确定: {decision['uncertain']!s:<6} 分数: {decision['score']:+.3f}")
+    elapsed = (time.perf_counter() - start) * 1000 / len(labeled)
+    print(f"\n准确率: {correct}/{len(labeled)}，平均每次判断 {elapsed:.3f} ms")
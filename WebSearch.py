@@ -0,0 +1,213 @@
+# 带时间预算和缓存的网络搜索
+# - 搜索在后台线程中执行，调用方最多等待 budget 秒，超时后使用已经返回的部分结果
+# - 搜索在预算之外继续完成，完整结果写入缓存供下次使用
+# - 结果按规范化后的查询缓存（TTL），热门查询缓存更久
+# - 相同查询同时只会发起一次搜索
+# - 搜索提供方是一个可替换的函数，便于使用本地假数据离线测试
+
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional, Callable, Iterable, Any
+
+# 搜索提供方：(query, max_results) -> 逐条产出 {"title", "snippet", "link"}
+SearchProvider = Callable[[str, int], Iterable[Dict[str, str]]]
+
+
+def normalize_query(query: str) -> str:
+    """规范化查询：小写、去掉首尾标点、合并空白"""
+    query = query.lower().strip()
+    query = re.sub(r"\s+", " ", query)
+    return query.strip(" ?？!！。.,，;；:：\"'“”")
+
+
+class SearchCache:
+    def __init__(self, ttl: float = 600, popular_ttl: float = 3600, popular_hits: int = 3, max_entries: int = 512):
+        """搜索结果缓存
+
+        Args:
+            ttl: 普通查询的缓存时间（秒）
+            popular_ttl: 热门查询的缓存时间（秒）
+            popular_hits: 命中多少次后视为热门查询
+            max_entries: 最多缓存的查询数，超过后淘汰最久未使用的
+        """
+        self.ttl = ttl
+        self.popular_ttl = popular_ttl
+        self.popular_hits = popular_hits
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, query: str) -> Optional[List[Dict[str, str]]]:
+        key = normalize_query(query)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                ttl = self.popular_ttl if entry["hits"] >= self.popular_hits else self.ttl
+                if time.monotonic() - entry["stored_at"] < ttl:
+                    entry["hits"] += 1
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return list(entry["results"])
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, query: str, results: List[Dict[str, str]]) -> None:
+        key = normalize_query(query)
+        with self._lock:
+            hits = self._entries[key]["hits"] if key in self._entries else 0
+            self._entries[key] = {"results": list(results), "stored_at": time.monotonic(), "hits": hits}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class SearchHandle:
+    """一次进行中的搜索，可以随时读取已经到达的结果"""
+
+    def __init__(self, query: str):
+        self.query = query
+        self.results: List[Dict[str, str]] = []
+        self.error: Optional[Exception] = None
+        self.done = threading.Event()
+        self._lock = threading.Lock()
+
+    def add(self, result: Dict[str, str]) -> None:
+        with self._lock:
+            self.results.append(result)
+
+    def wait(self, timeout: Optional[float] = None) -> List[Dict[str, str]]:
+        """最多等待 timeout 秒，返回当前已经到达的结果"""
+        self.done.wait(timeout)
+        with self._lock:
+            return list(self.results)
+
+
+class WebSearch:
+    def __init__(
+        self,
+        provider: SearchProvider,
+        max_results: int = 5,
+        budget: float = 2.0,
+        cache: Optional[SearchCache] = None,
+        max_workers: int = 4,
+    ):
+        """初始化搜索
+
+        Args:
+            provider: 搜索提供方
+            max_results: 每次搜索的最大结果数
+            budget: 默认的等待预算（秒），超时后返回部分结果
+            cache: 结果缓存，默认新建一个
+            max_workers: 后台搜索线程数
+        """
+        self.provider = provider
+        self.max_results = max_results
+        self.budget = budget
+        self.cache = cache or SearchCache()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="web-search")
+        self._inflight: Dict[str, SearchHandle] = {}
+        self._lock = threading.Lock()
+
+    def search_async(self, query: str) -> SearchHandle:
+        """发起搜索并立即返回句柄；命中缓存时句柄已完成"""
+        handle = SearchHandle(query)
+        cached = self.cache.get(query)
+        if cached is not None:
+            handle.results = cached
+            handle.done.set()
+            return handle
+
+        key = normalize_query(query)
+        with self._lock:
+            if key in self._inflight:
+                return self._inflight[key]
+            self._inflight[key] = handle
+        self._executor.submit(self._run, key, handle)
+        return handle
+
+    def _run(self, key: str, handle: SearchHandle) -> None:
+        try:
+            for result in self.provider(handle.query, self.max_results):
+                handle.add(result)
+                if len(handle.results) >= self.max_results:
+                    break
+            self.cache.put(handle.query, handle.results)
+        except Exception as e:
+            handle.error = e
+            print(f"搜索出错: {str(e)}")
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            handle.done.set()
+
+    def search(self, query: str, budget: Optional[float] = None) -> List[Dict[str, str]]:
+        """在时间预算内搜索，返回已经到达的结果（可能不完整）"""
+        return self.search_async(query).wait(self.budget if budget is None else budget)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
+
+
+def ddgs_provider(ddgs: Any = None) -> SearchProvider:
+    """DuckDuckGo 搜索提供方
+
+    Args:
+        ddgs: DDGS 实例；为 None 时在第一次搜索时导入 duckduckgo_search 并创建
+    """
+    clients = [ddgs] if ddgs is not None else []
+    lock = threading.Lock()
+
+    def provider(query: str, max_results: int) -> Iterable[Dict[str, str]]:
+        with lock:
+            if not clients:
+                from duckduckgo_search import DDGS
+                clients.append(DDGS())
+        for r in clients[0].text(query, max_results=max_results):
+            yield {
+                "title": r.get("title", ""),
+                "snippet": r.get("body", ""),
+                "link": r.get("href", r.get("link", ""))
+            }
+    return provider
+
+
+class FakeSearchProvider:
+    """本地假搜索提供方：按固定延迟逐条返回结果，用于离线测试"""
+
+    def __init__(self, first_delay: float = 0.3, per_result_delay: float = 0.2):
+        self.first_delay = first_delay
+        self.per_result_delay = per_result_delay
+        self.calls = 0
+
+    def __call__(self, query: str, max_results: int) -> Iterable[Dict[str, str]]:
+        self.calls += 1
+        time.sleep(self.first_delay)
+        for i in range(max_results):
+            if i:
+                time.sleep(self.per_result_delay)
+            yield {
+                "title": f"{query} - 结果 {i + 1}",
+                "snippet": f"关于 {query} 的第 {i + 1} 条摘要",
+                "link": f"https://example.com/{i + 1}"
+            }
+
+
+if __name__ == "__main__":
+    # 离线演示：预算内返回部分结果，后台补全后再次查询命中缓存
+    provider = FakeSearchProvider(first_delay=0.2, per_result_delay=0.2)
+    search = WebSearch(provider, max_results=5, budget=0.5)
+
+    for query in ["Python 3.12 新特性", "python 3.12   新特性？"]:
+        start = time.perf_counter()
+        results = search.search(query)
+        print(f"{query!r}: {len(results)} 条结果，耗时 {(time.perf_counter() - start) * 1000:.0f} ms")
+        time.sleep(1.2)  # 等待后台搜索完成并写入缓存
+
+    print(f"提供方调用次数: {provider.calls}，缓存命中: {search.cache.hits}，未命中: {search.cache.misses}")
+    search.close()
@@ -0,0 +1,112 @@
+# 启动耗时检查：用 `python -X importtime` 测量入口模块的导入时间，超出预算或导入了重量级依赖时返回非零退出码
+#
+# 入口模块只应在用到时才导入 torch / sentence_transformers / pymilvus / langchain / fitz 等依赖，
+# 这些依赖一旦回到模块顶层，启动时间会从几百毫秒变成数秒，这里会直接报错。
+#
+# 用法：
+#   python check_import_time.py                   # 检查全部入口模块
+#   python check_import_time.py ChatWithRAG       # 只检查指定模块
+#   python check_import_time.py --scale 2         # 机器较慢时按比例放宽预算
+
+import argparse
+import os
+import subprocess
+import sys
+from typing import List, Tuple
+
+# 入口模块 -> 导入耗时预算（毫秒，包含 requests 等轻量依赖）
+BUDGETS_MS = {
+    "ChatWithRAG": 400,
+    "DocSearch": 100,
+    "DocSearchSentenceTransformer": 100,
+    "NetChatBot": 400,
+}
+
+# 入口模块在导入阶段不允许加载的顶层包
+HEAVY_PACKAGES = (
+    "torch",
+    "transformers",
+    "sentence_transformers",
+    "pymilvus",
+    "langchain",
+    "langchain_core",
+    "langchain_community",
+    "langchain_ollama",
+    "fitz",
+    "ollama",
+    "duckduckgo_search",
+)
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def measure_import(module: str) -> Tuple[float, List[str], str]:
+    """在新的解释器中导入模块
+
+    Returns:
+        (累计导入耗时毫秒, 导入过程中加载的全部模块名, 导入失败时的错误输出)
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, cwd=ROOT,
+    )
+    cumulative_ms = 0.0
+    imported = []
+    other = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            other.append(line)
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue  # 表头
+        name = parts[2].strip()
+        imported.append(name)
+        if parts[2].rstrip() == f" {module}":  # 没有缩进的行是顶层导入
+            cumulative_ms = int(parts[1]) / 1000
+    error = "\n".join(other[-5:]) if result.returncode != 0 else ""
+    return cumulative_ms, imported, error
+
+
+def check(modules: List[str], scale: float = 1.0, repeat: int = 3) -> bool:
+    ok = True
+    for module in modules:
+        budget = BUDGETS_MS[module] * scale
+        timings = []
+        for _ in range(repeat):
+            elapsed, imported, error = measure_import(module)
+            if error:
+                break
+            timings.append(elapsed)
+        if error:
+            print(f"FAIL {module}: 导入失败\n{error}")
+            ok = False
+            continue
+
+        heavy = sorted({name.split(".")[0] for name in imported} & set(HEAVY_PACKAGES))
+        best = min(timings)  # 取最小值，排除磁盘缓存和系统负载的干扰
+        problems = []
+        if best > budget:
+            problems.append(f"耗时 {best:.0f} ms 超出预算 {budget:.0f} ms")
+        if heavy:
+            problems.append(f"启动时导入了重量级依赖: {', '.join(heavy)}")
+        if problems:
+            print(f"FAIL {module}: {'；'.join(problems)}")
+            ok = False
+        else:
+            print(f"ok   {module}: {best:.0f} ms（预算 {budget:.0f} ms）")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="检查入口模块的导入耗时")
+    parser.add_argument("modules", nargs="*", help=f"要检查的模块，默认全部：{', '.join(BUDGETS_MS)}")
+    parser.add_argument("--scale", type=float, default=1.0, help="预算放大倍数")
+    parser.add_argument("--repeat", type=int, default=3, help="每个模块测量次数，取最小值")
+    args = parser.parse_args()
+    unknown = [m for m in args.modules if m not in BUDGETS_MS]
+    if unknown:
+        parser.error(f"没有为这些模块设置预算: {', '.join(unknown)}")
+
+    if not check(args.modules or list(BUDGETS_MS), args.scale, args.repeat):
+        sys.exit(1)
@@ -1,22 +1,109 @@
 import os
-from flask import Flask, request, jsonify, send_file
+import json
+import base64
+import bisect
+import fnmatch
+import threading
+import time
+import uuid
+import zlib
+import shutil
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, request, jsonify, send_file, Response, stream_with_context
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 import hashlib
 from datetime import datetime
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+from search_index import SearchIndex
+from change_feed import ChangeFeed
 
 app = Flask(__name__)
 CORS(app)  # 允许跨域请求
 
 # 配置文件
-UPLOAD_FOLDER = 'E:\AIProjects\AITest\MCPFileTest'
+UPLOAD_FOLDER = os.environ.get('MCP_UPLOAD_FOLDER', 'E:\AIProjects\AITest\MCPFileTest')
 ALLOWED_EXTENSIONS = {'txt', 'pdf', 'png', 'jpg', 'jpeg', 'gif', 'json'}
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB限制
+app.config['MAX_READ_BYTES'] = 1024 * 1024  # 单次读取内容的上限，超出部分通过 cursor 继续读取
+app.config['READ_CHUNK_SIZE'] = 64 * 1024  # 流式读取的块大小
+app.config['TEXT_ENCODING'] = 'utf-8'
+app.config['LIST_PAGE_SIZE'] = 1000  # 目录列表默认每页条数
+app.config['LIST_MAX_PAGE_SIZE'] = 10000
+app.config['LIST_CACHE_TTL'] = 5  # 目录元数据缓存的最长有效时间（秒），兜底文件内容原地修改的情况
+# 分块上传的临时文件、上传状态和内容哈希索引存放在上传目录下的隐藏目录中
+UPLOAD_STATE_DIRNAME = '.uploads'
+app.config['UPLOAD_STATE_FOLDER'] = os.path.join(UPLOAD_FOLDER, UPLOAD_STATE_DIRNAME)
+app.config['UPLOAD_CHUNK_SIZE'] = 8 * 1024 * 1024  # 建议的分块大小，单个分块仍受 MAX_CONTENT_LENGTH 限制
+app.config['BATCH_MAX_OPERATIONS'] = 200  # 单个批量请求的最大操作数
+app.config['BATCH_MAX_WORKERS'] = 8  # 批量操作的并发线程数
+app.config['SEARCH_PAGE_SIZE'] = 50  # 搜索默认返回条数
+app.config['SEARCH_MAX_PAGE_SIZE'] = 1000
+app.config['SEARCH_RECONCILE_INTERVAL'] = int(os.environ.get('MCP_SEARCH_RECONCILE_INTERVAL', '30'))  # 扫描外部修改的间隔（秒）
+app.config['CHANGES_MAX_EVENTS'] = 100000  # 变更日志最多保留的事件数
+app.config['CHANGES_PAGE_SIZE'] = 500
+app.config['CHANGES_MAX_WAIT'] = 60  # 长轮询的最长等待时间（秒）
+app.config['CHANGES_HEARTBEAT'] = 15  # SSE 心跳间隔（秒）
 
 # 确保上传目录存在
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+os.makedirs(app.config['UPLOAD_STATE_FOLDER'], exist_ok=True)
+
+# 全文检索索引：本服务的写操作同步更新，外部修改由后台监听发现；索引发现的变化写入变更日志
+change_feed = ChangeFeed(os.path.join(app.config['UPLOAD_STATE_FOLDER'], 'changes.db'),
+                         max_events=app.config['CHANGES_MAX_EVENTS'])
+search_index = SearchIndex(UPLOAD_FOLDER, os.path.join(app.config['UPLOAD_STATE_FOLDER'], 'search_index.db'),
+                           exclude=(UPLOAD_STATE_DIRNAME,), on_change=change_feed.append)
+
+def try_lock_file(f):
+    """对打开的文件加非阻塞的独占锁（操作系统级，多个进程之间有效，进程退出时自动释放），已被占用时返回 False"""
+    try:
+        if fcntl:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+def unlock_file(f):
+    if fcntl:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+_watcher_started = threading.Event()
+_watcher_lock_file = None  # 负责监听的进程持有该文件的锁直到退出
+
+def start_watcher():
+    """启动外部修改的监听（由 serve.py 或 __main__ 在每个工作进程中调用，导入 app 时不会启动）
+
+    多个工作进程时通过 .uploads/watcher.lock 文件锁选出一个进程负责监听，外部修改只写入一次变更日志；
+    其余进程每隔 SEARCH_RECONCILE_INTERVAL 秒重试一次，负责的进程退出（例如 gunicorn 回收 worker）后由它们接替。
+    """
+    if _watcher_started.is_set():
+        return
+    _watcher_started.set()
+    interval = app.config['SEARCH_RECONCILE_INTERVAL']
+
+    def elect():
+        global _watcher_lock_file
+        lock_file = open(os.path.join(app.config['UPLOAD_STATE_FOLDER'], 'watcher.lock'), 'a+b')
+        while not try_lock_file(lock_file):
+            time.sleep(interval)
+        _watcher_lock_file = lock_file
+        search_index.start_watching(interval)
+
+    threading.Thread(target=elect, name='search-watcher-election', daemon=True).start()
 
 def allowed_file(filename):
     return '.' in filename and \
@@ -31,8 +118,156 @@ def get_file_info(filepath):
         'is_dir': os.path.isdir(filepath)
     }
 
+def encode_cursor(offset, line, mtime_ns):
+    """生成续读 cursor：记录下一次读取的字节偏移、行号和文件修改时间"""
+    raw = f"{offset}:{line}:{mtime_ns}".encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+def decode_cursor(cursor):
+    offset, line, mtime_ns = base64.urlsafe_b64decode(cursor.encode()).decode().split(':')
+    return int(offset), int(line), int(mtime_ns)
+
+def utf8_safe_end(data):
+    """去掉末尾不完整的 UTF-8 字符，返回可以安全解码的长度"""
+    end = len(data)
+    for back in range(1, min(4, end) + 1):
+        byte = data[end - back]
+        if byte & 0xC0 == 0x80:  # 续字节，继续向前找首字节
+            continue
+        if byte & 0x80 == 0:  # ASCII
+            return end
+        need = 2 if byte & 0xE0 == 0xC0 else 3 if byte & 0xF0 == 0xE0 else 4
+        return end if back >= need else end - back
+    return end
+
+def read_byte_range(full_path, offset, length):
+    """读取 [offset, offset + length) 字节，结尾对齐到完整字符"""
+    with open(full_path, 'rb') as f:
+        f.seek(offset)
+        data = f.read(length)
+    if len(data) == length:
+        data = data[:utf8_safe_end(data)]
+    return data
+
+def read_line_range(full_path, offset, max_lines, max_bytes):
+    """从字节偏移 offset 开始读取最多 max_lines 行（同时受 max_bytes 限制），返回 (数据, 完整行数)"""
+    chunks = []
+    size = 0
+    count = 0
+    with open(full_path, 'rb') as f:
+        f.seek(offset)
+        while count < max_lines and size < max_bytes:
+            line = f.readline(max_bytes - size)
+            if not line:
+                break
+            if not line.endswith(b'\n') and size + len(line) >= max_bytes:
+                # 剩余额度放不下整行：第一行就超长时截断返回，否则留到下一页
+                if not chunks:
+                    chunks.append(line[:utf8_safe_end(line)])
+                break
+            chunks.append(line)
+            size += len(line)
+            count += 1
+    return b''.join(chunks), count
+
+# 目录元数据缓存：{目录绝对路径: {'mtime_ns', 'scanned_at', 'version', 'entries', 'sorted'}}
+# 目录的 mtime 在增删改名时变化，据此判断缓存是否失效；本服务自己的写操作会主动失效缓存
+_listing_cache = {}
+_listing_lock = threading.Lock()
+
+SORT_FIELDS = {
+    'name': lambda e: e['name'],
+    'size': lambda e: e['size'],
+    'modified': lambda e: e['modified'],
+}
+
+def invalidate_listing(dir_path):
+    """目录内容发生变化时调用，丢弃该目录的缓存"""
+    with _listing_lock:
+        _listing_cache.pop(os.path.abspath(dir_path), None)
+
+def index_path(full_path):
+    """文件发生变化后更新检索索引；索引出错不影响文件操作本身，后台扫描会再次修正"""
+    try:
+        search_index.refresh(full_path)
+    except Exception as e:
+        print(f"更新检索索引失败: {full_path}: {e}")
+
+def scan_directory(full_path):
+    """使用 os.scandir 扫描目录，返回缓存的条目信息"""
+    full_path = os.path.abspath(full_path)
+    mtime_ns = os.stat(full_path).st_mtime_ns
+    with _listing_lock:
+        cached = _listing_cache.get(full_path)
+        if cached and cached['mtime_ns'] == mtime_ns and \
+                time.monotonic() - cached['scanned_at'] < app.config['LIST_CACHE_TTL']:
+            return cached
+
+    entries = []
+    newest = 0
+    with os.scandir(full_path) as it:
+        for entry in it:
+            if entry.name == UPLOAD_STATE_DIRNAME:
+                continue
+            try:
+                # is_dir 使用目录项自带的类型信息，不额外 stat
+                stat = entry.stat()
+                newest = max(newest, stat.st_mtime_ns)
+                entries.append({
+                    'name': entry.name,
+                    'size': stat.st_size,
+                    'modified': datetime.fromtimestamp(stat.st_mtime).isoformat(),
+                    'created': datetime.fromtimestamp(stat.st_ctime).isoformat(),
+                    'is_dir': entry.is_dir()
+                })
+            except FileNotFoundError:
+                continue  # 扫描过程中被删除
+
+    cached = {
+        'mtime_ns': mtime_ns,
+        'scanned_at': time.monotonic(),
+        # 版本只取决于文件系统状态，多个 worker 进程算出的 ETag 一致
+        'version': f"{mtime_ns:x}-{newest:x}-{len(entries):x}",
+        'entries': entries,
+        'sorted': {}
+    }
+    with _listing_lock:
+        _listing_cache[full_path] = cached
+    return cached
+
+def sorted_entries(cached, sort):
+    """按字段排序后的条目及对应的排序键（每种排序只计算一次）"""
+    if sort not in cached['sorted']:
+        key = SORT_FIELDS[sort]
+        items = sorted(cached['entries'], key=lambda e: (key(e), e['name']))
+        cached['sorted'][sort] = (items, [(key(e), e['name']) for e in items])
+    return cached['sorted'][sort]
+
+def entry_matches(entry, pattern, kind, ext):
+    if pattern and not fnmatch.fnmatch(entry['name'], pattern):
+        return False
+    if kind == 'file' and entry['is_dir'] or kind == 'dir' and not entry['is_dir']:
+        return False
+    if ext and (entry['is_dir'] or not entry['name'].lower().endswith('.' + ext.lower().lstrip('.'))):
+        return False
+    return True
+
 @app.route('/api/files', methods=['GET'])
 def list_files():
+    """列出目录内容
+
+    查询参数：
+        path: 目录路径
+        limit: 每页条数，默认 LIST_PAGE_SIZE
+        cursor: 上一页返回的 next_cursor
+        sort: name / size / modified，默认 name
+        order: asc / desc，默认 asc
+        pattern: 文件名通配符，例如 *.pdf
+        type: file / dir
+        ext: 扩展名
+
+    响应带有 ETag，客户端可以通过 If-None-Match 跳过未变化的列表。
+    """
     path = request.args.get('path', '')
     full_path = os.path.join(app.config['UPLOAD_FOLDER'], path)
     
@@ -41,18 +276,74 @@ def list_files():
     
     if not os.path.isdir(full_path):
         return jsonify({'error': 'Not a directory'}), 400
-    
+
+    sort = request.args.get('sort', 'name')
+    order = request.args.get('order', 'asc')
+    if sort not in SORT_FIELDS or order not in ('asc', 'desc'):
+        return jsonify({'error': 'Invalid sort or order'}), 400
+    limit = request.args.get('limit', app.config['LIST_PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, app.config['LIST_MAX_PAGE_SIZE']))
+    pattern = request.args.get('pattern')
+    kind = request.args.get('type')
+    ext = request.args.get('ext')
+    cursor = request.args.get('cursor')
+
+    cached = scan_directory(full_path)
+    etag = f'W/"{cached["version"]}-{zlib.crc32(request.query_string):x}"'
+    if etag in request.headers.get('If-None-Match', ''):
+        return Response(status=304, headers={'ETag': etag})
+
+    items, keys = sorted_entries(cached, sort)
+    # 游标记录上一页最后一条的排序键，目录在翻页期间发生变化也不会重复或遗漏
+    start_key = None
+    if cursor:
+        try:
+            start_key = tuple(json.loads(base64.urlsafe_b64decode(cursor.encode())))
+        except (ValueError, TypeError):
+            return jsonify({'error': 'Invalid cursor'}), 400
+
+    if order == 'asc':
+        start = bisect.bisect_right(keys, start_key) if start_key else 0
+        indices = range(start, len(items))
+    else:
+        end = bisect.bisect_left(keys, start_key) if start_key else len(items)
+        indices = range(end - 1, -1, -1)
+
     files = []
-    for item in os.listdir(full_path):
-        item_path = os.path.join(full_path, item)
-        file_info = get_file_info(item_path)
-        file_info['name'] = item
-        files.append(file_info)
-    
-    return jsonify({'path': path, 'files': files})
+    last_index = None
+    next_cursor = None
+    for i in indices:
+        if not entry_matches(items[i], pattern, kind, ext):
+            continue
+        if len(files) == limit:
+            last = keys[last_index]
+            next_cursor = base64.urlsafe_b64encode(json.dumps(list(last)).encode()).decode()
+            break
+        files.append(items[i])
+        last_index = i
+
+    response = jsonify({
+        'path': path,
+        'files': files,
+        'total': len(items),
+        'next_cursor': next_cursor
+    })
+    response.headers['ETag'] = etag
+    return response
 
 @app.route('/api/files/content', methods=['GET'])
 def read_file():
+    """读取文件内容
+
+    查询参数：
+        path: 文件路径
+        offset / length: 按字节范围读取
+        start_line / max_lines: 按行读取（start_line 从 0 开始）
+        cursor: 上一次响应返回的 next_cursor，用于继续读取
+        stream: 为 1 时以分块流式响应返回原始文本，不包装 JSON
+
+    单次返回的内容不超过 MAX_READ_BYTES，未读完时响应中带有 next_cursor。
+    """
     path = request.args.get('path', '')
     full_path = os.path.join(app.config['UPLOAD_FOLDER'], path)
     
@@ -61,18 +352,81 @@ def read_file():
     
     if os.path.isdir(full_path):
         return jsonify({'error': 'Cannot read content of a directory'}), 400
-    
+
+    stat = os.stat(full_path)
+    max_bytes = app.config['MAX_READ_BYTES']
+    cursor = request.args.get('cursor')
     try:
-        with open(full_path, 'r') as f:
-            content = f.read()
-        return jsonify({
-            'path': path,
-            'content': content,
-            'info': get_file_info(full_path)
-        })
+        offset = request.args.get('offset', 0, type=int)
+        length = request.args.get('length', type=int)
+        start_line = request.args.get('start_line', type=int)
+        max_lines = request.args.get('max_lines', type=int)
+        line = start_line or 0
+        if cursor:
+            offset, line, mtime_ns = decode_cursor(cursor)
+            if mtime_ns != stat.st_mtime_ns:
+                return jsonify({'error': 'File changed since cursor was issued'}), 409
+    except (ValueError, TypeError):
+        return jsonify({'error': 'Invalid range or cursor'}), 400
+
+    if offset < 0 or (length is not None and length <= 0):
+        return jsonify({'error': 'Invalid range'}), 400
+    offset = min(offset, stat.st_size)
+    end = stat.st_size if length is None else min(stat.st_size, offset + length)
+
+    if request.args.get('stream') == '1':
+        return stream_file_range(full_path, offset, end)
+
+    if start_line is not None or max_lines is not None:
+        # 按行读取：没有 cursor 时先跳过 start_line 之前的行
+        if not cursor and line:
+            with open(full_path, 'rb') as f:
+                for _ in range(line):
+                    if not f.readline():
+                        break
+                offset = f.tell()
+        data, count = read_line_range(full_path, offset, max_lines or 1000, max_bytes)
+        line += count
+        end = stat.st_size
+    else:
+        data = read_byte_range(full_path, offset, min(end - offset, max_bytes))
+
+    try:
+        content = data.decode(app.config['TEXT_ENCODING'])
     except UnicodeDecodeError:
         return jsonify({'error': 'File is not text-based'}), 400
 
+    next_offset = offset + len(data)
+    truncated = next_offset < end
+    return jsonify({
+        'path': path,
+        'content': content,
+        'offset': offset,
+        'next_offset': next_offset,
+        'next_line': line,
+        'truncated': truncated,
+        'next_cursor': encode_cursor(next_offset, line, stat.st_mtime_ns) if truncated else None,
+        'info': get_file_info(full_path)
+    })
+
+def stream_file_range(full_path, start, end):
+    """以分块流式响应返回 [start, end) 字节，不把整个文件读入内存"""
+    chunk_size = app.config['READ_CHUNK_SIZE']
+
+    def generate():
+        with open(full_path, 'rb') as f:
+            f.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                chunk = f.read(min(chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    return Response(stream_with_context(generate()),
+                    content_type=f"text/plain; charset={app.config['TEXT_ENCODING']}")
+
 @app.route('/api/files', methods=['POST'])
 def create_file():
     path = request.form.get('path', '')
@@ -86,6 +440,8 @@ def create_file():
         os.makedirs(os.path.dirname(full_path), exist_ok=True)
         with open(full_path, 'w') as f:
             f.write(content)
+        invalidate_listing(os.path.dirname(full_path))
+        index_path(full_path)
         return jsonify({'message': 'File created successfully', 'path': path})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -101,16 +457,387 @@ def upload_file():
     
     if file and allowed_file(file.filename):
         filename = secure_filename(file.filename)
-        save_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(save_path)
+        # 边写入临时文件边计算 SHA-256，完成后按内容去重
+        temp_path = os.path.join(app.config['UPLOAD_STATE_FOLDER'], f"{uuid.uuid4().hex}.part")
+        hasher = hashlib.sha256()
+        with open(temp_path, 'wb') as f:
+            while True:
+                block = file.stream.read(app.config['READ_CHUNK_SIZE'])
+                if not block:
+                    break
+                hasher.update(block)
+                f.write(block)
+        save_path, deduplicated = finalize_upload(temp_path, filename, hasher.hexdigest())
         return jsonify({
             'message': 'File uploaded successfully',
             'filename': filename,
+            'sha256': hasher.hexdigest(),
+            'deduplicated': deduplicated,
             'info': get_file_info(save_path)
         })
     else:
         return jsonify({'error': 'File type not allowed'}), 400
 
+# ---------------- 分块上传（支持断点续传、SHA-256 校验和按内容去重） ----------------
+#
+# 1. POST /api/files/uploads            表单: filename, size(可选), sha256(可选)
+#    创建上传会话；如果 sha256 已存在于哈希索引中，直接完成（秒传）
+# 2. PUT  /api/files/uploads/<id>       请求体为分块数据，Content-Range: bytes start-end/total
+#    分块必须从已接收的位置开始；重复发送的已接收部分会被跳过
+# 3. GET  /api/files/uploads/<id>       查询已接收的字节数，用于断点续传
+# 4. POST /api/files/uploads/<id>/complete  校验大小和哈希，落盘为正式文件
+
+_upload_hashers = {}  # upload_id -> (hashlib 对象, 已计算的字节数)，进程内缓存
+_upload_lock = threading.Lock()
+_hash_index_lock = threading.Lock()
+
+def upload_state_path(upload_id, suffix):
+    return os.path.join(app.config['UPLOAD_STATE_FOLDER'], f"{upload_id}.{suffix}")
+
+@contextmanager
+def upload_write_lock(upload_id):
+    """独占一个上传会话的写入，得到锁时返回 True，已有请求在写入时返回 False
+
+    使用操作系统的文件锁，多个工作进程之间同样有效；进程退出时锁自动释放
+    """
+    with open(upload_state_path(upload_id, 'lock'), 'a+b') as f:
+        if not try_lock_file(f):
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            unlock_file(f)
+
+def remove_upload(upload_id):
+    for suffix in ('part', 'json', 'lock'):
+        try:
+            os.remove(upload_state_path(upload_id, suffix))
+        except OSError:
+            pass
+
+def write_json_atomic(path, data):
+    temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(temp_path, path)
+
+def load_upload_state(upload_id):
+    if not all(c in '0123456789abcdef' for c in upload_id):
+        return None
+    try:
+        with open(upload_state_path(upload_id, 'json'), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def load_hash_index():
+    try:
+        with open(os.path.join(app.config['UPLOAD_STATE_FOLDER'], 'hash_index.json'), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_hash_index(index):
+    write_json_atomic(os.path.join(app.config['UPLOAD_STATE_FOLDER'], 'hash_index.json'), index)
+
+def file_signature(full_path):
+    """大小、inode 和修改时间；文件被覆盖、原地修改或替换后至少有一项会变化"""
+    st = os.stat(full_path)
+    return {'size': st.st_size, 'inode': st.st_ino, 'mtime_ns': st.st_mtime_ns}
+
+def file_sha256(full_path):
+    hasher = hashlib.sha256()
+    with open(full_path, 'rb') as f:
+        while True:
+            block = f.read(app.config['READ_CHUNK_SIZE'])
+            if not block:
+                break
+            hasher.update(block)
+    return hasher.hexdigest()
+
+def find_by_hash(sha256):
+    """按内容哈希查找已存在的文件
+
+    先比较记录的大小、inode 和修改时间，再重新计算哈希确认内容一致，
+    客户端声明的哈希和过期的索引项都不会把新文件链接到错误的内容上。
+    文件已被删除或修改时移除索引项并返回 None
+    """
+    entry = load_hash_index().get(sha256)
+    if not entry:
+        return None
+    full_path = os.path.join(app.config['UPLOAD_FOLDER'], entry['path'])
+    try:
+        if (os.path.isfile(full_path)
+                and file_signature(full_path) == {k: entry.get(k) for k in ('size', 'inode', 'mtime_ns')}
+                and file_sha256(full_path) == sha256):
+            return full_path
+    except OSError:
+        pass
+    with _hash_index_lock:
+        index = load_hash_index()
+        if index.get(sha256) == entry:
+            del index[sha256]
+            save_hash_index(index)
+    return None
+
+def record_hash(sha256, full_path):
+    with _hash_index_lock:
+        index = load_hash_index()
+        index[sha256] = {
+            'path': os.path.relpath(full_path, app.config['UPLOAD_FOLDER']),
+            **file_signature(full_path)
+        }
+        save_hash_index(index)
+
+def under_path(rel_path, prefix):
+    return rel_path == prefix or rel_path.startswith(prefix + os.sep)
+
+def forget_path(full_path, keep=None):
+    """文件（或目录下的文件）被覆盖、删除时移除指向它的索引项
+
+    Args:
+        keep: 内容不变时保留的哈希（同名文件重新上传相同内容）
+    """
+    prefix = os.path.relpath(full_path, app.config['UPLOAD_FOLDER'])
+    with _hash_index_lock:
+        index = load_hash_index()
+        stale = [h for h, entry in index.items() if h != keep and under_path(entry['path'], prefix)]
+        if stale:
+            for h in stale:
+                del index[h]
+            save_hash_index(index)
+
+def rename_path(full_source, full_target):
+    """文件或目录移动后更新索引项中的路径（重命名不改变 inode 和修改时间）"""
+    source = os.path.relpath(full_source, app.config['UPLOAD_FOLDER'])
+    target = os.path.relpath(full_target, app.config['UPLOAD_FOLDER'])
+    with _hash_index_lock:
+        index = load_hash_index()
+        changed = False
+        for entry in index.values():
+            if under_path(entry['path'], source):
+                entry['path'] = target + entry['path'][len(source):]
+                changed = True
+        if changed:
+            save_hash_index(index)
+
+def link_existing(existing, save_path):
+    """把 save_path 硬链接到内容相同的已有文件，不重复占用磁盘；不支持硬链接时返回 False"""
+    if os.path.abspath(existing) == os.path.abspath(save_path):
+        return True
+    link_path = f"{save_path}.{uuid.uuid4().hex}.tmp"
+    try:
+        os.link(existing, link_path)
+        os.replace(link_path, save_path)
+        return True
+    except OSError:
+        if os.path.exists(link_path):
+            os.remove(link_path)
+        return False
+
+def finalize_upload(temp_path, filename, sha256):
+    """把临时文件落盘为正式文件，内容已存在时改为硬链接
+
+    Returns:
+        (正式文件路径, 是否去重)
+    """
+    save_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    existing = find_by_hash(sha256)
+    forget_path(save_path, keep=sha256)  # 同名文件的旧内容被覆盖
+    if existing and link_existing(existing, save_path):
+        os.remove(temp_path)
+        deduplicated = True
+    else:
+        os.replace(temp_path, save_path)
+        record_hash(sha256, save_path)
+        deduplicated = False
+    invalidate_listing(os.path.dirname(save_path))
+    index_path(save_path)
+    return save_path, deduplicated
+
+def upload_hasher(upload_id, received):
+    """取得与已接收数据一致的哈希对象；会话在其他进程中开始时从临时文件补算"""
+    with _upload_lock:
+        hasher, hashed = _upload_hashers.get(upload_id, (None, 0))
+    if hasher is None or hashed != received:
+        hasher = hashlib.sha256()
+        with open(upload_state_path(upload_id, 'part'), 'rb') as f:
+            remaining = received
+            while remaining > 0:
+                block = f.read(min(app.config['READ_CHUNK_SIZE'], remaining))
+                if not block:
+                    break
+                hasher.update(block)
+                remaining -= len(block)
+    return hasher
+
+def parse_content_range(header):
+    """解析 'bytes start-end/total'，返回 (start, total)；total 为 * 时返回 None"""
+    unit, _, spec = header.partition(' ')
+    if unit != 'bytes':
+        raise ValueError(header)
+    span, _, total = spec.partition('/')
+    start = int(span.split('-')[0])
+    return start, (None if total in ('', '*') else int(total))
+
+@app.route('/api/files/uploads', methods=['POST'])
+def create_upload():
+    filename = request.form.get('filename', '')
+    if not filename or not allowed_file(filename):
+        return jsonify({'error': 'File type not allowed'}), 400
+    filename = secure_filename(filename)
+    size = request.form.get('size', type=int)
+    sha256 = (request.form.get('sha256') or '').lower() or None
+
+    # 秒传：相同内容已经存在
+    if sha256:
+        existing = find_by_hash(sha256)
+        save_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        if existing:
+            forget_path(save_path, keep=sha256)
+        if existing and link_existing(existing, save_path):
+            invalidate_listing(app.config['UPLOAD_FOLDER'])
+            index_path(save_path)
+            return jsonify({
+                'message': 'File uploaded successfully',
+                'filename': filename,
+                'sha256': sha256,
+                'deduplicated': True,
+                'info': get_file_info(save_path)
+            })
+
+    upload_id = uuid.uuid4().hex
+    open(upload_state_path(upload_id, 'part'), 'wb').close()
+    write_json_atomic(upload_state_path(upload_id, 'json'), {
+        'filename': filename,
+        'size': size,
+        'sha256': sha256,
+        'created': datetime.now().isoformat()
+    })
+    return jsonify({
+        'upload_id': upload_id,
+        'received': 0,
+        'chunk_size': app.config['UPLOAD_CHUNK_SIZE']
+    }), 201
+
+@app.route('/api/files/uploads/<upload_id>', methods=['GET'])
+def upload_status(upload_id):
+    state = load_upload_state(upload_id)
+    if state is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    received = os.path.getsize(upload_state_path(upload_id, 'part'))
+    return jsonify({'upload_id': upload_id, 'filename': state['filename'],
+                    'size': state['size'], 'received': received})
+
+@app.route('/api/files/uploads/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    if load_upload_state(upload_id) is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    # 同一会话的重叠请求（例如第一个请求仍在传输时客户端重试）会用相同的 received 重复追加，
+    # 读取已接收大小、追加和更新哈希需要在锁内完成
+    with upload_write_lock(upload_id) as locked:
+        if not locked:
+            return jsonify({'error': 'Another request is writing this upload'}), 409
+        state = load_upload_state(upload_id)  # 获取锁之前可能已完成或取消
+        if state is None:
+            return jsonify({'error': 'Upload not found'}), 404
+        return receive_chunk(upload_id, state)
+
+def receive_chunk(upload_id, state):
+    part_path = upload_state_path(upload_id, 'part')
+    received = os.path.getsize(part_path)
+
+    try:
+        if 'Content-Range' in request.headers:
+            start, total = parse_content_range(request.headers['Content-Range'])
+        else:
+            start, total = request.args.get('offset', received, type=int), None
+    except ValueError:
+        return jsonify({'error': 'Invalid Content-Range'}), 400
+    if total is not None and state['size'] is not None and total != state['size']:
+        return jsonify({'error': 'Size mismatch', 'received': received}), 400
+    if start > received:
+        return jsonify({'error': 'Chunk out of order', 'received': received}), 409
+
+    # 超出声明大小的分块在写入前拒绝
+    size = state['size']
+    if size is not None and request.content_length is not None and start + request.content_length > size:
+        return jsonify({'error': 'Received more data than declared size', 'received': received}), 400
+
+    # 跳过之前已经接收过的部分（客户端重传）
+    skip = received - start
+    original = received
+    hasher = upload_hasher(upload_id, received).copy()
+    oversized = False
+    with open(part_path, 'ab') as f:
+        while True:
+            block = request.stream.read(app.config['READ_CHUNK_SIZE'])
+            if not block:
+                break
+            if skip:
+                dropped = min(skip, len(block))
+                block = block[dropped:]
+                skip -= dropped
+            if block:
+                if size is not None and received + len(block) > size:
+                    oversized = True  # 没有 Content-Length（分块传输编码）时在写入前逐块检查
+                    break
+                hasher.update(block)
+                f.write(block)
+                received += len(block)
+    if oversized:
+        os.truncate(part_path, original)  # 丢弃本次请求已写入的部分，保持与缓存的哈希一致
+        return jsonify({'error': 'Received more data than declared size', 'received': original}), 400
+    with _upload_lock:
+        _upload_hashers[upload_id] = (hasher, received)
+    return jsonify({'upload_id': upload_id, 'received': received})
+
+@app.route('/api/files/uploads/<upload_id>/complete', methods=['POST'])
+def complete_upload(upload_id):
+    if load_upload_state(upload_id) is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    with upload_write_lock(upload_id) as locked:
+        if not locked:
+            return jsonify({'error': 'Another request is writing this upload'}), 409
+        state = load_upload_state(upload_id)
+        if state is None:
+            return jsonify({'error': 'Upload not found'}), 404
+        part_path = upload_state_path(upload_id, 'part')
+        received = os.path.getsize(part_path)
+        if state['size'] is not None and received != state['size']:
+            return jsonify({'error': 'Upload incomplete', 'received': received, 'size': state['size']}), 409
+
+        sha256 = upload_hasher(upload_id, received).hexdigest()
+        if state['sha256'] and state['sha256'] != sha256:
+            return jsonify({'error': 'SHA-256 mismatch', 'expected': state['sha256'], 'actual': sha256}), 400
+
+        save_path, deduplicated = finalize_upload(part_path, state['filename'], sha256)
+        os.remove(upload_state_path(upload_id, 'json'))
+    remove_upload(upload_id)
+    with _upload_lock:
+        _upload_hashers.pop(upload_id, None)
+    return jsonify({
+        'message': 'File uploaded successfully',
+        'filename': state['filename'],
+        'sha256': sha256,
+        'deduplicated': deduplicated,
+        'info': get_file_info(save_path)
+    })
+
+@app.route('/api/files/uploads/<upload_id>', methods=['DELETE'])
+def abort_upload(upload_id):
+    if load_upload_state(upload_id) is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    with upload_write_lock(upload_id) as locked:
+        if not locked:
+            return jsonify({'error': 'Another request is writing this upload'}), 409
+        os.remove(upload_state_path(upload_id, 'json'))  # 之后取得锁的请求会看到会话不存在
+    remove_upload(upload_id)
+    with _upload_lock:
+        _upload_hashers.pop(upload_id, None)
+    return jsonify({'message': 'Upload aborted', 'upload_id': upload_id})
+
 @app.route('/api/files', methods=['DELETE'])
 def delete_file():
     path = request.args.get('path', '')
@@ -124,6 +851,9 @@ def delete_file():
             os.rmdir(full_path)
         else:
             os.remove(full_path)
+        forget_path(full_path)
+        invalidate_listing(os.path.dirname(full_path))
+        index_path(full_path)
         return jsonify({'message': 'Deleted successfully', 'path': path})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -141,6 +871,12 @@ def move_file():
     
     try:
         os.rename(full_source, full_target)
+        forget_path(full_target)  # 目标位置原有的文件被覆盖
+        rename_path(full_source, full_target)
+        invalidate_listing(os.path.dirname(full_source))
+        invalidate_listing(os.path.dirname(full_target))
+        index_path(full_source)
+        index_path(full_target)
         return jsonify({
             'message': 'File moved successfully',
             'source': source,
@@ -160,7 +896,278 @@ def download_file():
     if os.path.isdir(full_path):
         return jsonify({'error': 'Cannot download a directory'}), 400
     
-    return send_file(full_path, as_attachment=True)
+    # conditional=True：支持 Range 分段下载（206）以及 ETag / If-None-Match、If-Modified-Since（304）
+    response = send_file(full_path, as_attachment=True, conditional=True, etag=True, max_age=0)
+    response.headers['Accept-Ranges'] = 'bytes'
+    return response
+
+@app.route('/api/files/search', methods=['GET'])
+def search_files():
+    """搜索文件名和文件内容
+
+    查询参数：
+        q: 查询内容，为空时只按文件名过滤
+        mode: substring（子串，默认）/ terms（关键词，按相关度排序）
+        match: terms 模式下 all（默认，包含全部关键词）/ any
+        name: 文件名通配符，例如 *.txt；包含 / 时匹配相对路径
+        path: 只在该目录下搜索
+        limit: 最多返回的结果数，默认 SEARCH_PAGE_SIZE
+        after: 翻页位置，传入上一页返回的 next_after（terms 模式不支持）
+    """
+    query = request.args.get('q', '')
+    mode = request.args.get('mode', 'substring')
+    match = request.args.get('match', 'all')
+    name = request.args.get('name')
+    if mode not in ('substring', 'terms') or match not in ('all', 'any'):
+        return jsonify({'error': 'Invalid mode or match'}), 400
+    if not query.strip() and not name:
+        return jsonify({'error': 'q or name is required'}), 400
+    after = request.args.get('after')
+    if after is not None and mode == 'terms' and query.strip():
+        return jsonify({'error': 'after is not supported in terms mode'}), 400
+    limit = request.args.get('limit', app.config['SEARCH_PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, app.config['SEARCH_MAX_PAGE_SIZE']))
+
+    start = time.perf_counter()
+    try:
+        results = search_index.search(query, mode=mode, name=name, path=request.args.get('path', ''),
+                                      limit=limit, match_all=match == 'all', after=after)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    for item in results:
+        item['modified'] = datetime.fromtimestamp(item['mtime_ns'] / 1e9).isoformat()
+    return jsonify({
+        'query': query,
+        'mode': mode,
+        'results': results,
+        'count': len(results),
+        # 按路径排序的结果翻页：结果数达到 limit 时可能还有下一页
+        'next_after': results[-1]['path'] if len(results) == limit and (mode != 'terms' or not query.strip()) else None,
+        'took_ms': round((time.perf_counter() - start) * 1000, 2)
+    })
+
+# ---------------- 变更订阅 ----------------
+#
+# 事件格式：{"seq": 12, "type": "created" / "modified" / "deleted", "path": "docs/a.pdf",
+#            "size": 1024, "mtime_ns": ..., "time": ...}
+# 移动 / 重命名表现为原路径 deleted 加新路径 created。
+# 订阅方保存最后处理的 seq，下次从该位置继续；truncated 为 true 说明中间的事件已被清理，需要全量同步一次。
+
+@app.route('/api/files/changes', methods=['GET'])
+def list_changes():
+    """长轮询获取变更事件
+
+    查询参数：
+        since: 上次处理到的 seq，默认 0（从头开始）；-1 表示只要之后的新事件
+        timeout: 没有新事件时最多等待的秒数，默认 0（立即返回）
+        limit: 每次最多返回的事件数
+    """
+    since = request.args.get('since', 0, type=int)
+    if since < 0:
+        since = change_feed.latest()
+    timeout = max(0.0, min(request.args.get('timeout', 0, type=float), app.config['CHANGES_MAX_WAIT']))
+    limit = max(1, min(request.args.get('limit', app.config['CHANGES_PAGE_SIZE'], type=int),
+                       app.config['CHANGES_PAGE_SIZE']))
+    events = change_feed.wait(since, timeout, limit)
+    return jsonify({
+        'events': events,
+        'next_since': events[-1]['seq'] if events else since,
+        'truncated': change_feed.is_truncated(since)
+    })
+
+@app.route('/api/files/changes/stream', methods=['GET'])
+def stream_changes():
+    """以 Server-Sent Events 推送变更事件，断线重连时浏览器会通过 Last-Event-ID 自动续传"""
+    since = request.headers.get('Last-Event-ID', type=int)
+    if since is None:
+        since = request.args.get('since', -1, type=int)
+    if since < 0:
+        since = change_feed.latest()
+
+    def generate(since):
+        if change_feed.is_truncated(since):
+            yield 'event: truncated\ndata: {}\n\n'
+        while True:
+            events = change_feed.wait(since, app.config['CHANGES_HEARTBEAT'], app.config['CHANGES_PAGE_SIZE'])
+            if not events:
+                yield ': heartbeat\n\n'  # 保持连接，并让服务器及时发现断开的客户端
+                continue
+            for event in events:
+                yield change_feed.format_sse(event)
+            since = events[-1]['seq']
+
+    return Response(stream_with_context(generate(since)), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# ---------------- 批量操作 ----------------
+#
+# POST /api/files/batch
+# {
+#   "operations": [
+#     {"op": "list", "path": "docs"},
+#     {"op": "read", "path": "a.txt", "max_lines": 100},
+#     {"op": "create", "path": "b.txt", "content": "..."},
+#     {"op": "delete", "path": "c.txt"},
+#     {"op": "move", "source": "d.txt", "target": "e.txt"},
+#     {"op": "search", "q": "会议", "name": "*.txt"}
+#   ],
+#   "atomic": false
+# }
+#
+# 非原子模式下各操作在线程池中并发执行，互不影响，结果按请求顺序返回；
+# atomic=true 时按顺序执行，任一操作失败则撤销之前已完成的写操作（全部成功或全部不生效）。
+
+# op -> (HTTP 方法, 视图函数, 查询参数字段, 表单字段)
+BATCH_OPERATIONS = {
+    'list': ('GET', list_files, ('path', 'limit', 'cursor', 'sort', 'order', 'pattern', 'type', 'ext'), ()),
+    'read': ('GET', read_file, ('path', 'offset', 'length', 'start_line', 'max_lines', 'cursor'), ()),
+    'create': ('POST', create_file, (), ('path', 'content')),
+    'delete': ('DELETE', delete_file, ('path',), ()),
+    'move': ('POST', move_file, (), ('source', 'target')),
+    'search': ('GET', search_files, ('q', 'mode', 'match', 'name', 'path', 'limit'), ()),
+}
+WRITE_OPERATIONS = {'create', 'delete', 'move'}
+
+_batch_executor = ThreadPoolExecutor(max_workers=app.config['BATCH_MAX_WORKERS'], thread_name_prefix='batch')
+
+def run_operation(operation):
+    """在独立的请求上下文中调用对应的视图函数，与单独请求的行为完全一致"""
+    op = operation.get('op')
+    if op not in BATCH_OPERATIONS:
+        return {'op': op, 'status': 400, 'result': {'error': f'Unsupported operation: {op}'}}
+    method, view, query_fields, form_fields = BATCH_OPERATIONS[op]
+    query = {k: operation[k] for k in query_fields if k in operation}
+    form = {k: operation[k] for k in form_fields if k in operation}
+    with app.test_request_context('/api/files/batch', method=method, query_string=query, data=form):
+        response = app.make_response(view())
+    return {'op': op, 'status': response.status_code, 'result': response.get_json()}
+
+def run_atomic(operations):
+    """按顺序执行，失败时逆序撤销已完成的写操作"""
+    trash = os.path.join(app.config['UPLOAD_STATE_FOLDER'], f"trash_{uuid.uuid4().hex}")
+    undo = []
+    results = []
+    failed = None
+    for i, operation in enumerate(operations):
+        op = operation.get('op')
+        if op == 'delete':
+            # 删除先移入回收目录，提交时才真正删除，便于撤销
+            result = atomic_delete(operation.get('path', ''), trash, undo)
+        elif op == 'move':
+            result = atomic_move(operation.get('source', ''), operation.get('target', ''), trash, undo)
+        else:
+            if op == 'create':
+                created = os.path.join(app.config['UPLOAD_FOLDER'], operation.get('path', ''))
+                new_dirs = missing_dirs(os.path.dirname(created))
+            result = run_operation(operation)
+            if result['status'] < 400 and op == 'create':
+                undo.append(lambda p=created, d=new_dirs: remove_created(p, d))
+        results.append(result)
+        if result['status'] >= 400:
+            failed = i
+            break
+
+    if failed is not None:
+        for action in reversed(undo):
+            try:
+                action()
+            except OSError as e:
+                print(f"撤销批量操作失败: {e}")
+        invalidate_listing(app.config['UPLOAD_FOLDER'])
+        search_index.reconcile()
+    shutil.rmtree(trash, ignore_errors=True)
+    return results, failed
+
+def missing_dirs(directory):
+    """directory 及其上级目录中尚不存在的部分，由深到浅"""
+    missing = []
+    while directory and not os.path.exists(directory):
+        missing.append(directory)
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            break
+        directory = parent
+    return missing
+
+def remove_created(path, new_dirs):
+    """撤销创建：删除文件以及创建时新建的目录（目录中还有其他文件时保留）"""
+    os.remove(path)
+    for directory in new_dirs:
+        try:
+            os.rmdir(directory)
+        except OSError:
+            break
+
+def atomic_move(source, target, trash, undo):
+    """移动文件；目标位置已有文件时先移入回收目录，撤销时移回原位"""
+    full_source = os.path.join(app.config['UPLOAD_FOLDER'], source)
+    full_target = os.path.join(app.config['UPLOAD_FOLDER'], target)
+    operation = {'op': 'move', 'source': source, 'target': target}
+    if not os.path.exists(full_source):
+        return run_operation(operation)
+    backup = None
+    if os.path.isfile(full_target) and os.path.abspath(full_target) != os.path.abspath(full_source):
+        try:
+            os.makedirs(trash, exist_ok=True)
+            backup = os.path.join(trash, uuid.uuid4().hex)
+            os.rename(full_target, backup)
+        except OSError as e:
+            return {'op': 'move', 'status': 500, 'result': {'error': str(e)}}
+        undo.append(lambda b=backup, t=full_target: os.rename(b, t))
+    result = run_operation(operation)
+    if result['status'] < 400:
+        undo.append(lambda s=full_source, t=full_target: os.rename(t, s))
+    return result
+
+def atomic_delete(path, trash, undo):
+    full_path = os.path.join(app.config['UPLOAD_FOLDER'], path)
+    if not os.path.exists(full_path):
+        return {'op': 'delete', 'status': 404, 'result': {'error': 'File not found'}}
+    try:
+        if os.path.isdir(full_path):
+            os.rmdir(full_path)
+            undo.append(lambda p=full_path: os.makedirs(p, exist_ok=True))
+        else:
+            os.makedirs(trash, exist_ok=True)
+            backup = os.path.join(trash, uuid.uuid4().hex)
+            os.rename(full_path, backup)
+            undo.append(lambda b=backup, p=full_path: os.rename(b, p))
+            forget_path(full_path)
+        invalidate_listing(os.path.dirname(full_path))
+        index_path(full_path)
+        return {'op': 'delete', 'status': 200, 'result': {'message': 'Deleted successfully', 'path': path}}
+    except Exception as e:
+        return {'op': 'delete', 'status': 500, 'result': {'error': str(e)}}
+
+@app.route('/api/files/batch', methods=['POST'])
+def batch_operations():
+    payload = request.get_json(silent=True) or {}
+    operations = payload.get('operations')
+    if not isinstance(operations, list) or not operations:
+        return jsonify({'error': 'operations must be a non-empty list'}), 400
+    if len(operations) > app.config['BATCH_MAX_OPERATIONS']:
+        return jsonify({'error': f"Too many operations (max {app.config['BATCH_MAX_OPERATIONS']})"}), 400
+    if not all(isinstance(op, dict) for op in operations):
+        return jsonify({'error': 'Each operation must be an object'}), 400
+
+    if payload.get('atomic'):
+        results, failed = run_atomic(operations)
+        return jsonify({
+            'atomic': True,
+            'ok': failed is None,
+            'failed_index': failed,
+            'rolled_back': failed is not None and any(
+                op.get('op') in WRITE_OPERATIONS for op in operations[:failed]),
+            'results': results
+        }), (200 if failed is None else 409)
+
+    results = list(_batch_executor.map(run_operation, operations))
+    return jsonify({
+        'atomic': False,
+        'ok': all(r['status'] < 400 for r in results),
+        'results': results
+    })
 
 if __name__ == '__main__':
+    start_watcher()
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
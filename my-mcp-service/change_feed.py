@@ -0,0 +1,93 @@
+# 文件变更日志：持久化在 .uploads/changes.db（SQLite），每个事件有单调递增的序号
+#
+# 订阅方记录最后处理的序号，通过长轮询或 SSE 获取之后的事件，服务或订阅方重启后都能从断点继续。
+# 事件来自检索索引（search_index.SearchIndex 的 on_change），因此本服务的写操作和外部修改都会被记录。
+
+import json
+import sqlite3
+import threading
+import time
+
+
+class ChangeFeed:
+    def __init__(self, db_path, max_events=100000):
+        """初始化变更日志
+
+        Args:
+            db_path: SQLite 数据库路径
+            max_events: 最多保留的事件数，超出后删除最旧的事件
+        """
+        self.db_path = db_path
+        self.max_events = max_events
+        self._local = threading.local()
+        self._condition = threading.Condition()
+        self._appended = 0
+        conn = self._connect()
+        with conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS events ('
+                         'seq INTEGER PRIMARY KEY AUTOINCREMENT, type TEXT, path TEXT, '
+                         'size INTEGER, mtime_ns INTEGER, time REAL)')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def append(self, change_type, path, stat=None):
+        """记录一个事件并唤醒等待中的订阅方，可直接作为 SearchIndex 的 on_change 回调"""
+        conn = self._connect()
+        with conn:
+            conn.execute('INSERT INTO events (type, path, size, mtime_ns, time) VALUES (?, ?, ?, ?, ?)',
+                         (change_type, path, stat.st_size if stat else None,
+                          stat.st_mtime_ns if stat else None, time.time()))
+        with self._condition:
+            self._appended += 1
+            prune = self._appended % 1000 == 0
+            self._condition.notify_all()
+        if prune:
+            self.prune()
+
+    def prune(self):
+        conn = self._connect()
+        with conn:
+            conn.execute('DELETE FROM events WHERE seq <= (SELECT max(seq) FROM events) - ?', (self.max_events,))
+
+    def latest(self):
+        return self._connect().execute('SELECT coalesce(max(seq), 0) FROM events').fetchone()[0]
+
+    def oldest(self):
+        return self._connect().execute('SELECT coalesce(min(seq), 0) FROM events').fetchone()[0]
+
+    def read(self, since, limit=500):
+        """返回序号大于 since 的事件"""
+        rows = self._connect().execute(
+            'SELECT seq, type, path, size, mtime_ns, time FROM events WHERE seq > ? ORDER BY seq LIMIT ?',
+            (since, limit))
+        return [{'seq': seq, 'type': change_type, 'path': path, 'size': size, 'mtime_ns': mtime_ns, 'time': t}
+                for seq, change_type, path, size, mtime_ns, t in rows]
+
+    def wait(self, since, timeout, limit=500):
+        """长轮询：有新事件时立即返回，否则最多等待 timeout 秒
+
+        同一进程内的写入会立即唤醒；其他 worker 进程写入的事件按 1 秒间隔检查。
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            events = self.read(since, limit)
+            remaining = deadline - time.monotonic()
+            if events or remaining <= 0:
+                return events
+            with self._condition:
+                self._condition.wait(min(1.0, remaining))
+
+    def is_truncated(self, since):
+        """since 之后的部分事件是否已被清理（订阅方落后太多，需要全量同步一次）"""
+        return self.oldest() > since + 1
+
+    @staticmethod
+    def format_sse(event):
+        return f"id: {event['seq']}\nevent: change\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
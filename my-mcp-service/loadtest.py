@@ -0,0 +1,104 @@
+# 文件服务压测脚本：并发执行 list / read / create，统计吞吐（req/s）和尾延迟
+#
+# 用法：
+#   python loadtest.py --url http://localhost:5000 --concurrency 32 --duration 20
+#   python loadtest.py --scenario read --concurrency 64
+
+import argparse
+import random
+import threading
+import time
+import uuid
+
+import requests
+
+SCENARIOS = ('list', 'read', 'create')
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def prepare(base_url, prefix, count=20):
+    """准备被读取的测试文件"""
+    session = requests.Session()
+    paths = []
+    for i in range(count):
+        path = f"{prefix}/read_{i}.txt"
+        session.post(f"{base_url}/api/files", data={'path': path, 'content': f"line {i}\n" * 200})
+        paths.append(path)
+    return paths
+
+
+def worker(base_url, scenarios, prefix, read_paths, deadline, results, lock):
+    session = requests.Session()  # 每个线程一个长连接会话
+    local = {name: [] for name in SCENARIOS}
+    errors = 0
+    while time.monotonic() < deadline:
+        scenario = random.choice(scenarios)
+        start = time.perf_counter()
+        try:
+            if scenario == 'list':
+                response = session.get(f"{base_url}/api/files", params={'path': prefix})
+            elif scenario == 'read':
+                response = session.get(f"{base_url}/api/files/content", params={'path': random.choice(read_paths)})
+            else:
+                response = session.post(f"{base_url}/api/files",
+                                        data={'path': f"{prefix}/new_{uuid.uuid4().hex}.txt", 'content': 'hello'})
+            ok = response.status_code < 400
+        except requests.exceptions.RequestException:
+            ok = False
+        elapsed = (time.perf_counter() - start) * 1000
+        if ok:
+            local[scenario].append(elapsed)
+        else:
+            errors += 1
+    with lock:
+        for name, values in local.items():
+            results[name].extend(values)
+        results['errors'] += errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description='MCP 文件服务压测')
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10, help='压测时长（秒）')
+    parser.add_argument('--scenario', choices=SCENARIOS + ('mixed',), default='mixed')
+    args = parser.parse_args()
+
+    prefix = f"loadtest_{uuid.uuid4().hex[:8]}"
+    read_paths = prepare(args.url, prefix)
+    scenarios = SCENARIOS if args.scenario == 'mixed' else (args.scenario,)
+
+    results = {name: [] for name in SCENARIOS}
+    results['errors'] = 0
+    lock = threading.Lock()
+    deadline = time.monotonic() + args.duration
+    threads = [threading.Thread(target=worker,
+                                args=(args.url, scenarios, prefix, read_paths, deadline, results, lock))
+               for _ in range(args.concurrency)]
+    start = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.monotonic() - start
+
+    print(f"并发: {args.concurrency}，时长: {wall:.1f}s，失败: {results['errors']}")
+    print(f"{'操作':<8}{'请求数':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    total = 0
+    for name in scenarios:
+        values = sorted(results[name])
+        total += len(values)
+        print(f"{name:<8}{len(values):>8}{len(values) / wall:>10.1f}{percentile(values, 50):>10.1f}"
+              f"{percentile(values, 95):>10.1f}{percentile(values, 99):>10.1f}{(values[-1] if values else 0):>10.1f}")
+    print(f"总吞吐: {total / wall:.1f} req/s")
+    print(f"测试文件位于目录 {prefix}，可手动删除")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,372 @@
+# 文件服务的全文检索索引（SQLite FTS5），持久化在上传目录的 .uploads/search_index.db 中
+#
+# - files 表记录所有文件的路径、文件名、mtime 和大小，用于文件名通配符查询和增量更新判断
+# - content 表（trigram 分词）保存文本文件内容，用于子串查询，中文、英文都适用
+# - terms 表（unicode61 分词）保存预处理后的词：英文按单词、中文按二元组切分，用于按 BM25 排序的关键词查询
+#
+# 服务自己的写操作调用 refresh() 同步更新索引；外部对目录的修改由文件系统事件（安装了 watchdog 时）
+# 或定期的 reconcile() 扫描发现，只重新索引 mtime / 大小变化的文件。
+# 索引发现的每个变化都会通过 on_change 回调通知出去（变更订阅基于此实现）。
+
+import fnmatch
+import os
+import re
+import sqlite3
+import threading
+import time
+
+TEXT_EXTENSIONS = {'txt', 'json', 'md', 'csv', 'log', 'xml', 'html', 'htm', 'yaml', 'yml',
+                   'ini', 'cfg', 'py', 'js', 'ts', 'java', 'c', 'cpp', 'h', 'sql', 'sh', 'bat'}
+TEXT_ENCODINGS = ('utf-8', 'gb18030')
+MAX_INDEX_BYTES = 2 * 1024 * 1024  # 超过该大小的文件只索引文件名
+SNIPPET_CHARS = 80
+
+_WORD_RE = re.compile(r'[0-9a-z_]+|[㐀-鿿豈-﫿]+')
+_CJK_RE = re.compile(r'[㐀-鿿豈-﫿]')
+
+
+def tokenize_terms(text):
+    """英文、数字按单词切分，中文按相邻二字切分（单个汉字保留为一个词）"""
+    tokens = []
+    for word in _WORD_RE.findall(text.lower()):
+        if _CJK_RE.match(word) and len(word) > 1:
+            tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+        else:
+            tokens.append(word)
+    return tokens
+
+
+def quote_phrase(text):
+    return '"' + text.replace('"', '""') + '"'
+
+
+def make_snippet(body, needles, width=SNIPPET_CHARS):
+    """截取第一个命中位置附近的文本"""
+    lowered = body.lower()
+    positions = [p for p in (lowered.find(n.lower()) for n in needles if n) if p >= 0]
+    if not positions:
+        return body[:width].strip()
+    start = max(0, min(positions) - width // 4)
+    snippet = body[start:start + width].replace('\n', ' ').strip()
+    return ('...' if start else '') + snippet + ('...' if start + width < len(body) else '')
+
+
+def read_text(full_path):
+    with open(full_path, 'rb') as f:
+        data = f.read(MAX_INDEX_BYTES + 1)
+    if len(data) > MAX_INDEX_BYTES or b'\x00' in data[:8192]:
+        return None
+    for encoding in TEXT_ENCODINGS:
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return None
+
+
+class SearchIndex:
+    def __init__(self, root, db_path, exclude=(), on_change=None):
+        """初始化检索索引
+
+        Args:
+            root: 被索引的根目录
+            db_path: SQLite 数据库路径
+            exclude: 不索引的目录名（例如 .uploads）
+            on_change: 文件变化回调 (type, path, stat)，type 为 created / modified / deleted
+        """
+        self.root = os.path.abspath(root)
+        self.db_path = db_path
+        self.exclude = set(exclude)
+        self.on_change = on_change
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._watcher = None
+        self.last_reconcile = None
+        self.trigram = self._create_schema()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.create_function('fnmatch', 2, lambda name, pattern: fnmatch.fnmatch(name, pattern),
+                                 deterministic=True)
+            self._local.conn = conn
+        return conn
+
+    def _create_schema(self):
+        conn = self._connect()
+        with conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS files ('
+                         'id INTEGER PRIMARY KEY, path TEXT UNIQUE, name TEXT, '
+                         'mtime_ns INTEGER, size INTEGER, indexed INTEGER)')
+            conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS terms USING fts5(body, tokenize='unicode61')")
+            try:
+                conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS content USING fts5(body, tokenize='trigram')")
+            except sqlite3.OperationalError:
+                # SQLite 3.34 以下不支持 trigram，子串查询退化为逐行扫描
+                conn.execute('CREATE VIRTUAL TABLE IF NOT EXISTS content USING fts5(body)')
+                return False
+        sql = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'content'").fetchone()[0]
+        return 'trigram' in sql
+
+    def relpath(self, full_path):
+        return os.path.relpath(os.path.abspath(full_path), self.root).replace(os.sep, '/')
+
+    def _excluded(self, rel):
+        return any(part in self.exclude for part in rel.split('/'))
+
+    # ---------------- 索引更新 ----------------
+
+    def refresh(self, full_path):
+        """路径发生变化后调用：文件重新索引，目录递归对比，不存在则从索引中删除"""
+        rel = self.relpath(full_path)
+        if rel.startswith('..') or self._excluded(rel):
+            return
+        if os.path.isfile(full_path):
+            self._update(rel, full_path, os.stat(full_path))
+        elif os.path.isdir(full_path):
+            self.reconcile(full_path)
+        else:
+            self._remove_prefix(rel)
+
+    def _update(self, rel, full_path, stat):
+        conn = self._connect()
+        row = conn.execute('SELECT mtime_ns, size FROM files WHERE path = ?', (rel,)).fetchone()
+        if row and row == (stat.st_mtime_ns, stat.st_size):
+            return  # 未变化（例如 watchdog 的重复事件）
+        ext = rel.rsplit('.', 1)[-1].lower() if '.' in rel.rsplit('/', 1)[-1] else ''
+        body = None
+        if ext in TEXT_EXTENSIONS:
+            try:
+                body = read_text(full_path)
+            except OSError:
+                return
+        with self._write_lock, conn:
+            row = conn.execute('SELECT id FROM files WHERE path = ?', (rel,)).fetchone()
+            if row:
+                file_id = row[0]
+                conn.execute('UPDATE files SET mtime_ns = ?, size = ?, indexed = ? WHERE id = ?',
+                             (stat.st_mtime_ns, stat.st_size, body is not None, file_id))
+                conn.execute('DELETE FROM content WHERE rowid = ?', (file_id,))
+                conn.execute('DELETE FROM terms WHERE rowid = ?', (file_id,))
+            else:
+                file_id = conn.execute(
+                    'INSERT INTO files (path, name, mtime_ns, size, indexed) VALUES (?, ?, ?, ?, ?)',
+                    (rel, rel.rsplit('/', 1)[-1], stat.st_mtime_ns, stat.st_size, body is not None)).lastrowid
+            if body is not None:
+                conn.execute('INSERT INTO content (rowid, body) VALUES (?, ?)', (file_id, body))
+                conn.execute('INSERT INTO terms (rowid, body) VALUES (?, ?)',
+                             (file_id, ' '.join(tokenize_terms(body))))
+        self._notify('modified' if row else 'created', rel, stat)
+
+    def _notify(self, change_type, rel, stat=None):
+        if self.on_change is None:
+            return
+        try:
+            self.on_change(change_type, rel, stat)
+        except Exception as e:
+            print(f"文件变化通知失败: {rel}: {e}")
+
+    def _remove(self, rows):
+        """rows: [(id, path)]"""
+        if not rows:
+            return
+        conn = self._connect()
+        with self._write_lock, conn:
+            for file_id, _ in rows:
+                conn.execute('DELETE FROM content WHERE rowid = ?', (file_id,))
+                conn.execute('DELETE FROM terms WHERE rowid = ?', (file_id,))
+                conn.execute('DELETE FROM files WHERE id = ?', (file_id,))
+        for _, rel in rows:
+            self._notify('deleted', rel)
+
+    def _remove_prefix(self, rel):
+        rows = self._connect().execute(
+            "SELECT id, path FROM files WHERE path = ? OR substr(path, 1, ?) = ?",
+            (rel, len(rel) + 1, rel + '/')).fetchall()
+        self._remove(rows)
+
+    def reconcile(self, full_path=None):
+        """扫描目录并与索引对比：新增或 mtime / 大小变化的文件重新索引，已删除的文件移出索引
+
+        Returns:
+            (更新的文件数, 删除的文件数)
+        """
+        start_dir = os.path.abspath(full_path or self.root)
+        prefix = '' if start_dir == self.root else self.relpath(start_dir) + '/'
+        conn = self._connect()
+        known = {path: (file_id, mtime_ns, size) for file_id, path, mtime_ns, size in conn.execute(
+            'SELECT id, path, mtime_ns, size FROM files WHERE substr(path, 1, ?) = ?', (len(prefix), prefix))}
+
+        updated = 0
+        stack = [start_dir]
+        while stack:
+            current = stack.pop()
+            try:
+                with os.scandir(current) as it:
+                    entries = list(it)
+            except OSError:
+                continue
+            for entry in entries:
+                if entry.name in self.exclude:
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                        continue
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                rel = self.relpath(entry.path)
+                old = known.pop(rel, None)
+                if old is None or old[1] != stat.st_mtime_ns or old[2] != stat.st_size:
+                    self._update(rel, entry.path, stat)
+                    updated += 1
+
+        self._remove([(v[0], rel) for rel, v in known.items()])
+        self.last_reconcile = time.time()
+        return updated, len(known)
+
+    # ---------------- 外部修改的监听 ----------------
+
+    def start_watching(self, interval=30):
+        """后台监听目录变化：优先使用 watchdog 的文件系统事件，否则每 interval 秒执行一次 reconcile
+
+        启动时会先在后台执行一次完整的 reconcile，补上服务停止期间发生的修改。
+        """
+        if self._watcher is not None:
+            return
+        try:
+            from watchdog.observers import Observer
+            from watchdog.events import FileSystemEventHandler
+        except ImportError:
+            Observer = None
+
+        index = self
+
+        if Observer is not None:
+            class Handler(FileSystemEventHandler):
+                def on_any_event(self, event):
+                    for path in (event.src_path, getattr(event, 'dest_path', None)):
+                        if path:
+                            try:
+                                index.refresh(path)
+                            except (OSError, sqlite3.Error) as e:
+                                print(f"更新检索索引失败: {path}: {e}")
+
+            observer = Observer()
+            observer.schedule(Handler(), self.root, recursive=True)
+            observer.daemon = True
+            observer.start()
+            self._watcher = observer
+
+        def loop():
+            # 有文件系统事件时 reconcile 只作为兜底，间隔放大
+            wait = interval if Observer is None else interval * 10
+            while True:
+                try:
+                    self.reconcile()
+                except (OSError, sqlite3.Error) as e:
+                    print(f"检索索引扫描失败: {e}")
+                if self._stop_event.wait(wait):
+                    break
+
+        thread = threading.Thread(target=loop, name='search-index', daemon=True)
+        thread.start()
+        if self._watcher is None:
+            self._watcher = thread
+
+    def stop_watching(self):
+        self._stop_event.set()
+        if hasattr(self._watcher, 'stop'):
+            self._watcher.stop()
+
+    # ---------------- 查询 ----------------
+
+    def search(self, query='', mode='substring', name=None, path='', limit=50, match_all=True, after=None):
+        """搜索文件
+
+        Args:
+            query: 查询内容，为空时只按文件名过滤
+            mode: substring（子串，不区分大小写）或 terms（关键词，按 BM25 排序）
+            name: 文件名通配符，例如 *.txt；包含 / 时匹配相对路径
+            path: 只在该目录下搜索
+            limit: 最多返回的结果数
+            match_all: terms 模式下是否要求包含全部关键词
+            after: 只返回路径大于该值的结果（按路径排序时翻页用，翻页期间文件增删不会导致遗漏）
+
+        Returns:
+            结果列表，每项包含 path / name / size / score / snippet
+        """
+        conditions = []
+        params = []
+        prefix = path.strip('/').replace('\\', '/')
+        if prefix:
+            conditions.append('substr(f.path, 1, ?) = ?')
+            params += [len(prefix) + 1, prefix + '/']
+        if name:
+            conditions.append('fnmatch(f.path, ?)' if '/' in name else 'fnmatch(f.name, ?)')
+            params.append(name)
+
+        query = query.strip()
+        needles = []
+        if not query:
+            sql = 'SELECT f.path, f.name, f.size, f.mtime_ns, 0, NULL FROM files f'
+            order = 'f.path'
+        elif mode == 'terms':
+            words = query.split()
+            phrases = [' '.join(tokenize_terms(w)) for w in words]
+            phrases = [quote_phrase(p) for p in phrases if p]
+            if not phrases:
+                return []
+            needles = words
+            sql = ('SELECT f.path, f.name, f.size, f.mtime_ns, bm25(terms), c.body '
+                   'FROM terms JOIN files f ON f.id = terms.rowid JOIN content c ON c.rowid = f.id')
+            conditions.insert(0, 'terms MATCH ?')
+            params.insert(0, (' AND ' if match_all else ' OR ').join(phrases))
+            order = 'bm25(terms)'
+        else:
+            needles = [query]
+            sql = ('SELECT f.path, f.name, f.size, f.mtime_ns, 0, content.body '
+                   'FROM content JOIN files f ON f.id = content.rowid')
+            if self.trigram and len(query) >= 3:
+                # trigram 分词下短语查询就是不区分大小写的子串匹配，可以走索引
+                conditions.insert(0, 'content MATCH ?')
+                params.insert(0, quote_phrase(query))
+            else:
+                # 少于 3 个字符无法使用 trigram 索引，逐行查找
+                conditions.insert(0, 'instr(lower(content.body), ?) > 0')
+                params.insert(0, query.lower())
+            order = 'f.path'
+
+        if after is not None:
+            if order != 'f.path':
+                raise ValueError('after is only supported for results ordered by path')
+            conditions.append('f.path > ?')
+            params.append(after)
+
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += f' ORDER BY {order} LIMIT ?'
+        params.append(limit)
+
+        results = []
+        for rel, file_name, size, mtime_ns, score, body in self._connect().execute(sql, params):
+            results.append({
+                'path': rel,
+                'name': file_name,
+                'size': size,
+                'mtime_ns': mtime_ns,
+                # bm25() 越小越相关，取反后分数越大越相关
+                'score': round(-score, 4) if score else 0,
+                'snippet': make_snippet(body, needles) if body is not None and needles else None,
+            })
+        return results
+
+    def stats(self):
+        conn = self._connect()
+        files, indexed = conn.execute('SELECT count(*), coalesce(sum(indexed), 0) FROM files').fetchone()
+        return {'files': files, 'indexed': indexed, 'trigram': self.trigram, 'last_reconcile': self.last_reconcile}
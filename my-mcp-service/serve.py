@@ -0,0 +1,235 @@
+# 文件服务的生产部署入口，替代 app.run(debug=True) 的开发服务器
+#
+# 依赖：pip install -r requirements.txt（waitress / gunicorn / uvicorn + asgiref）
+#
+# 用法：
+#   python serve.py                      # waitress，多线程（Windows / Linux 均可）
+#   python serve.py --mode gunicorn      # gunicorn 多进程 + 线程（仅 Linux / macOS）
+#   python serve.py --mode asgi          # uvicorn + asgiref，WSGI 调用在线程池中执行
+#
+# 所有参数都可以通过环境变量配置（MCP_HOST、MCP_PORT、MCP_WORKERS、MCP_THREADS、
+# MCP_MAX_CONCURRENT、MCP_QUEUE_TIMEOUT、MCP_GRACEFUL_TIMEOUT）。
+
+import argparse
+import logging
+import os
+import signal
+import threading
+import time
+
+from app import app, start_watcher
+
+DEFAULT_HOST = os.environ.get('MCP_HOST', '0.0.0.0')
+DEFAULT_PORT = int(os.environ.get('MCP_PORT', '5000'))
+DEFAULT_WORKERS = int(os.environ.get('MCP_WORKERS', str(min(4, os.cpu_count() or 1))))
+DEFAULT_THREADS = int(os.environ.get('MCP_THREADS', '16'))
+DEFAULT_MAX_CONCURRENT = int(os.environ.get('MCP_MAX_CONCURRENT', '64'))
+DEFAULT_QUEUE_TIMEOUT = float(os.environ.get('MCP_QUEUE_TIMEOUT', '2'))
+DEFAULT_GRACEFUL_TIMEOUT = float(os.environ.get('MCP_GRACEFUL_TIMEOUT', '30'))
+
+
+class ConcurrencyLimit:
+    """WSGI 中间件：限制同时处理的请求数，排队超时后返回 503，避免过载时无限堆积
+
+    停止时调用 drain()：之后到达的请求直接返回 503，wait_idle() 等待在途请求处理完。
+    """
+
+    def __init__(self, wsgi_app, max_concurrent=DEFAULT_MAX_CONCURRENT, queue_timeout=DEFAULT_QUEUE_TIMEOUT):
+        self.wsgi_app = wsgi_app
+        self.queue_timeout = queue_timeout
+        self._semaphore = threading.BoundedSemaphore(max_concurrent)
+        self._idle = threading.Condition()
+        self.in_flight = 0
+        self.draining = False
+
+    def __call__(self, environ, start_response):
+        if self.draining:
+            return self._unavailable(start_response, b'{"error": "Server is shutting down"}')
+        if not self._semaphore.acquire(timeout=self.queue_timeout):
+            return self._unavailable(start_response, b'{"error": "Server busy, please retry"}')
+        with self._idle:
+            self.in_flight += 1
+        try:
+            result = self.wsgi_app(environ, start_response)
+        except BaseException:
+            self._release()
+            raise
+        return _ReleaseOnClose(result, self._release)
+
+    @staticmethod
+    def _unavailable(start_response, body):
+        start_response('503 Service Unavailable', [
+            ('Content-Type', 'application/json'),
+            ('Content-Length', str(len(body))),
+            ('Retry-After', '1'),
+        ])
+        return [body]
+
+    def _release(self):
+        self._semaphore.release()
+        with self._idle:
+            self.in_flight -= 1
+            self._idle.notify_all()
+
+    def drain(self):
+        self.draining = True
+
+    def wait_idle(self, timeout):
+        """等待在途请求全部完成，超时返回 False"""
+        with self._idle:
+            return self._idle.wait_for(lambda: self.in_flight == 0, timeout)
+
+
+class _ReleaseOnClose:
+    """响应体（包括流式响应）发送完毕后才归还并发名额"""
+
+    def __init__(self, result, release):
+        self.result = result
+        self.release = release
+
+    def __iter__(self):
+        return iter(self.result)
+
+    def close(self):
+        try:
+            if hasattr(self.result, 'close'):
+                self.result.close()
+        finally:
+            self.release()
+
+
+def build_application(max_concurrent=DEFAULT_MAX_CONCURRENT, queue_timeout=DEFAULT_QUEUE_TIMEOUT):
+    return ConcurrencyLimit(app, max_concurrent, queue_timeout)
+
+
+# 供 gunicorn / uvicorn 通过 "serve:application" / "serve:asgi_application" 加载；
+# 直接加载 serve:application 时需在 worker 启动后调用 app.start_watcher()（例如 gunicorn 的 post_worker_init）
+application = build_application()
+
+
+def asgi_application():
+    """ASGI 版本：asgiref 在线程池中执行 WSGI 应用，事件循环不会被文件 I/O 阻塞"""
+    from asgiref.wsgi import WsgiToAsgi
+    start_watcher()  # 每个 uvicorn worker 都会调用，只有取得文件锁的进程实际监听
+    return WsgiToAsgi(application)
+
+
+def serve_waitress(args):
+    try:
+        from waitress import create_server
+    except ImportError:
+        print("未安装 waitress，请先执行: pip install -r requirements.txt")
+        raise
+
+    limiter = build_application(args.max_concurrent, args.queue_timeout)
+    server = create_server(
+        limiter,
+        host=args.host,
+        port=args.port,
+        threads=args.threads,
+        connection_limit=args.max_concurrent * 2,
+        channel_timeout=120,
+    )
+
+    # 排队由 ConcurrencyLimit 控制，不再逐条打印 waitress 的队列深度警告
+    logging.getLogger('waitress.queue').setLevel(logging.ERROR)
+
+    start_watcher()
+    stopping = threading.Event()
+
+    def request_stop(signum, frame):
+        stopping.set()
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    # 事件循环在后台线程运行，主线程等待停止信号
+    loop = threading.Thread(target=server.run, name='waitress', daemon=True)
+    loop.start()
+    print(f"waitress 已启动: http://{args.host}:{args.port} (threads={args.threads}, "
+          f"max_concurrent={args.max_concurrent})")
+    while not stopping.wait(1):
+        pass
+
+    # 优雅退出：新请求返回 503，等待在途请求处理完，再关闭监听端口
+    print("正在停止，等待在途请求完成...")
+    deadline = time.monotonic() + args.graceful_timeout
+    limiter.drain()
+    if not limiter.wait_idle(args.graceful_timeout):
+        print(f"仍有 {limiter.in_flight} 个请求未完成，强制停止")
+    server.close()
+    # 留出时间把已生成的响应从发送缓冲区写出
+    time.sleep(max(0.0, min(1.0, deadline - time.monotonic())))
+    print("已停止")
+
+
+def serve_gunicorn(args):
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        print("未安装 gunicorn（仅支持 Linux / macOS），请先执行: pip install -r requirements.txt")
+        raise
+
+    class StandaloneApplication(BaseApplication):
+        def load_config(self):
+            # SIGTERM 时 gunicorn 停止接受连接，并给 worker graceful_timeout 秒处理完在途请求
+            self.cfg.set('bind', f"{args.host}:{args.port}")
+            self.cfg.set('workers', args.workers)
+            self.cfg.set('worker_class', 'gthread')
+            self.cfg.set('threads', args.threads)
+            self.cfg.set('graceful_timeout', args.graceful_timeout)
+            self.cfg.set('timeout', 120)
+            self.cfg.set('max_requests', 10000)
+            self.cfg.set('max_requests_jitter', 1000)
+
+        def load(self):
+            # 每个 worker 进程各自限制并发；外部修改的监听只由取得文件锁的一个 worker 负责
+            start_watcher()
+            return build_application(args.max_concurrent, args.queue_timeout)
+
+    StandaloneApplication().run()
+
+
+def serve_asgi(args):
+    try:
+        import uvicorn
+    except ImportError:
+        print("未安装 uvicorn / asgiref，请先执行: pip install -r requirements.txt")
+        raise
+
+    uvicorn.run(
+        "serve:asgi_application",
+        factory=True,
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        limit_concurrency=args.max_concurrent,
+        timeout_graceful_shutdown=int(args.graceful_timeout),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='MCP 文件服务生产部署')
+    parser.add_argument('--mode', choices=['waitress', 'gunicorn', 'asgi'], default='waitress')
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='进程数（gunicorn / asgi 模式）')
+    parser.add_argument('--threads', type=int, default=DEFAULT_THREADS, help='每个进程的线程数')
+    parser.add_argument('--max-concurrent', type=int, default=DEFAULT_MAX_CONCURRENT,
+                        help='每个进程同时处理的最大请求数')
+    parser.add_argument('--queue-timeout', type=float, default=DEFAULT_QUEUE_TIMEOUT,
+                        help='请求排队的最长时间（秒），超时返回 503')
+    parser.add_argument('--graceful-timeout', type=float, default=DEFAULT_GRACEFUL_TIMEOUT,
+                        help='停止时等待在途请求完成的最长时间（秒）')
+    args = parser.parse_args()
+
+    if args.mode == 'gunicorn':
+        serve_gunicorn(args)
+    elif args.mode == 'asgi':
+        serve_asgi(args)
+    else:
+        serve_waitress(args)
+
+
+if __name__ == '__main__':
+    main()